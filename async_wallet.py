@@ -0,0 +1,184 @@
+"""Loads wallets with many WalletExplorer.com and bitcoind requests in flight.
+
+`Wallet` downloads its pages of transactions and decodes each transaction one
+request at a time, so most of its time is spent waiting on the network.
+`AsyncWallet` issues those requests concurrently, with the number in flight
+bounded by the size of a shared request pool, and then replays the wallet
+exactly as `Wallet` does from the now warm caches.
+
+This code base targets Python 2.7, which has no `asyncio`, so requests are
+issued from a pool of worker threads, which share a pool of bitcoind RPC
+connections of the same size.
+"""
+import threading
+from multiprocessing.pool import ThreadPool
+
+import http #http.py
+import bitcoind_rpc #bitcoind_rpc.py
+from wallet import Wallet, CHECKPOINT_INTERVAL #wallet.py
+
+ENABLE_DEBUG_PRINT = False
+
+#Maximum number of HTTP and RPC requests in flight at once
+MAX_CONCURRENT_REQUESTS = 32
+
+#Maximum number of wallets loaded at once by `load_wallets`
+MAX_CONCURRENT_WALLETS = 8
+
+_RPC_POOL = None
+_RPC_POOL_LOCK = threading.Lock()
+
+def get_rpc_pool():
+    """Returns the RPC connection pool shared by all worker threads.
+
+    The pool is created by the first thread to ask for it. Other threads
+    asking at the same time wait for it rather than creating pools of their
+    own.
+    """
+    global _RPC_POOL
+    if _RPC_POOL is None:
+        with _RPC_POOL_LOCK:
+            if _RPC_POOL is None:
+                _RPC_POOL = bitcoind_rpc.RPCConnectionPool(
+                    size=MAX_CONCURRENT_REQUESTS)
+    return _RPC_POOL
+
+def _decode_tx(rpc_pool, txid):
+    """Decode a transaction into the shared cache from a worker thread.
+
+    The pool from `get_rpc_pool` is used if `rpc_pool` is None.
+    """
+    try:
+        if rpc_pool is None:
+            rpc_pool = get_rpc_pool()
+        return rpc_pool.get_decoded_tx(txid)
+    except Exception as err:
+        #leave it to the replay to fetch, and report, this transaction
+        dprint("Failed to prefetch tx %s: %s" % (txid, str(err)))
+        return None
+
+class AsyncWallet(Wallet):
+    """A `Wallet` whose network requests are made concurrently.
+
+    Pages of the wallet's transactions are downloaded in parallel, and then
+    every transaction in the wallet, along with every transaction whose
+    outputs it spends, is decoded in parallel into the shared decoded tx
+    cache. The UTXO snapshots produced are identical to those of `Wallet`.
+
+    Prefetched transactions are only useful while they remain in
+    `bitcoind_rpc.DECODED_TX_CACHE`, so its size should exceed that of the
+    wallets being loaded at once.
+
+    Args:
+        wallet_label (str): The name of the wallet you're iterating through.
+        iterate_until_send (Optional[bool]): As for `Wallet`.
+        max_txs_download (Optional[int]): As for `Wallet`.
+        checkpoint_interval (Optional[int]): As for `Wallet`.
+        conn (Optional[`RPCConnection`]): As for `Wallet`.
+        pool (Optional[`ThreadPool`]): Pool that requests are issued from. A
+            pool of `MAX_CONCURRENT_REQUESTS` threads is created if omitted.
+        rpc_pool (Optional[`RPCConnectionPool`]): Connections that
+            transactions are decoded on. The pool shared by the process,
+            from `get_rpc_pool`, is used if omitted.
+
+    Raises:
+        http.WalletNotFoundError: Raised if not found at walletexplorer.com API.
+        http.MaxTransactionsExceededError: Raised if the number of transactions
+            in the wallet exceeds the specified `max_txs_download` param.
+    """
+    def __init__(self, wallet_label, iterate_until_send=False,
+                 max_txs_download=None, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 conn=None, pool=None, rpc_pool=None):
+        self.pool = pool
+        if pool is None:
+            self.pool = ThreadPool(MAX_CONCURRENT_REQUESTS)
+        self.rpc_pool = rpc_pool
+        try:
+            super(AsyncWallet, self).__init__(
+                wallet_label, iterate_until_send=iterate_until_send,
+                max_txs_download=max_txs_download,
+                checkpoint_interval=checkpoint_interval, conn=conn)
+            self.prefetch_decoded_txs()
+        finally:
+            if pool is None:
+                self.pool.terminate()
+            self.pool = None
+
+    def fetch_txs(self, max_txs_download):
+        """Download all pages of the wallet's transactions concurrently."""
+        num_txs = http.get_num_txs(self.wallet_label)
+        if max_txs_download is not None and num_txs > max_txs_download:
+            raise http.MaxTransactionsExceededError
+        offsets = range(0, num_txs, http.NUM_TX_PER_FETCH)
+        pages = self.pool.map(
+            lambda offset: http.get_wallet_txs_page(self.wallet_label, offset),
+            offsets)
+        txs = []
+        for page in pages:
+            txs.extend(page)
+        txs.reverse()
+        return txs
+
+    def prefetch_decoded_txs(self):
+        """Decode this wallet's txs and the txs they spend from concurrently.
+
+        The decoded transactions land in the shared decoded tx cache, where
+        the replay will find them.
+        """
+        txids = [txn.txid for txn in self.txs]
+        own_txids = set(txids)
+        prev_txids = set()
+        decode_tx = lambda txid: _decode_tx(self.rpc_pool, txid)
+        for txn, decoded_tx in zip(self.txs, self.pool.map(decode_tx, txids)):
+            if decoded_tx is None or txn.type != 'sent':
+                continue
+            for vin in decoded_tx['vin']:
+                if 'txid' in vin and vin['txid'] not in own_txids:
+                    prev_txids.add(vin['txid'])
+        self.pool.map(decode_tx, list(prev_txids))
+        dprint("Prefetched %d txs and %d foreign prevout txs for %s" %
+               (len(txids), len(prev_txids), self.wallet_label))
+
+def load_wallets(wallet_labels, max_concurrent_wallets=MAX_CONCURRENT_WALLETS,
+                 max_concurrent_requests=MAX_CONCURRENT_REQUESTS, **kwargs):
+    """Load many wallets at once, sharing one bounded pool of requests.
+
+    Args:
+        wallet_labels (List[str]): Labels of the wallets to load.
+        max_concurrent_wallets (Optional[int]): Number of wallets loaded at
+            once.
+        max_concurrent_requests (Optional[int]): Number of HTTP and RPC
+            requests in flight at once across all wallets. The wallets share a
+            pool of this many threads, and a pool of this many bitcoind
+            connections.
+        **kwargs: Passed on to each `AsyncWallet`.
+
+    Yields:
+        (str, `AsyncWallet` or Exception): Each wallet label along with the
+            loaded wallet, or the error raised while loading it, in the order
+            the wallets finish loading.
+    """
+    rpc_pool = bitcoind_rpc.RPCConnectionPool(size=max_concurrent_requests)
+    request_pool = ThreadPool(max_concurrent_requests)
+    wallet_pool = ThreadPool(max_concurrent_wallets)
+
+    def load(wallet_label):
+        """Load one wallet, returning any error instead of raising it."""
+        try:
+            return (wallet_label,
+                    AsyncWallet(wallet_label, pool=request_pool,
+                                rpc_pool=rpc_pool, **kwargs))
+        except Exception as err:
+            return (wallet_label, err)
+
+    try:
+        for result in wallet_pool.imap_unordered(load, wallet_labels):
+            yield result
+    finally:
+        wallet_pool.terminate()
+        request_pool.terminate()
+
+def dprint(msg):
+    """Debug print statements."""
+    if ENABLE_DEBUG_PRINT:
+        print "DEBUG: %s" % msg
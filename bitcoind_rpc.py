@@ -1,36 +1,140 @@
 """Fetches data from bitcoind's RPC interface."""
 import ConfigParser
+import httplib
+import Queue
+import socket
+import time
+from contextlib import contextmanager
 from bitcoinrpc.authproxy import AuthServiceProxy
 
+import cache #cache.py
+from raw_tx import decode_raw_tx #raw_tx.py
+from satoshi_convert import btc_to_satoshis #satoshi_convert.py
+
+ENABLE_DEBUG_PRINT = False
+
 CONFIG_FILENAME = 'app.cfg'
 
+#Number of connections held by an `RPCConnectionPool` by default
+DEFAULT_POOL_SIZE = 8
+
+#Check that a pooled connection still works before reusing it if it has been
+#   idle for longer than this.
+POOL_HEALTH_CHECK_AFTER_IDLE_SEC = 30
+
+#Retry a call on a fresh connection at most this many times if the connection
+#   it was made on turns out to be broken.
+POOL_MAX_RECONNECTS = 2
+
+#Errors indicating the connection is broken, rather than that bitcoind refused
+#   the request.
+BROKEN_CONNECTION_ERRORS = (socket.error, httplib.HTTPException)
+
+#Upper bound on the memory used by decoded transactions shared by all
+#   connections in this process, as estimated by `cache.estimate_size`.
+DECODED_TX_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+DECODED_TX_CACHE = cache.LRUCache(max_size=DECODED_TX_CACHE_MAX_BYTES,
+                                  sizeof=cache.estimate_size)
+
+#Decode raw transactions with `raw_tx.decode_raw_tx` rather than sending them
+#   back to bitcoind's `decoderawtransaction`, halving the RPC calls per tx.
+LOCAL_DECODE = True
+
+def values_to_satoshis(decoded_tx):
+    """Convert the value of each output of a decoded tx to integer satoshis.
+
+    The RPC interface parses values as `Decimal`; they're converted once, in
+    place, before the decoded tx is cached.
+
+    Returns:
+        dict: The decoded tx.
+    """
+    for vout in decoded_tx['vout']:
+        vout['value'] = btc_to_satoshis(vout['value'])
+    return decoded_tx
+
+def get_service_url():
+    """Read the URL of the RPC interface from `CONFIG_FILENAME`."""
+    config_parser = ConfigParser.ConfigParser()
+    config_parser.read(CONFIG_FILENAME)
+    username = config_parser.get(section='RPC', option='rpc_username')
+    password = config_parser.get(section='RPC', option='rpc_password')
+    host = config_parser.get(section='RPC', option='rpc_host')
+    port = config_parser.get(section='RPC', option='rpc_port')
+    return "http://%s:%s@%s:%s" % (username, password, host, port)
+
 class RPCConnection(object):
     """Creates a continuous connection to the bitcoind RPC interface.
 
     RPC connections are configured by the configuration file referred to by
-    `CONFIG_FILENAME`.
+    `CONFIG_FILENAME`. A connection must not be used by more than one thread
+    at a time; use `RPCConnectionPool` to share connections between threads.
 
     Attributes:
         conn (`AuthServiceProxy`): A connection to the RPC interface.
+
+    Args:
+        service_url (Optional[str]): URL of the RPC interface, including
+            credentials. Read from `CONFIG_FILENAME` if omitted.
     """
-    def __init__(self):
-        config_parser = ConfigParser.ConfigParser()
-        config_parser.read(CONFIG_FILENAME)
-        username = config_parser.get(section='RPC', option='rpc_username')
-        password = config_parser.get(section='RPC', option='rpc_password')
-        host = config_parser.get(section='RPC', option='rpc_host')
-        port = config_parser.get(section='RPC', option='rpc_port')
+    def __init__(self, service_url=None):
+        if service_url is None:
+            service_url = get_service_url()
+        self.conn = AuthServiceProxy(service_url)
 
-        self.conn = AuthServiceProxy("http://%s:%s@%s:%s" %
-                                     (username, password, host, port))
+    def is_healthy(self):
+        """Returns whether the connection can still reach bitcoind."""
+        try:
+            self.conn.getblockcount()
+            return True
+        except BROKEN_CONNECTION_ERRORS:
+            return False
 
     def get_block_hash_at_height(self, block_height):
         """Get the hash of the block at the specified block height."""
         return self.conn.getblockhash(block_height)
 
-    def get_json_for_block_hash(self, block_hash):
-        """Get a JSON represntation of the specified block."""
-        return self.conn.getblock(block_hash)
+    def get_json_for_block_hash(self, block_hash, verbosity=1):
+        """Get a JSON represntation of the specified block.
+
+        Args:
+            block_hash (str): Hash of the block.
+            verbosity (Optional[int]): 1 lists the block's transaction IDs; 2
+                includes each transaction decoded as by `get_decoded_tx`.
+        """
+        if verbosity == 1:
+            return self.conn.getblock(block_hash)
+        return self.conn.getblock(block_hash, verbosity)
+
+    def get_decoded_txs_in_block(self, block_height, tx_ids=None):
+        """Decode the transactions of a block with a single RPC call.
+
+        The decoded transactions are added to `DECODED_TX_CACHE`, with output
+        values in integer satoshis as for `get_decoded_tx`, so that later
+        calls to `get_decoded_tx` for them don't go to the RPC interface. This
+        doesn't require bitcoind to maintain a transaction index.
+
+        Args:
+            block_height (int): Height of the block.
+            tx_ids (Optional[Set[str]]): Only cache these transactions from the
+                block. All of them are cached if omitted.
+
+        Returns:
+            int: The number of transactions cached.
+        """
+        block_hash = self.get_block_hash_at_height(block_height)
+        block_json = self.get_json_for_block_hash(block_hash, verbosity=2)
+        num_cached = 0
+        for decoded_tx in block_json['tx']:
+            if tx_ids is not None and decoded_tx['txid'] not in tx_ids:
+                continue
+            #unlike decoderawtransaction, getblock includes the raw hex
+            decoded_tx.pop('hex', None)
+            DECODED_TX_CACHE.put(decoded_tx['txid'],
+                                 values_to_satoshis(decoded_tx))
+            num_cached += 1
+        return num_cached
 
     def get_tx_ids_at_height(self, block_height):
         """Get a list of transaction IDs contained in the specified block."""
@@ -57,9 +161,26 @@ class RPCConnection(object):
             return self.conn.getrawtransaction(tx_id)
 
     def get_decoded_tx(self, tx_id):
-        """Gets the transaction in JSON format from the RPC interface."""
+        """Gets the transaction in JSON format from the RPC interface.
+
+        The value of each output is in integer satoshis. Decoded transactions
+        are kept in `DECODED_TX_CACHE`, which is shared by every connection in
+        the process. The returned object must not be modified. If
+        `LOCAL_DECODE` is set, only the fields listed by `raw_tx.decode_raw_tx`
+        are included.
+        """
+        decoded_tx = DECODED_TX_CACHE.get(tx_id)
+        if decoded_tx is not None:
+            return decoded_tx
         try:
-            return self.conn.decoderawtransaction(self.get_raw_tx(tx_id))
+            raw_tx = self.get_raw_tx(tx_id)
+            if LOCAL_DECODE:
+                decoded_tx = decode_raw_tx(raw_tx)
+            else:
+                decoded_tx = values_to_satoshis(
+                    self.conn.decoderawtransaction(raw_tx))
+            DECODED_TX_CACHE.put(tx_id, decoded_tx)
+            return decoded_tx
         except IndexError:
             #bitcoind won't generate this, but here's what it would look like
             genesis_json = {
@@ -76,7 +197,7 @@ class RPCConnection(object):
                 }],
                 'vout': [
                     {
-                        'value': 50.00000000,
+                        'value': 5000000000, #in satoshis
                         'n': 0,
                         'scriptPubKey': {
                             'asm': ('04678afdb0fe5548271967f1a67130b7105cd6a828'
@@ -95,3 +216,96 @@ class RPCConnection(object):
                 ]
             }
             return genesis_json
+
+class RPCConnectionPool(object):
+    """A thread-safe pool of connections to the bitcoind RPC interface.
+
+    Offers the same methods as `RPCConnection`. Each call borrows a connection
+    from the pool for its duration, blocking while all connections are in use.
+    A connection that has been idle for `POOL_HEALTH_CHECK_AFTER_IDLE_SEC` is
+    checked before it's reused, and a call that fails because its connection
+    broke is retried on a new one.
+
+    Attributes:
+        size (int): Maximum number of connections.
+
+    Args:
+        size (Optional[int]): Maximum number of connections, and so of calls
+            in progress at once.
+        service_url (Optional[str]): URL of the RPC interface, including
+            credentials. Read from `CONFIG_FILENAME` once if omitted.
+    """
+    def __init__(self, size=DEFAULT_POOL_SIZE, service_url=None):
+        assert size > 0
+        self.size = size
+        self._service_url = service_url
+        if self._service_url is None:
+            self._service_url = get_service_url()
+        #(connection or None, time it was returned); connections are opened
+        #   when first needed
+        self._idle = Queue.LifoQueue()
+        for _ in range(0, size):
+            self._idle.put((None, 0))
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a `with` block."""
+        conn, last_used = self._idle.get()
+        try:
+            if conn is None:
+                conn = RPCConnection(self._service_url)
+            elif (time.time() - last_used > POOL_HEALTH_CHECK_AFTER_IDLE_SEC
+                  and not conn.is_healthy()):
+                dprint("Replacing unhealthy idle RPC connection")
+                conn = RPCConnection(self._service_url)
+            yield conn
+        except BROKEN_CONNECTION_ERRORS:
+            conn = None
+            raise
+        finally:
+            self._idle.put((conn, time.time()))
+
+    def call(self, method_name, *args, **kwargs):
+        """Call a method of `RPCConnection` on a pooled connection."""
+        num_reconnects = 0
+        while True:
+            try:
+                with self.connection() as conn:
+                    return getattr(conn, method_name)(*args, **kwargs)
+            except BROKEN_CONNECTION_ERRORS as err:
+                if num_reconnects == POOL_MAX_RECONNECTS:
+                    raise
+                num_reconnects += 1
+                dprint("Retrying %s on a new connection after error: %s" %
+                       (method_name, str(err)))
+
+    def get_block_hash_at_height(self, block_height):
+        """See `RPCConnection.get_block_hash_at_height`."""
+        return self.call('get_block_hash_at_height', block_height)
+
+    def get_json_for_block_hash(self, block_hash, verbosity=1):
+        """See `RPCConnection.get_json_for_block_hash`."""
+        return self.call('get_json_for_block_hash', block_hash,
+                         verbosity=verbosity)
+
+    def get_decoded_txs_in_block(self, block_height, tx_ids=None):
+        """See `RPCConnection.get_decoded_txs_in_block`."""
+        return self.call('get_decoded_txs_in_block', block_height,
+                         tx_ids=tx_ids)
+
+    def get_tx_ids_at_height(self, block_height):
+        """See `RPCConnection.get_tx_ids_at_height`."""
+        return self.call('get_tx_ids_at_height', block_height)
+
+    def get_raw_tx(self, tx_id):
+        """See `RPCConnection.get_raw_tx`."""
+        return self.call('get_raw_tx', tx_id)
+
+    def get_decoded_tx(self, tx_id):
+        """See `RPCConnection.get_decoded_tx`."""
+        return self.call('get_decoded_tx', tx_id)
+
+def dprint(msg):
+    """Debug print statements."""
+    if ENABLE_DEBUG_PRINT:
+        print "DEBUG: %s" % msg
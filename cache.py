@@ -0,0 +1,176 @@
+"""Caches shared by the wallet and its data sources.
+
+The on-disk cache stores everything beneath `CACHE_DIR`, relative to the
+working directory, so that repeated runs of a simulation can reuse what earlier
+runs computed. `LRUCache` keeps recently used data in memory for the lifetime
+of the process.
+"""
+import collections
+import errno
+import json
+import os
+import sys
+import tempfile
+import threading
+
+CACHE_DIR = 'cache'
+
+def get_path(*parts):
+    """Returns the path of an entry in the cache, creating its directory."""
+    path = os.path.join(CACHE_DIR, *parts)
+    make_dirs(os.path.dirname(path))
+    return path
+
+def make_dirs(path):
+    """Create the directory at `path` if it doesn't already exist."""
+    try:
+        os.makedirs(path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+def load_str(path):
+    """Load a string from the cache, or return None if it's missing."""
+    try:
+        with open(path) as cache_file:
+            return cache_file.read()
+    except IOError:
+        return None
+
+def save_str(path, data):
+    """Atomically write a string to the cache.
+
+    The string is written to a uniquely named temporary file first and then
+    renamed, so that an interrupted run never leaves a truncated entry behind
+    and concurrent writers of the same entry don't clobber each other.
+    """
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                        suffix='.tmp')
+    with os.fdopen(tmp_fd, 'w') as cache_file:
+        cache_file.write(data)
+    os.rename(tmp_path, path)
+
+def load_json(path):
+    """Load a JSON object from the cache, or return None if it's missing."""
+    json_str = load_str(path)
+    if json_str is None:
+        return None
+    try:
+        return json.loads(json_str)
+    except ValueError:
+        #a partially written file from an interrupted run; treat as missing
+        return None
+
+def save_json(path, obj):
+    """Atomically write a JSON object to the cache, as by `save_str`."""
+    save_str(path, json.dumps(obj))
+
+def estimate_size(obj):
+    """Estimate the memory used by a parsed JSON object, in bytes.
+
+    Sums the sizes of the object and everything it contains. Strings shared
+    between objects, such as dict keys, are counted each time they appear, so
+    the estimate errs on the high side.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += estimate_size(key) + estimate_size(value)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += estimate_size(item)
+    return size
+
+class LRUCache(object):
+    """Thread-safe in-memory cache that evicts least recently used entries.
+
+    The cache is bounded by the total size of its entries rather than their
+    number. Callers must treat cached values as read-only, since the same
+    object is handed to every caller that asks for it.
+
+    Attributes:
+        max_size (int): Maximum total size of all entries.
+        size (int): Current total size of all entries.
+        hits (int): Number of lookups that found an entry.
+        misses (int): Number of lookups that found nothing.
+
+    Args:
+        max_size (int): Maximum total size of all entries, e.g. in bytes.
+        sizeof (Optional[function]): Computes the size of a value when `put`
+            isn't given one. Each entry has size 1 by default, which bounds
+            the cache by its number of entries.
+    """
+    def __init__(self, max_size, sizeof=None):
+        assert max_size > 0
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict() #key -> (value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value cached for `key`, or `default` if missing."""
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size=None):
+        """Add an entry, evicting the least recently used ones as needed.
+
+        Values larger than the whole cache are not stored.
+        """
+        if size is None:
+            size = 1 if self.sizeof is None else self.sizeof(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            while self.size + size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+            self._entries[key] = (value, size)
+            self.size += size
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Whether `key` is cached, without counting as a use or a lookup."""
+        with self._lock:
+            return key in self._entries
+
+    def items(self):
+        """Returns a list of (key, value) from least to most recently used."""
+        with self._lock:
+            return [(key, value)
+                    for key, (value, _) in self._entries.iteritems()]
+
+    def get_hit_rate(self):
+        """Returns the fraction of lookups that were hits, from 0.0 to 1.0."""
+        num_lookups = self.hits + self.misses
+        if num_lookups == 0:
+            return 0.0
+        return float(self.hits) / num_lookups
+
+    def get_stats_str(self):
+        """Returns a one line summary of the cache's usage."""
+        return ("%d hits, %d misses (%.1f%% hit rate), %d entries, size %d of "
+                "%d") % (self.hits, self.misses, self.get_hit_rate() * 100,
+                         len(self), self.size, self.max_size)
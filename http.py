@@ -1,11 +1,23 @@
-"""Takes care of fetching data via HTTP."""
+"""Takes care of fetching data via HTTP.
+
+A few slow responses from WalletExplorer.com can dominate how long a wallet
+takes to download. If `HEDGING_ENABLED` is set, a request that hasn't finished
+by the `HEDGE_PERCENTILE` of recently observed latencies is sent again, and
+whichever response arrives first is used. At most `HEDGE_BUDGET` of requests
+are duplicated, to cap the extra load on the API.
+"""
 import urllib2
 import ssl
 from socket import error as SocketError
+import collections
 import json
+import Queue
+import threading
 import time
+from decimal import Decimal
 
-from satoshi_convert import float_to_satoshis #satoshi_convert.py
+import cache #cache.py
+from satoshi_convert import btc_to_satoshis #satoshi_convert.py
 
 ENABLE_DEBUG_PRINT = False
 
@@ -20,6 +32,31 @@ MAX_RETRY_TIME_IN_SEC = 2
 NUM_SEC_TIMEOUT = 30
 NUM_SEC_SLEEP = 0
 
+#Send a duplicate of a request that hasn't finished by this percentile of
+#   recent latencies, and use whichever response arrives first.
+HEDGING_ENABLED = False
+HEDGE_PERCENTILE = 95
+
+#Most requests that may be duplicated, as a fraction of all requests
+HEDGE_BUDGET = 0.05
+
+#Don't hedge until this many latencies have been observed
+HEDGE_MIN_SAMPLES = 20
+
+#Number of recent latencies the percentile is computed from
+HEDGE_LATENCY_WINDOW = 1000
+
+#Upper bound on the memory used by parsed /tx responses shared by all wallets
+#   in this process, as estimated by `cache.estimate_size`.
+TX_DATA_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+TX_DATA_CACHE = cache.LRUCache(max_size=TX_DATA_CACHE_MAX_BYTES,
+                               sizeof=cache.estimate_size)
+
+#Fields of WalletExplorer.com responses holding BTC amounts, which are
+#   converted to integer satoshis as the responses are parsed.
+AMOUNT_KEYS = frozenset(['amount', 'fee', 'balance'])
+
 class WalletNotFoundError(Exception):
     """Wallet not found at WalletExplorer.com"""
     pass
@@ -28,6 +65,206 @@ class MaxTransactionsExceededError(Exception):
     """Wallet contains more transactions than permissible."""
     pass
 
+class WalletTx(object):
+    """A transaction from WalletExplorer.com's /wallet endpoint.
+
+    Only the fields used to replay a wallet are kept.
+
+    Attributes:
+        txid (str): Transaction hash.
+        block_height (int): Height of the block containing the transaction.
+        block_pos (int): Position of the transaction within its block.
+        time (int): Timestamp of the transaction.
+        type (str): Either 'received' or 'sent'.
+        amount (int): Amount received by the wallet, in satoshis, if received.
+        output_wallet_ids (List[str]): Wallet receiving each output, if sent.
+        output_amounts (List[int]): Amount of each output in satoshis, if sent.
+
+    Args:
+        tx_json (dict): One element of the 'txs' list returned by /wallet, as
+            parsed by `parse_json`.
+    """
+    __slots__ = ('txid', 'block_height', 'block_pos', 'time', 'type',
+                 'amount', 'output_wallet_ids', 'output_amounts')
+
+    def __init__(self, tx_json):
+        self.txid = tx_json['txid']
+        self.block_height = tx_json.get('block_height')
+        self.block_pos = tx_json.get('block_pos')
+        self.time = tx_json.get('time')
+        self.type = tx_json['type']
+        self.amount = None
+        self.output_wallet_ids = []
+        self.output_amounts = []
+        if self.type == 'received':
+            self.amount = tx_json['amount']
+        elif self.type == 'sent':
+            for output in tx_json['outputs']:
+                self.output_wallet_ids.append(output['wallet_id'])
+                self.output_amounts.append(output['amount'])
+
+    def __repr__(self):
+        if self.type == 'received':
+            details = "amount=%d" % self.amount
+        else:
+            details = "outputs=%s" % str(zip(self.output_wallet_ids,
+                                             self.output_amounts))
+        return ("WalletTx(txid=%s, block_height=%s, block_pos=%s, type=%s, "
+                "%s)") % (self.txid, self.block_height, self.block_pos,
+                          self.type, details)
+
+class HedgePolicy(object):
+    """Decides when to hedge requests, from the latencies observed so far.
+
+    Thread-safe, since requests are made from several threads at once.
+
+    Args:
+        percentile (int): Hedge requests slower than this percentile.
+        budget (float): Most requests that may be hedged, as a fraction of
+            all requests.
+        min_samples (int): Don't hedge until this many latencies are known.
+        window (int): Number of recent latencies to keep.
+    """
+    def __init__(self, percentile=HEDGE_PERCENTILE, budget=HEDGE_BUDGET,
+                 min_samples=HEDGE_MIN_SAMPLES, window=HEDGE_LATENCY_WINDOW):
+        assert 0 < percentile < 100
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=window)
+        self.num_requests = 0
+        self.num_hedged = 0
+        self.num_hedges_won = 0
+        self.lock = threading.Lock()
+
+    def record_latency(self, latency):
+        """Record the time taken by a successful request, in seconds."""
+        with self.lock:
+            self.latencies.append(latency)
+
+    def start_request(self):
+        """Count a request, and return how long to wait before hedging it.
+
+        Returns:
+            Optional[float]: Seconds to wait, or None if the request may not
+                be hedged.
+        """
+        with self.lock:
+            self.num_requests += 1
+            if len(self.latencies) < self.min_samples:
+                return None
+            if self.num_hedged + 1 > self.budget * self.num_requests:
+                return None
+            latencies = sorted(self.latencies)
+            return latencies[len(latencies) * self.percentile // 100]
+
+    def start_hedge(self):
+        """Returns whether the budget allows hedging, and if so counts it."""
+        with self.lock:
+            if self.num_hedged + 1 > self.budget * self.num_requests:
+                return False
+            self.num_hedged += 1
+            return True
+
+    def record_hedge_won(self):
+        """Record that a hedge responded before the original request."""
+        with self.lock:
+            self.num_hedges_won += 1
+
+    def get_stats_str(self):
+        """Returns a one line summary of hedging so far."""
+        with self.lock:
+            return "%d requests, %d hedged, %d hedges responded first" % (
+                self.num_requests, self.num_hedged, self.num_hedges_won)
+
+HEDGE_POLICY = HedgePolicy()
+
+def amounts_to_satoshis(pairs):
+    """Build a JSON object, converting the values of `AMOUNT_KEYS` to satoshis.
+
+    Used as the `object_pairs_hook` of `parse_json`.
+    """
+    obj = {}
+    for key, value in pairs:
+        if key in AMOUNT_KEYS and value is not None:
+            value = btc_to_satoshis(value)
+        obj[key] = value
+    return obj
+
+def parse_json(json_str):
+    """Parse a WalletExplorer.com response, with amounts in integer satoshis.
+
+    Numbers with a fractional part are read as `Decimal` rather than float, so
+    amounts are converted exactly.
+    """
+    return json.loads(json_str, parse_float=Decimal,
+                      object_pairs_hook=amounts_to_satoshis)
+
+def _fetch_once(url):
+    """Fetch a url once, without retrying.
+
+    Raises:
+        urllib2.URLError, ssl.SSLError, socket.error: If the fetch fails.
+    """
+    response = urllib2.urlopen(url=url, timeout=NUM_SEC_TIMEOUT).read()
+    if response is None:
+        #For some reason, no handler handled the request
+        raise Exception
+    return response
+
+def _fetch_into_queue(url, responses, is_hedge):
+    """Fetch a url on behalf of `_fetch_hedged`, reporting to `responses`."""
+    start_time = time.time()
+    try:
+        response = _fetch_once(url)
+    except Exception as err:
+        responses.put((is_hedge, None, err))
+        return
+    HEDGE_POLICY.record_latency(time.time() - start_time)
+    responses.put((is_hedge, response, None))
+
+def _start_fetch_thread(url, responses, is_hedge):
+    """Start fetching a url on a daemon thread, which may be abandoned."""
+    thread = threading.Thread(target=_fetch_into_queue,
+                              args=(url, responses, is_hedge))
+    thread.daemon = True
+    thread.start()
+
+def _fetch_hedged(url):
+    """Fetch a url once, sending a duplicate request if it's slow.
+
+    Raises:
+        As for `_fetch_once`, if every request sent fails.
+    """
+    delay = HEDGE_POLICY.start_request()
+    responses = Queue.Queue()
+    _start_fetch_thread(url, responses, False)
+    num_pending = 1
+    first_error = None
+    if delay is not None:
+        try:
+            _, response, err = responses.get(timeout=delay)
+        except Queue.Empty:
+            if HEDGE_POLICY.start_hedge():
+                dprint("Hedging request for '%s' after %.2fs" % (url, delay))
+                _start_fetch_thread(url, responses, True)
+                num_pending += 1
+        else:
+            num_pending -= 1
+            if err is None:
+                return response
+            first_error = err
+    while num_pending > 0:
+        is_hedge, response, err = responses.get()
+        num_pending -= 1
+        if err is None:
+            if is_hedge:
+                HEDGE_POLICY.record_hedge_won()
+            return response
+        if first_error is None:
+            first_error = err
+    raise first_error
+
 def fetch_url(url):
     """Fetch contents of remote page as string for specified url."""
 
@@ -43,11 +280,9 @@ def fetch_url(url):
         if current_retry_time_in_sec:
             time.sleep(current_retry_time_in_sec)
         try:
-            response = urllib2.urlopen(url=url, timeout=NUM_SEC_TIMEOUT).read()
-            if response is None:
-                #For some reason, no handler handled the request
-                raise Exception
-            return response
+            if HEDGING_ENABLED:
+                return _fetch_hedged(url)
+            return _fetch_once(url)
         except (urllib2.HTTPError, ssl.SSLError) as err:
             #There was a problem fetching the page, maybe something other than
             #   HTTP 200 OK.
@@ -83,7 +318,7 @@ def get_num_txs(wallet_label):
     """
     url = get_wallet_txs_offsets_url(wallet_label, 0)
     dprint(url)
-    wallet_json = json.loads(fetch_url(url))
+    wallet_json = parse_json(fetch_url(url))
     try:
         if not wallet_json['found']:
             raise WalletNotFoundError
@@ -114,7 +349,7 @@ def get_all_wallet_txids(wallet_label):
     txids = []
     for offset in range(0, num_txs, NUM_TX_PER_FETCH):
         url = get_wallet_txs_offsets_url(wallet_label, offset)
-        json_obj = json.loads(fetch_url(url))
+        json_obj = parse_json(fetch_url(url))
         if not json_obj['found']:
             raise WalletNotFoundError
         try:
@@ -125,12 +360,43 @@ def get_all_wallet_txids(wallet_label):
     return txids
 
 def get_tx_data_json(txid):
-    """Fetch WalletExplorer.com's TX data for specified tx."""
-    url = get_tx_data_url(txid)
-    json_obj = json.loads(fetch_url(url))
-    assert json_obj['found']
+    """Fetch WalletExplorer.com's TX data for specified tx.
+
+    Responses are saved to the on-disk cache, so each transaction is only
+    fetched from the remote API once, and recently used ones are also kept in
+    `TX_DATA_CACHE`. The returned object must not be modified.
+    """
+    json_obj = TX_DATA_CACHE.get(txid)
+    if json_obj is not None:
+        return json_obj
+    path = cache.get_path('tx', '%s.json' % txid)
+    json_str = cache.load_str(path)
+    try:
+        json_obj = parse_json(json_str)
+    except (TypeError, ValueError):
+        #missing, or partially written by an interrupted run
+        url = get_tx_data_url(txid)
+        json_str = fetch_url(url)
+        json_obj = parse_json(json_str)
+        assert json_obj['found']
+        cache.save_str(path, json_str)
+    TX_DATA_CACHE.put(txid, json_obj)
     return json_obj
 
+def get_tx_wallet_label(txid):
+    """Get the label of the wallet that created the specified transaction.
+
+    Returns:
+        str: The wallet's label if WalletExplorer.com has one, otherwise its
+            wallet ID, or None if this is a coinbase transaction.
+    """
+    tx_json = get_tx_data_json(txid)
+    if tx_json['is_coinbase']:
+        return None
+    if 'label' in tx_json:
+        return tx_json['label']
+    return tx_json['wallet_id']
+
 def get_outputs_sent_to_wallet(txid, wallet_label):
     """Find all outputs in tx sent to specified wallet using remote API.
 
@@ -141,7 +407,7 @@ def get_outputs_sent_to_wallet(txid, wallet_label):
     utxos = []
     for i, output in enumerate(tx_json['out']):
         receiver_wallet = None
-        amt_in_satoshis = float_to_satoshis(output['amount'])
+        amt_in_satoshis = output['amount']
         if 'label' in output:
             receiver_wallet = output['label']
         else:
@@ -152,23 +418,7 @@ def get_outputs_sent_to_wallet(txid, wallet_label):
     return utxos
 
 def get_all_wallet_txs(wallet_label, max_num_txs=None):
-    """Get a list of transaction objects belonging to specified wallet.
-
-    Each object contains these fields:
-        * txid
-        * block_height
-        * block_pos
-        * time
-        * balance (in BTC)
-        * type (received|sent)
-        * wallet_id (if received)
-        * amount (if received)
-        * label (if received)
-        * fee (if sent)
-        * outputs (list, if sent)
-            * per output:
-                * amount
-                * wallet_id
+    """Get a list of `WalletTx` records belonging to specified wallet.
 
     Transactions will be listed in chronological order, with the earliest being
     in the 0th position.
@@ -188,15 +438,52 @@ def get_all_wallet_txs(wallet_label, max_num_txs=None):
     if max_num_txs is not None and num_txs > max_num_txs:
         raise MaxTransactionsExceededError
     txs = []
-    for offset in range(0, num_txs, NUM_TX_PER_FETCH):
-        url = get_wallet_txs_offsets_url(wallet_label, offset)
-        json_obj = json.loads(fetch_url(url))
-        dprint('Fetched %d txs for %s' % (len(json_obj['txs']), wallet_label))
-        txs.extend(json_obj['txs'])
+    for _, page in iter_wallet_tx_pages(wallet_label, num_txs):
+        txs.extend(page)
         dprint("New length of txs array is %d" % len(txs))
     txs.reverse()
     return txs
 
+def iter_wallet_tx_pages(wallet_label, num_txs):
+    """Yields each page of a wallet's `WalletTx` records, one at a time.
+
+    Only one page is held in memory at a time, so even the largest wallets can
+    be streamed to disk.
+
+    Args:
+        wallet_label (str): The wallet label assigned by walletexplorer.com
+        num_txs (int): The number of transactions in the wallet, as returned
+            by `get_num_txs`.
+
+    Yields:
+        (int, List[`WalletTx`]): The offset of the page, counting back from the
+            wallet's most recent transaction, and its records in reverse
+            chronological order.
+
+    Raises:
+        WalletNotFoundError: If wallet not found at walletexplorer.com.
+    """
+    for offset in xrange(0, num_txs, NUM_TX_PER_FETCH):
+        yield offset, get_wallet_txs_page(wallet_label, offset)
+
+def get_wallet_txs_page(wallet_label, offset):
+    """Get one page of a wallet's `WalletTx` records, starting at `offset`.
+
+    Pages list transactions in reverse chronological order, and `offset` counts
+    back from the wallet's most recent transaction.
+
+    Raises:
+        WalletNotFoundError: If wallet not found at walletexplorer.com.
+    """
+    url = get_wallet_txs_offsets_url(wallet_label, offset)
+    json_obj = parse_json(fetch_url(url))
+    try:
+        txs = [WalletTx(tx_json) for tx_json in json_obj['txs']]
+    except KeyError:
+        raise WalletNotFoundError
+    dprint('Fetched %d txs for %s' % (len(txs), wallet_label))
+    return txs
+
 def dprint(msg):
     """Debug print statements."""
     if ENABLE_DEBUG_PRINT:
@@ -0,0 +1,346 @@
+"""Replays wallets too large to hold in memory, using an on-disk store.
+
+`Wallet` keeps the wallet's whole transaction list and UTXO set in memory,
+which rules out exchange-sized wallets with millions of transactions.
+`OutOfCoreWallet` keeps both in a SQLite database in the cache instead, and
+caps the memory SQLite may use for its page cache, so the replay runs in a
+fixed working set regardless of the wallet's size. The decoded tx and /tx
+caches are bounded separately, by `bitcoind_rpc.DECODED_TX_CACHE_MAX_BYTES`
+and `http.TX_DATA_CACHE_MAX_BYTES`.
+
+The transaction list is downloaded one page at a time, and is kept in the
+database between runs. It's downloaded again if the number of transactions
+WalletExplorer.com reports for the wallet has changed since, e.g. because the
+wallet has grown. Delete the database from the cache to force a download.
+"""
+import array
+import json
+import sqlite3
+
+import http #http.py
+import cache #cache.py
+from wallet import Wallet #wallet.py
+
+ENABLE_DEBUG_PRINT = False
+
+#Memory SQLite may use to cache the pages of each wallet's database
+OUT_OF_CORE_MEMORY_MB = 64
+
+#Commit the UTXO set to disk after every this many transactions
+COMMIT_INTERVAL = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS txs (
+    tx_index INTEGER PRIMARY KEY, txid TEXT, block_height INTEGER,
+    block_pos INTEGER, time INTEGER, type TEXT, amount INTEGER, outputs TEXT);
+CREATE INDEX IF NOT EXISTS txs_block_height ON txs (block_height);
+CREATE TABLE IF NOT EXISTS utxos (
+    seq INTEGER PRIMARY KEY, txid TEXT, output_index INTEGER, amt INTEGER,
+    UNIQUE (txid, output_index));
+CREATE INDEX IF NOT EXISTS utxos_amt ON utxos (amt);
+"""
+
+class WalletStore(object):
+    """A wallet's transactions and UTXO set, stored in a SQLite database.
+
+    Args:
+        path (str): Location of the database, which is created if needed.
+        memory_mb (int): Memory SQLite may use to cache database pages.
+    """
+    def __init__(self, path, memory_mb=OUT_OF_CORE_MEMORY_MB):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA cache_size = %d' % (-memory_mb * 1024))
+        #the database is only a cache, which can be rebuilt if it's lost
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('PRAGMA journal_mode = MEMORY')
+        self.db.executescript(SCHEMA)
+
+    def get_meta(self, key):
+        """Returns a value saved with `set_meta`, or None."""
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def set_meta(self, key, value):
+        """Save a value describing the wallet."""
+        self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                        (key, value))
+
+    def commit(self):
+        """Write pending changes to disk."""
+        self.db.commit()
+
+    def close(self):
+        """Commit and close the database."""
+        self.db.commit()
+        self.db.close()
+
+class StoredTxList(object):
+    """A read-only sequence of the `http.WalletTx` records in a `WalletStore`.
+
+    Records are read from disk as they're accessed. The most recently
+    accessed one is kept, since `Wallet` looks up the current transaction
+    several times while processing it.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.num_txs = store.db.execute(
+            'SELECT COUNT(*) FROM txs').fetchone()[0]
+        self.last_tx = (None, None)
+
+    @staticmethod
+    def to_row(tx_index, txn):
+        """Returns the database row for a record."""
+        outputs = None
+        if txn.type == 'sent':
+            outputs = json.dumps(zip(txn.output_wallet_ids,
+                                     txn.output_amounts))
+        return (tx_index, txn.txid, txn.block_height, txn.block_pos, txn.time,
+                txn.type, txn.amount, outputs)
+
+    @staticmethod
+    def from_row(row):
+        """Returns the record for a database row."""
+        tx_json = {'txid': row[1], 'block_height': row[2], 'block_pos': row[3],
+                   'time': row[4], 'type': row[5], 'amount': row[6]}
+        if row[7] is not None:
+            tx_json['outputs'] = [
+                {'wallet_id': wallet_id, 'amount': amt}
+                for wallet_id, amt in json.loads(row[7])]
+        return http.WalletTx(tx_json)
+
+    def __len__(self):
+        return self.num_txs
+
+    def __getitem__(self, tx_index):
+        if tx_index < 0:
+            tx_index += self.num_txs
+        if not 0 <= tx_index < self.num_txs:
+            raise IndexError
+        if self.last_tx[0] != tx_index:
+            row = self.store.db.execute('SELECT * FROM txs WHERE tx_index = ?',
+                                        (tx_index,)).fetchone()
+            self.last_tx = (tx_index, self.from_row(row))
+        return self.last_tx[1]
+
+    def __iter__(self):
+        cursor = self.store.db.cursor()
+        for row in cursor.execute('SELECT * FROM txs ORDER BY tx_index'):
+            yield self.from_row(row)
+
+class StoredTxidsByHeight(object):
+    """Maps each block height to the set of the wallet's txids in that block.
+
+    Stands in for `Wallet.txids_by_height`, looking up the txids on disk.
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, block_height):
+        rows = self.store.db.execute(
+            'SELECT txid FROM txs WHERE block_height = ?', (block_height,))
+        return set(row[0] for row in rows)
+
+class StoredUTXOSet(object):
+    """The UTXO set in a `WalletStore`, in the order the UTXOs were added.
+
+    Stands in for both the `utxos` list and the `outpoints` index of `Wallet`.
+    Iterating reads the set from disk, so the set must not be modified until
+    an iteration is complete.
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def extend(self, utxos):
+        """Add UTXOs to the end of the set.
+
+        UTXOs whose outpoint is already in the set are skipped, leaving the
+        UTXO already there in place, as `Wallet.add_utxos` does.
+
+        Returns:
+            List[utxo]: The UTXOs that were added.
+        """
+        new_utxos = []
+        for utxo in utxos:
+            cursor = self.store.db.execute(
+                'INSERT OR IGNORE INTO utxos (txid, output_index, amt) '
+                'VALUES (?, ?, ?)', utxo)
+            if cursor.rowcount > 0:
+                new_utxos.append(utxo)
+        return new_utxos
+
+    def remove(self, utxo):
+        """Remove a UTXO from the set.
+
+        Raises:
+            ValueError: If the UTXO is not in the set.
+        """
+        cursor = self.store.db.execute(
+            'DELETE FROM utxos WHERE txid = ? AND output_index = ? AND amt = ?',
+            utxo)
+        if cursor.rowcount == 0:
+            raise ValueError
+
+    def clear(self):
+        """Remove all UTXOs from the set."""
+        self.store.db.execute('DELETE FROM utxos')
+
+    def get(self, outpoint, default=None):
+        """Returns the UTXO with the (txid, output_index) outpoint, if any."""
+        row = self.store.db.execute(
+            'SELECT txid, output_index, amt FROM utxos '
+            'WHERE txid = ? AND output_index = ?', outpoint).fetchone()
+        if row is None:
+            return default
+        return tuple(row)
+
+    def __iter__(self):
+        cursor = self.store.db.cursor()
+        for row in cursor.execute(
+                'SELECT txid, output_index, amt FROM utxos ORDER BY seq'):
+            yield tuple(row)
+
+    def get_amts(self):
+        """Returns the amounts of the UTXOs in descending order.
+
+        Returns:
+            array.array: The amounts, stored compactly rather than as a list,
+                so that they take a small fraction of the memory the UTXOs
+                would.
+        """
+        cursor = self.store.db.cursor()
+        return array.array('l', (row[0] for row in cursor.execute(
+            'SELECT amt FROM utxos ORDER BY amt DESC')))
+
+    def __len__(self):
+        return self.store.db.execute(
+            'SELECT COUNT(*) FROM utxos').fetchone()[0]
+
+    def __repr__(self):
+        return "StoredUTXOSet(%d utxos)" % len(self)
+
+class OutOfCoreWallet(Wallet):
+    """A `Wallet` whose transactions and UTXO set are kept on disk.
+
+    Produces the same UTXO snapshots as `Wallet`, except that each snapshot is
+    the live `StoredUTXOSet`, rather than a list. Callers should iterate over
+    it before processing further transactions, and call `close` when done.
+    Checkpoints and the outpoint index aren't supported.
+
+    Args:
+        wallet_label (str): The name of the wallet you're iterating through.
+        iterate_until_send (Optional[bool]): As for `Wallet`.
+        max_txs_download (Optional[int]): As for `Wallet`.
+        conn (Optional[`RPCConnection`]): As for `Wallet`.
+        bulk_fetch (Optional[bool]): As for `Wallet`.
+        memory_mb (Optional[int]): Memory the database may use for its cache.
+            Defaults to `OUT_OF_CORE_MEMORY_MB`.
+
+    Raises:
+        http.WalletNotFoundError: Raised if not found at walletexplorer.com API.
+        http.MaxTransactionsExceededError: Raised if the number of transactions
+            in the wallet exceeds the specified `max_txs_download` param.
+    """
+    def __init__(self, wallet_label, iterate_until_send=False,
+                 max_txs_download=None, conn=None, bulk_fetch=False,
+                 memory_mb=OUT_OF_CORE_MEMORY_MB):
+        self.store = WalletStore(cache.get_path('wallets',
+                                                '%s.sqlite' % wallet_label),
+                                 memory_mb=memory_mb)
+        super(OutOfCoreWallet, self).__init__(
+            wallet_label, iterate_until_send=iterate_until_send,
+            max_txs_download=max_txs_download, checkpoint_interval=None,
+            conn=conn)
+        #the index would grow with the wallet
+        self.outpoint_index = None
+        self.set_utxos([])
+        self.bulk_fetch = bulk_fetch
+        self.txids_by_height = StoredTxidsByHeight(self.store)
+
+    def fetch_txs(self, max_txs_download):
+        """Download the wallet's transactions to disk, unless already there.
+
+        A history downloaded by an earlier run is only reused if the wallet
+        still has the same number of transactions. Otherwise the whole history
+        is downloaded again, since WalletExplorer.com may also have merged
+        other clusters into the wallet.
+        """
+        num_txs = http.get_num_txs(self.wallet_label)
+        if max_txs_download is not None and num_txs > max_txs_download:
+            raise http.MaxTransactionsExceededError
+        num_txs_downloaded = self.store.get_meta('num_txs_downloaded')
+        if num_txs_downloaded != num_txs:
+            if num_txs_downloaded is not None:
+                print("Downloading %s again because it now has %d txs, not %d"
+                      % (self.wallet_label, num_txs, num_txs_downloaded))
+            self.store.db.execute('DELETE FROM txs')
+            for offset, page in http.iter_wallet_tx_pages(self.wallet_label,
+                                                          num_txs):
+                #pages are in reverse chronological order
+                self.store.db.executemany(
+                    'INSERT OR REPLACE INTO txs '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [StoredTxList.to_row(num_txs - 1 - offset - i, txn)
+                     for i, txn in enumerate(page)])
+                dprint("Downloaded %d of %d txs for %s" %
+                       (offset + len(page), num_txs, self.wallet_label))
+            self.store.set_meta('num_txs_downloaded', num_txs)
+            self.store.commit()
+        return StoredTxList(self.store)
+
+    def set_utxos(self, utxos):
+        """Replace the wallet's current set of UTXOs."""
+        self.utxos = StoredUTXOSet(self.store)
+        self.outpoints = self.utxos
+        self.utxos.clear()
+        self.utxos.extend(utxos)
+
+    def add_utxos(self, utxos):
+        """Add UTXOs to the end of the wallet's current set.
+
+        UTXOs whose outpoint is already in the set are skipped, as by
+        `Wallet.add_utxos`.
+
+        Returns:
+            List[utxo]: The UTXOs that were added.
+        """
+        utxos = list(utxos)
+        new_utxos = self.utxos.extend(utxos)
+        if len(new_utxos) < len(utxos):
+            added = set(new_utxos)
+            for utxo in utxos:
+                if utxo in added:
+                    added.remove(utxo)
+                    continue
+                print(("WARNING: Outpoint %s of %s is already in the UTXO set "
+                       "of wallet %s. It will be ignored.") %
+                      (str(utxo[:2]), str(utxo), self.wallet_label))
+        return new_utxos
+
+    def remove_utxo(self, utxo):
+        """Remove a UTXO from the wallet's current set.
+
+        Raises:
+            ValueError: If the UTXO is not in the set.
+        """
+        self.utxos.remove(utxo)
+
+    def next_tx(self):
+        """Process the next transaction, committing to disk periodically."""
+        tx_type = super(OutOfCoreWallet, self).next_tx()
+        if self.tx_index % COMMIT_INTERVAL == 0:
+            self.store.commit()
+        return tx_type
+
+    def close(self):
+        """Close the wallet's database."""
+        self.store.close()
+
+def dprint(msg):
+    """Debug print statements."""
+    if ENABLE_DEBUG_PRINT:
+        print "DEBUG: %s" % msg
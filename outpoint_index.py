@@ -0,0 +1,220 @@
+"""Index of which wallet owns each transaction output, shared by all wallets.
+
+The index is filled in as wallets are replayed:
+    * each UTXO added to a wallet is owned by that wallet
+    * each output of a send that pays one of the recipients listed by the
+      /wallet endpoint is owned by that recipient
+    * each output listed by a /tx response that a wallet falls back on is
+      owned by the wallet it names
+
+This lets a wallet tell in O(1) whether an input it can't find in its own
+UTXO set belongs to another known wallet, as in a CoinJoin, and lets it find
+its outputs in a transaction without another call to /tx once the owners of
+all of the transaction's outputs are known.
+
+A wallet may be named by its label, if WalletExplorer.com has one, or by its
+wallet ID, and a `Wallet` is named by whichever the user gave it. Recipients of
+sends are only known by wallet ID. The index learns which ID each label stands
+for from the /tx responses it sees, and compares owners by ID whenever it's
+known, so that a wallet recognizes its own outputs under either name.
+
+The index is bounded, forgetting the least recently used outpoints, sends and
+labels first, since it's shared by every wallet replayed in a run.
+"""
+import collections
+import threading
+
+import cache #cache.py
+
+#Most outpoints whose owners are remembered
+MAX_INDEXED_OUTPOINTS = 2000000
+
+#Most transactions whose number of outputs is remembered
+MAX_INDEXED_TXS = 500000
+
+#Most sends whose inputs' classification is remembered
+MAX_INDEXED_SENDS = 500000
+
+#Most labels whose wallet IDs are remembered
+MAX_INDEXED_LABELS = 100000
+
+#Classification of the inputs of a send, as seen by the sending wallet.
+#   num_inputs: Number of inputs.
+#   num_own: Inputs spending the sending wallet's UTXOs.
+#   num_foreign: Inputs spending UTXOs owned by other known wallets.
+#   num_unknown: Inputs spending UTXOs whose owner isn't known.
+#   num_wallets: Number of distinct known wallets contributing inputs.
+InputStats = collections.namedtuple(
+    'InputStats', ['num_inputs', 'num_own', 'num_foreign', 'num_unknown',
+                   'num_wallets'])
+
+class OutpointIndex(object):
+    """Thread-safe map from (txid, output_index) to the owning wallet.
+
+    Attributes:
+        owners (`LRUCache`): Owner of each indexed (txid, output_index)
+            outpoint.
+        num_outputs (`LRUCache`): Number of outputs of each transaction whose
+            outputs were all indexed.
+        input_stats (`LRUCache`): Classification of the inputs of each send
+            replayed, as an `InputStats`, by txid.
+        wallet_ids (`LRUCache`): Wallet ID of each label seen.
+
+    Args:
+        max_outpoints (Optional[int]): Most outpoints whose owners are kept.
+        max_txs (Optional[int]): Most transactions whose number of outputs is
+            kept.
+        max_sends (Optional[int]): Most sends whose `InputStats` are kept.
+        max_labels (Optional[int]): Most labels whose wallet IDs are kept.
+    """
+    def __init__(self, max_outpoints=MAX_INDEXED_OUTPOINTS,
+                 max_txs=MAX_INDEXED_TXS, max_sends=MAX_INDEXED_SENDS,
+                 max_labels=MAX_INDEXED_LABELS):
+        self.owners = cache.LRUCache(max_size=max_outpoints)
+        self.num_outputs = cache.LRUCache(max_size=max_txs)
+        self.input_stats = cache.LRUCache(max_size=max_sends)
+        self.wallet_ids = cache.LRUCache(max_size=max_labels)
+        self.lock = threading.Lock()
+
+    def get_wallet_id(self, wallet_label):
+        """Returns the wallet ID of a label if it's known, else the label.
+
+        Wallet IDs are returned unchanged, so the result identifies the wallet
+        however it was named.
+        """
+        return self.wallet_ids.get(wallet_label, wallet_label)
+
+    def add_utxos(self, utxos, wallet_label):
+        """Record that a wallet owns the UTXOs."""
+        owner = self.get_wallet_id(wallet_label)
+        with self.lock:
+            for utxo in utxos:
+                self.owners.put(utxo[:2], owner)
+
+    def add_outputs(self, txid, owners):
+        """Record the owners of a transaction's outputs.
+
+        Args:
+            txid (str): Transaction hash.
+            owners (List[str]): Owner of each output in order, or None for
+                outputs whose owner isn't known.
+        """
+        with self.lock:
+            for output_index, owner in enumerate(owners):
+                if owner is not None:
+                    self.owners.put((txid, output_index),
+                                    self.get_wallet_id(owner))
+            if None not in owners:
+                self.num_outputs.put(txid, len(owners))
+
+    def add_tx_json(self, txid, tx_json):
+        """Record the owners of a tx's outputs from its /tx response.
+
+        Each owner is recorded by wallet ID, and the ID of each labelled
+        owner is remembered.
+        """
+        owners = []
+        for output in tx_json['out']:
+            wallet_id = output.get('wallet_id')
+            if 'label' in output:
+                if wallet_id is None:
+                    wallet_id = output['label']
+                else:
+                    self.wallet_ids.put(output['label'], wallet_id)
+            owners.append(wallet_id)
+        self.add_outputs(txid, owners)
+
+    def get_owner(self, outpoint):
+        """Returns the owner of an outpoint, or None if it isn't known.
+
+        The owner is identified as by `get_wallet_id`.
+        """
+        owner = self.owners.get(outpoint)
+        if owner is None:
+            return None
+        return self.get_wallet_id(owner)
+
+    def is_owner(self, owner, wallet_label):
+        """Returns whether an owner returned by `get_owner` is a wallet."""
+        return owner == self.get_wallet_id(wallet_label)
+
+    def get_outputs_sent_to_wallet(self, txid, wallet_label, amts):
+        """Find the outputs of a tx owned by a wallet, if all owners are known.
+
+        Args:
+            txid (str): Transaction hash.
+            wallet_label (str): The wallet's label.
+            amts (List[int]): Amount of each of the transaction's outputs.
+
+        Returns:
+            List of utxos as tuples of (txid, output_index, amt_in_satoshis),
+            or None if the owner of any output isn't known.
+        """
+        with self.lock:
+            if self.num_outputs.get(txid) != len(amts):
+                return None
+            owners = [self.get_owner((txid, output_index))
+                      for output_index in range(0, len(amts))]
+        if None in owners:
+            #some of the owners were forgotten
+            return None
+        return [(txid, output_index, amt)
+                for output_index, (amt, owner) in enumerate(zip(amts, owners))
+                if self.is_owner(owner, wallet_label)]
+
+    def classify_inputs(self, txid, wallet_label, inputs, own_inputs):
+        """Classify and record the inputs of a wallet's send.
+
+        Args:
+            txid (str): Transaction hash of the send.
+            wallet_label (str): The sending wallet's label.
+            inputs (List[utxo]): All of the send's inputs.
+            own_inputs (List[utxo]): The inputs found in the wallet's UTXO set.
+
+        Returns:
+            `InputStats`
+        """
+        num_own = len(own_inputs)
+        num_foreign = 0
+        num_unknown = 0
+        wallet_id = self.get_wallet_id(wallet_label)
+        wallets = set([wallet_id]) if own_inputs else set()
+        own_outpoints = set(utxo[:2] for utxo in own_inputs)
+        for utxo in inputs:
+            if utxo[:2] in own_outpoints:
+                continue
+            owner = self.get_owner(utxo[:2])
+            if owner is None:
+                num_unknown += 1
+            else:
+                if owner != wallet_id:
+                    num_foreign += 1
+                else:
+                    num_own += 1
+                wallets.add(owner)
+        stats = InputStats(num_inputs=len(inputs), num_own=num_own,
+                           num_foreign=num_foreign, num_unknown=num_unknown,
+                           num_wallets=len(wallets))
+        self.input_stats.put(txid, stats)
+        return stats
+
+    def get_multi_party_txids(self):
+        """Returns the txids of the sends still indexed with inputs from more
+        than one wallet."""
+        return [txid for txid, stats in self.input_stats.items()
+                if stats.num_wallets > 1]
+
+    def get_stats_str(self):
+        """Returns a one line summary of the index's contents."""
+        all_stats = [stats for _, stats in self.input_stats.items()]
+        num_multi_party = len([stats for stats in all_stats
+                               if stats.num_wallets > 1])
+        num_unknown = len([stats for stats in all_stats
+                           if stats.num_unknown > 0])
+        return ("%d outpoints (%.1f%% hit rate), %d txs with all outputs "
+                "indexed, %d sends with inputs from several wallets, %d with "
+                "inputs of unknown owner") % (
+                    len(self.owners), self.owners.get_hit_rate() * 100,
+                    len(self.num_outputs), num_multi_party, num_unknown)
+
+OUTPOINT_INDEX = OutpointIndex()
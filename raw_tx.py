@@ -0,0 +1,194 @@
+"""Decodes raw Bitcoin transactions without a round trip to bitcoind.
+
+`bitcoind_rpc.RPCConnection.get_decoded_tx` only needs the outpoints spent by
+a transaction and the values of its outputs, which are cheap to read straight
+from the raw bytes returned by `getrawtransaction`. `decode_raw_tx` produces
+the subset of `decoderawtransaction`'s JSON used by this code base, including
+for segwit transactions, with output values already in integer satoshis.
+
+`encode_raw_tx` does the reverse, for tests and synthetic wallets.
+"""
+import binascii
+import hashlib
+import struct
+
+#Outpoint spent by the input of a coinbase transaction
+COINBASE_TXID = '00' * 32
+COINBASE_VOUT = 0xffffffff
+
+DEFAULT_SEQUENCE = 0xffffffff
+
+class MalformedTxError(Exception):
+    """The raw transaction couldn't be parsed."""
+    pass
+
+class _Reader(object):
+    """Reads the fields of a serialized transaction in order."""
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, num_bytes):
+        """Read the next `num_bytes` bytes."""
+        if self.pos + num_bytes > len(self.data):
+            raise MalformedTxError("Transaction is truncated")
+        data = self.data[self.pos:self.pos + num_bytes]
+        self.pos += num_bytes
+        return data
+
+    def read_uint(self, fmt):
+        """Read a little-endian integer of the `struct` format `fmt`."""
+        return struct.unpack(fmt, self.read(struct.calcsize(fmt)))[0]
+
+    def read_varint(self):
+        """Read a Bitcoin variable length integer."""
+        prefix = ord(self.read(1))
+        if prefix == 0xfd:
+            return self.read_uint('<H')
+        elif prefix == 0xfe:
+            return self.read_uint('<I')
+        elif prefix == 0xff:
+            return self.read_uint('<Q')
+        return prefix
+
+    def read_var_bytes(self):
+        """Read a byte string prefixed by its length."""
+        return self.read(self.read_varint())
+
+def _hash_to_hex(hash_bytes):
+    """Returns a hash in the byte-reversed hex used for txids."""
+    return binascii.hexlify(hash_bytes[::-1])
+
+def get_txid(tx_bytes):
+    """Returns the txid of a transaction serialized without witness data."""
+    return _hash_to_hex(
+        hashlib.sha256(hashlib.sha256(tx_bytes).digest()).digest())
+
+def decode_raw_tx(raw_tx):
+    """Decode a raw transaction as `decoderawtransaction` would.
+
+    Only these fields are included, with output values in integer satoshis:
+        txid, version, size, locktime
+        vin: txid, vout, scriptSig.hex, sequence, and txinwitness for segwit
+            transactions; or coinbase and sequence for a coinbase input
+        vout: value, n, scriptPubKey.hex
+
+    Args:
+        raw_tx (str): The transaction in hex, as returned by
+            `getrawtransaction`.
+
+    Returns:
+        dict: The decoded transaction.
+
+    Raises:
+        MalformedTxError: If the transaction can't be parsed.
+    """
+    try:
+        data = binascii.unhexlify(raw_tx)
+    except (TypeError, binascii.Error):
+        raise MalformedTxError("Transaction isn't hex")
+    reader = _Reader(data)
+    version = reader.read_uint('<i')
+
+    #segwit transactions have a marker of 0 where the number of inputs would
+    #   be, followed by a flag of 1
+    is_segwit = data[4:6] == '\x00\x01'
+    if is_segwit:
+        reader.read(2)
+    body_start = reader.pos
+
+    vin = []
+    for _ in xrange(0, reader.read_varint()):
+        prev_txid = _hash_to_hex(reader.read(32))
+        prev_vout = reader.read_uint('<I')
+        script_sig = binascii.hexlify(reader.read_var_bytes())
+        sequence = reader.read_uint('<I')
+        if prev_txid == COINBASE_TXID and prev_vout == COINBASE_VOUT:
+            vin.append({'coinbase': script_sig, 'sequence': sequence})
+        else:
+            vin.append({'txid': prev_txid, 'vout': prev_vout,
+                        'scriptSig': {'hex': script_sig},
+                        'sequence': sequence})
+
+    vout = []
+    for i in xrange(0, reader.read_varint()):
+        value = reader.read_uint('<q')
+        script_pub_key = binascii.hexlify(reader.read_var_bytes())
+        vout.append({'value': value, 'n': i,
+                     'scriptPubKey': {'hex': script_pub_key}})
+    body_end = reader.pos
+
+    if is_segwit:
+        for tx_input in vin:
+            witness = [binascii.hexlify(reader.read_var_bytes())
+                       for _ in xrange(0, reader.read_varint())]
+            if witness:
+                tx_input['txinwitness'] = witness
+    locktime_bytes = reader.read(4)
+    if reader.pos != len(data):
+        raise MalformedTxError("Unexpected data after transaction")
+
+    return {
+        'txid': get_txid(data[0:4] + data[body_start:body_end] +
+                         locktime_bytes),
+        'version': version,
+        'size': len(data),
+        'locktime': struct.unpack('<I', locktime_bytes)[0],
+        'vin': vin,
+        'vout': vout
+    }
+
+def _varint(num):
+    """Serialize a Bitcoin variable length integer."""
+    if num < 0xfd:
+        return chr(num)
+    elif num <= 0xffff:
+        return '\xfd' + struct.pack('<H', num)
+    elif num <= 0xffffffff:
+        return '\xfe' + struct.pack('<I', num)
+    return '\xff' + struct.pack('<Q', num)
+
+def _var_bytes(hex_str):
+    """Serialize hex data prefixed by its length."""
+    data = binascii.unhexlify(hex_str)
+    return _varint(len(data)) + data
+
+def encode_raw_tx(decoded_tx):
+    """Serialize a transaction decoded as by `decode_raw_tx`.
+
+    Fields other than txids, output indexes and values may be omitted, and
+    default to empty scripts, final sequence numbers, version 1 and locktime
+    0. The transaction is serialized with witness data if any input has some.
+
+    Returns:
+        str: The transaction in hex.
+    """
+    is_segwit = any(tx_input.get('txinwitness')
+                    for tx_input in decoded_tx['vin'])
+    parts = [struct.pack('<i', decoded_tx.get('version', 1))]
+    if is_segwit:
+        parts.append('\x00\x01')
+    parts.append(_varint(len(decoded_tx['vin'])))
+    for tx_input in decoded_tx['vin']:
+        if 'coinbase' in tx_input:
+            parts.append(binascii.unhexlify(COINBASE_TXID) +
+                         struct.pack('<I', COINBASE_VOUT) +
+                         _var_bytes(tx_input['coinbase']))
+        else:
+            parts.append(binascii.unhexlify(tx_input['txid'])[::-1] +
+                         struct.pack('<I', tx_input['vout']) +
+                         _var_bytes(tx_input.get('scriptSig', {}).get('hex',
+                                                                      '')))
+        parts.append(struct.pack('<I', tx_input.get('sequence',
+                                                     DEFAULT_SEQUENCE)))
+    parts.append(_varint(len(decoded_tx['vout'])))
+    for output in decoded_tx['vout']:
+        parts.append(struct.pack('<q', output['value']) +
+                     _var_bytes(output.get('scriptPubKey', {}).get('hex', '')))
+    if is_segwit:
+        for tx_input in decoded_tx['vin']:
+            witness = tx_input.get('txinwitness', [])
+            parts.append(_varint(len(witness)))
+            parts.extend(_var_bytes(item) for item in witness)
+    parts.append(struct.pack('<I', decoded_tx.get('locktime', 0)))
+    return binascii.hexlify(''.join(parts))
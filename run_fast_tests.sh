@@ -0,0 +1 @@
+python -m unittest discover -p "*_fast_test.py" test
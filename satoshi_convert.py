@@ -1,10 +1,24 @@
-"""Convert any BTC float amount into satoshis as integer.
+"""Convert any BTC amount into satoshis as integer.
 
 From https://en.bitcoin.it/wiki/Proper_Money_Handling_(JSON-RPC)
+
+Amounts should be converted once, when JSON is parsed, by having the parser
+read them as `Decimal` and passing them to `btc_to_satoshis`, so the rest of
+the code only ever handles integer satoshis.
 """
+from decimal import Decimal
 
 def float_to_satoshis(value):
     return long(round(float(value) * 1e8))
 
 def satoshis_to_float(amount):
     return float(int(amount) / 1e8)
+
+def btc_to_satoshis(value):
+    """Convert an exact BTC amount, e.g. a `Decimal` or int, into satoshis.
+
+    Floats are rounded to the nearest satoshi, as by `float_to_satoshis`.
+    """
+    if isinstance(value, float):
+        return float_to_satoshis(value)
+    return long(Decimal(value).scaleb(8).to_integral_value())
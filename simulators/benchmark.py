@@ -0,0 +1,332 @@
+"""Measures end-to-end throughput of replaying wallets and testing their sends.
+
+Each wallet is replayed with `Wallet`, and its sends are evaluated for HIT
+compliance by `wallet_simulation.evaluate_sends`, the pipeline that
+`wallet_simulation.test` runs, until a fixed budget of transactions has been
+processed. Wallets may be real WalletExplorer.com wallets, or synthetic ones
+generated locally and served by an in-process stand-in for bitcoind, which
+makes it possible to see how throughput scales with wallet size and with the
+mix of UTXOs independently of the network.
+
+Reported metrics:
+    * transactions replayed per second
+    * bitcoind RPC calls per transaction
+    * peak resident set size of the process
+    * 99th percentile latency of a send: the time from starting to replay up
+      to the send until its outcome is recorded
+
+Results can be saved as a baseline and later runs compared against it.
+
+Usage:
+    python -m simulators.benchmark --synthetic 2000 --send-ratio 0.3
+    python -m simulators.benchmark 3562f0c16b41b2f9 --save-baseline
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import time
+from decimal import Decimal
+
+import bitcoind_rpc #bitcoind_rpc.py
+import http #http.py
+import raw_tx #raw_tx.py
+from wallet import Wallet #wallet.py
+from simulators.hit import core
+from simulators.hit import wallet_simulation
+
+DEFAULT_TX_BUDGET = 1000
+
+DEFAULT_BASELINE_FILENAME = 'bench_baseline.json'
+
+#Metrics for which a lower value is better
+LOWER_IS_BETTER = ('rpc_calls_per_tx', 'peak_rss_kb', 'p99_send_latency_ms')
+
+class CountingProxy(object):
+    """Wraps an `AuthServiceProxy`, counting the RPC calls made through it."""
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.num_calls = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.proxy, name)
+        def call(*args):
+            """Count, then forward, one RPC call."""
+            self.num_calls += 1
+            return method(*args)
+        return call
+
+class SyntheticProxy(object):
+    """Stands in for bitcoind, serving the transactions of synthetic wallets.
+
+    Attributes:
+        raw_txs (Dict[str, str]): The raw hex of each transaction, by txid.
+    """
+    def __init__(self):
+        self.raw_txs = {}
+
+    def add_tx(self, decoded_tx):
+        """Serve a transaction given in the form of `raw_tx.decode_raw_tx`.
+
+        Returns:
+            str: The transaction's txid.
+        """
+        raw = raw_tx.encode_raw_tx(decoded_tx)
+        txid = raw_tx.decode_raw_tx(raw)['txid']
+        self.raw_txs[txid] = raw
+        return txid
+
+    def getrawtransaction(self, txid):
+        """Return the raw hex of a transaction."""
+        return self.raw_txs[txid]
+
+    def decoderawtransaction(self, raw):
+        """Decode a raw transaction, with values in BTC as bitcoind does."""
+        decoded_tx = raw_tx.decode_raw_tx(raw)
+        for vout in decoded_tx['vout']:
+            vout['value'] = Decimal(vout['value']).scaleb(-8)
+        return decoded_tx
+
+class SyntheticConnection(bitcoind_rpc.RPCConnection):
+    """An `RPCConnection` to a `SyntheticProxy` instead of bitcoind."""
+    def __init__(self, proxy):
+        self.conn = proxy
+
+class SyntheticWallet(Wallet):
+    """A randomly generated wallet that can be replayed without a network.
+
+    The wallet receives payments and makes sends, each spending a random
+    number of its UTXOs and returning change, as recorded by WalletExplorer.com
+    and bitcoind.
+
+    Args:
+        num_txs (int): Number of transactions in the wallet's history.
+        send_ratio (float): Probability that a transaction is a send, when the
+            wallet has funds.
+        max_inputs (int): Maximum number of UTXOs spent by a send.
+        seed (int): Seed of the random generator, so wallets are reproducible.
+        conn (`SyntheticConnection`): Connection whose proxy will serve the
+            generated transactions.
+    """
+    def __init__(self, num_txs, send_ratio, max_inputs, seed, conn):
+        self.num_txs = num_txs
+        self.send_ratio = send_ratio
+        self.max_inputs = max_inputs
+        self.seed = seed
+        self.proxy = conn.conn
+        super(SyntheticWallet, self).__init__(
+            'synthetic-%d-%d' % (seed, num_txs), iterate_until_send=True,
+            checkpoint_interval=None, conn=conn)
+
+    def fetch_txs(self, max_txs_download):
+        """Generate the wallet's history instead of downloading it."""
+        rand = random.Random(self.seed)
+        utxos = []
+        txs = []
+
+        def vout(amts):
+            """Returns decoded outputs paying the specified amounts."""
+            return [{'value': amt, 'n': i} for i, amt in enumerate(amts)]
+
+        for i in range(0, self.num_txs):
+            if utxos and rand.random() < self.send_ratio:
+                rand.shuffle(utxos)
+                num_inputs = rand.randint(1, min(self.max_inputs, len(utxos)))
+                inputs, utxos = utxos[:num_inputs], utxos[num_inputs:]
+                total = sum(utxo[2] for utxo in inputs)
+                spend = rand.randint(1, max(1, total / 2))
+                change = total - spend
+                txid = self.proxy.add_tx({
+                    'vin': [{'txid': utxo[0], 'vout': utxo[1]}
+                            for utxo in inputs],
+                    'vout': vout([spend, change] if change else [spend])})
+                if change:
+                    utxos.append((txid, 1, change))
+                tx_json = {'type': 'sent', 'outputs': [
+                    {'wallet_id': 'recipient', 'amount': spend}]}
+            else:
+                amt = rand.randint(10000, 100000000)
+                other_amt = amt + rand.randint(1, 100000)
+                #a random coinbase script makes each funding tx unique
+                funding_txid = self.proxy.add_tx({
+                    'vin': [{'coinbase': '%016x' % rand.getrandbits(64)}],
+                    'vout': vout([amt + other_amt])})
+                txid = self.proxy.add_tx({
+                    'vin': [{'txid': funding_txid, 'vout': 0}],
+                    'vout': vout([other_amt, amt])})
+                utxos.append((txid, 1, amt))
+                tx_json = {'type': 'received', 'amount': amt}
+            tx_json.update({'txid': txid, 'block_height': i, 'block_pos': 1})
+            txs.append(http.WalletTx(tx_json))
+        return txs
+
+class LatencyRecorder(object):
+    """Stands in for a `ResultStore`, timing each send as it's recorded.
+
+    Attributes:
+        start_times (Dict[str, float]): When replaying up to each send still
+            being evaluated started, by txid.
+        latencies (List[float]): The latency of each recorded send, appended
+            in place.
+    """
+    def __init__(self, latencies):
+        self.start_times = {}
+        self.latencies = latencies
+
+    def add(self, wallet_id, wallet_num_txs, txid, *outcome):
+        """Record the latency of a send whose outcome is being recorded."""
+        self.latencies.append(time.time() - self.start_times.pop(txid))
+
+def iter_budgeted_sends(test_wallet, tx_budget, metrics, recorder):
+    """Yields the snapshots of a wallet's sends while within the tx budget.
+
+    Args:
+        test_wallet (`Wallet`): Wallet created with `iterate_until_send=True`.
+        tx_budget (int): Maximum number of transactions to replay.
+        metrics (Dict): Running totals of earlier wallets.
+        recorder (`LatencyRecorder`): Notes when each send's replay starts.
+    """
+    sends = wallet_simulation.iter_wallet_sends(test_wallet)
+    while metrics['num_txs'] + test_wallet.tx_index < tx_budget:
+        send_start_time = time.time()
+        try:
+            send = next(sends)
+        except StopIteration:
+            return
+        recorder.start_times[send.txid] = send_start_time
+        yield send
+
+def replay(test_wallet, counting_proxy, tx_budget, metrics):
+    """Replay a wallet and evaluate its sends, within the tx budget.
+
+    Args:
+        test_wallet (`Wallet`): Wallet created with `iterate_until_send=True`.
+        counting_proxy (`CountingProxy`): Proxy the wallet's RPC calls go
+            through.
+        tx_budget (int): Maximum number of transactions to replay.
+        metrics (Dict): Running totals, updated in place.
+    """
+    test_wallet.conn.conn = counting_proxy
+    recorder = LatencyRecorder(metrics['send_latencies'])
+    start_calls = counting_proxy.num_calls
+    start_time = time.time()
+    try:
+        wallet_simulation.evaluate_sends(
+            test_wallet.wallet_label,
+            iter_budgeted_sends(test_wallet, tx_budget, metrics, recorder),
+            recorder)
+    finally:
+        metrics['elapsed'] += time.time() - start_time
+        metrics['num_txs'] += test_wallet.tx_index
+        metrics['rpc_calls'] += counting_proxy.num_calls - start_calls
+
+def summarize(metrics):
+    """Reduce the running totals to the reported metrics."""
+    latencies = sorted(metrics['send_latencies'])
+    p99_latency = 0.0
+    if latencies:
+        p99_latency = latencies[min(len(latencies) - 1,
+                                    int(len(latencies) * 0.99))]
+    num_txs = max(1, metrics['num_txs'])
+    return {
+        'num_txs': metrics['num_txs'],
+        'num_sends': len(latencies),
+        'txs_per_sec': metrics['num_txs'] / max(metrics['elapsed'], 1e-9),
+        'rpc_calls_per_tx': float(metrics['rpc_calls']) / num_txs,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'p99_send_latency_ms': p99_latency * 1000
+    }
+
+def print_results(results, baseline=None):
+    """Print the metrics, with the change relative to a baseline if given."""
+    for name in ('txs_per_sec', 'rpc_calls_per_tx', 'peak_rss_kb',
+                 'p99_send_latency_ms'):
+        line = "%-20s %12.2f" % (name, results[name])
+        if baseline is not None and baseline.get(name):
+            change = (results[name] - baseline[name]) * 100.0 / baseline[name]
+            verdict = 'unchanged'
+            if change:
+                better = (change < 0) == (name in LOWER_IS_BETTER)
+                verdict = 'better' if better else 'worse'
+            line += "  %+7.1f%% vs baseline (%s)" % (change, verdict)
+        print line
+    print "(%d txs, %d sends)" % (results['num_txs'], results['num_sends'])
+
+def positive_int(value):
+    """Parse a command line argument that must be an integer of at least 1."""
+    num = int(value)
+    if num < 1:
+        raise argparse.ArgumentTypeError("must be at least 1: %s" % value)
+    return num
+
+def main():
+    """Run the benchmark described by the command line."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark end-to-end wallet replay throughput.")
+    parser.add_argument('wallet_ids', nargs='*',
+                        help="WalletExplorer.com wallets to replay")
+    parser.add_argument('--synthetic', type=positive_int, metavar='NUM_TXS',
+                        help="replay synthetic wallets of this many txs")
+    parser.add_argument('--send-ratio', type=float, default=0.3,
+                        help="fraction of synthetic txs that are sends")
+    parser.add_argument('--max-inputs', type=int, default=5,
+                        help="maximum UTXOs spent by a synthetic send")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tx-budget', type=int, default=DEFAULT_TX_BUDGET,
+                        help="stop after replaying this many txs in total")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILENAME,
+                        help="file to compare results against")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="save the results as the new baseline")
+    args = parser.parse_args()
+    if not args.wallet_ids and args.synthetic is None:
+        parser.error("specify wallet IDs or --synthetic")
+
+    bitcoind_rpc.DECODED_TX_CACHE.clear()
+    wallet_simulation.FORM_MEMO.results.clear()
+    core.ENABLE_TX_PRINT = False
+    metrics = {'num_txs': 0, 'rpc_calls': 0, 'elapsed': 0.0,
+               'send_latencies': []}
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w') #silence the simulations
+    try:
+        if args.synthetic is not None:
+            seed = args.seed
+            while metrics['num_txs'] < args.tx_budget:
+                counting_proxy = CountingProxy(SyntheticProxy())
+                test_wallet = SyntheticWallet(
+                    args.synthetic, args.send_ratio, args.max_inputs, seed,
+                    SyntheticConnection(counting_proxy.proxy))
+                num_txs = metrics['num_txs']
+                replay(test_wallet, counting_proxy, args.tx_budget, metrics)
+                if metrics['num_txs'] == num_txs:
+                    #another wallet wouldn't get any further
+                    break
+                seed += 1
+        for wallet_id in args.wallet_ids:
+            if metrics['num_txs'] >= args.tx_budget:
+                break
+            test_wallet = Wallet(wallet_label=wallet_id,
+                                 iterate_until_send=True)
+            replay(test_wallet, CountingProxy(test_wallet.conn.conn),
+                   args.tx_budget, metrics)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    results = summarize(metrics)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print "Saved baseline to %s" % args.baseline
+
+if __name__ == '__main__':
+    main()
@@ -6,3 +6,4 @@ http://docs.python-guide.org/en/latest/writing/structure/
 """
 
 from .core import simulate_standard_form, simulate_alternate_form
+from .memo import FormMemo
@@ -0,0 +1,187 @@
+"""Explores alternate histories in which a wallet's sends were made as HITs.
+
+At each send of a real wallet, its history forks: in the new branch, the send
+is replaced by a simulated Heterogeneous Input Transaction paying the same
+desired spend, and the branch then continues through the rest of the wallet's
+history. It receives the same payments as the real wallet, and makes each of
+the later sends as a HIT as well, until it can't afford one.
+
+Every UTXO set is a `UTXOState`, so forking a branch costs nothing, each
+transaction applied to a branch costs O(log n), and all branches share the
+parts of their UTXO sets they have in common. This keeps thousands of
+branches per wallet affordable.
+
+Usage:
+    python -m simulators.hit.alternate_history [wallet_id ...]
+"""
+import json
+import sys
+
+from wallet import Wallet #wallet.py
+import http #http.py
+from utxo_state import UTXOState #utxo_state.py
+from . import core
+from .core import NotEnoughFundsError
+from .memo import STANDARD_FORM, ALTERNATE_FORM
+from .wallet_simulation import (FILE_JSON_LIST_OF_WALLET_IDS, MAX_NUM_WALLETS,
+                                MAX_TXS_PER_WALLET)
+
+ENABLE_DEBUG_PRINT = False
+
+#Fork at most this many sends of each wallet, starting from the first
+MAX_BRANCHES_PER_WALLET = None # Set to None to disable
+
+def make_hit(state, desired_spend, txid):
+    """Simulate a HIT paying the desired spend from a UTXO set.
+
+    Standard form is tried first, then alternate form. The first output of
+    the HIT is the payment, and its other outputs are change back to the
+    wallet, identified by the synthetic txid.
+
+    Args:
+        state (`UTXOState`): The wallet's UTXOs before the HIT.
+        desired_spend (int): The amount to pay, in satoshis.
+        txid (str): Synthetic txid to give the change outputs.
+
+    Returns:
+        (`UTXOState`, str): The wallet's UTXOs after the HIT, and the form it
+            was made in.
+
+    Raises:
+        NotEnoughFundsError: If neither form can be made.
+    """
+    utxo_vals = state.get_utxo_vals()
+    try:
+        inputs, outputs = core.simulate_standard_form(list(utxo_vals),
+                                                      desired_spend)
+        form = STANDARD_FORM
+    except NotEnoughFundsError:
+        inputs, outputs = core.simulate_alternate_form(list(utxo_vals),
+                                                       desired_spend)
+        form = ALTERNATE_FORM
+    for amt in inputs:
+        state = state.remove(state.find_by_amount(amt))
+    for output_index, amt in enumerate(outputs):
+        if output_index > 0:
+            state = state.add((txid, output_index, amt))
+    return state, form
+
+class Branch(object):
+    """One alternate history of a wallet.
+
+    Attributes:
+        fork_tx_index (int): Index in the wallet's history of the send at
+            which this branch forked from the real history.
+        state (`UTXOState`): The branch's current UTXO set.
+        num_standard (int): Number of sends made in standard form.
+        num_alternate (int): Number of sends made in alternate form.
+        failed_tx_index (Optional[int]): Index of the send that the branch
+            couldn't make as a HIT, ending the branch, or None if it's active.
+    """
+    def __init__(self, fork_tx_index, state):
+        self.fork_tx_index = fork_tx_index
+        self.state = state
+        self.num_standard = 0
+        self.num_alternate = 0
+        self.failed_tx_index = None
+
+    def is_active(self):
+        """Returns whether the branch has made all of its sends so far."""
+        return self.failed_tx_index is None
+
+    def receive(self, utxos):
+        """Apply a payment received by the wallet."""
+        self.state = self.state.apply([], utxos)
+
+    def send(self, tx_index, txid, desired_spend):
+        """Make the wallet's send at `tx_index` as a HIT.
+
+        The branch ends if the HIT can't be made.
+        """
+        try:
+            self.state, form = make_hit(
+                self.state, desired_spend, "%s:%d" % (txid, self.fork_tx_index))
+        except NotEnoughFundsError:
+            self.failed_tx_index = tx_index
+            return
+        if form == STANDARD_FORM:
+            self.num_standard += 1
+        else:
+            self.num_alternate += 1
+
+def explore(test_wallet, max_branches=MAX_BRANCHES_PER_WALLET):
+    """Replay a wallet, forking an alternate history at each of its sends.
+
+    Args:
+        test_wallet (`Wallet`): A wallet that hasn't been iterated yet.
+        max_branches (Optional[int]): Fork at most this many sends.
+
+    Returns:
+        List[`Branch`]: The branches, in the order they forked.
+    """
+    real_state = UTXOState()
+    branches = []
+    while test_wallet.tx_index < test_wallet.get_num_txs():
+        tx_index = test_wallet.tx_index
+        if test_wallet.is_next_tx_send():
+            if max_branches is None or len(branches) < max_branches:
+                branches.append(Branch(tx_index, real_state))
+            txid = test_wallet.txs[tx_index].txid
+            desired_spend = test_wallet.get_current_desired_spend()
+            for branch in branches:
+                if branch.is_active():
+                    branch.send(tx_index, txid, desired_spend)
+            test_wallet.next_tx()
+        else:
+            test_wallet.next_tx()
+            for branch in branches:
+                if branch.is_active():
+                    branch.receive(test_wallet.last_added_utxos)
+        real_state = real_state.apply(test_wallet.last_removed_utxos,
+                                      test_wallet.last_added_utxos)
+    return branches
+
+def main():
+    """Explore the alternate histories of the wallets on the command line.
+
+    If none are given, the wallets in `FILE_JSON_LIST_OF_WALLET_IDS` are used.
+    """
+    wallet_ids = sys.argv[1:]
+    if not wallet_ids:
+        with open(FILE_JSON_LIST_OF_WALLET_IDS) as json_file:
+            wallet_ids = json.load(json_file)
+        if MAX_NUM_WALLETS is not None:
+            wallet_ids = wallet_ids[:MAX_NUM_WALLETS]
+    core.ENABLE_TX_PRINT = False
+
+    for wallet_id in wallet_ids:
+        try:
+            test_wallet = Wallet(wallet_label=wallet_id,
+                                 max_txs_download=MAX_TXS_PER_WALLET)
+        except http.WalletNotFoundError:
+            print "Skipped %s because it's missing from API" % wallet_id
+            continue
+        except http.MaxTransactionsExceededError:
+            print "Skipped %s because it has too many txs" % wallet_id
+            continue
+        branches = explore(test_wallet)
+        num_completed = len([branch for branch in branches
+                             if branch.is_active()])
+        print(("%s: %d alternate histories, %d of which made every send as a "
+               "HIT; %d standard and %d alternate form sends in total") %
+              (wallet_id, len(branches), num_completed,
+               sum(branch.num_standard for branch in branches),
+               sum(branch.num_alternate for branch in branches)))
+        for branch in branches:
+            dprint("Fork at tx %d: %d standard, %d alternate, failed at %s, "
+                   "%s" % (branch.fork_tx_index, branch.num_standard,
+                           branch.num_alternate, str(branch.failed_tx_index),
+                           repr(branch.state)))
+
+def dprint(msg):
+    """Debug print statements."""
+    if ENABLE_DEBUG_PRINT:
+        print "DEBUG: %s" % msg
+
+if __name__ == "__main__":
+    main()
@@ -8,48 +8,143 @@ https://github.com/OpenBitcoinPrivacyProject/rfc/blob/master/bips/obpp-03.mediaw
 
 import copy
 import math
+import threading
 
 ENABLE_DEBUG_PRINT = False
 
+#Print the inputs and outputs of each simulated transaction, or that there
+#   weren't enough funds for it
+ENABLE_TX_PRINT = True
+
+#Per-thread switch for printing simulated transactions, see `set_thread_print`
+_THREAD_PRINT = threading.local()
+
 #Don't try more than this many attempts for standard form transactions
 MAX_STANDARD_FORM_ATTEMPTS = 1000 #Set to None to disable
 
+#Increment whenever a change to the simulations may change their outcomes, so
+#   that outcomes saved by `memo.FormMemo` under an earlier version are
+#   discarded
+SIMULATION_VERSION = 1
+
 class NotEnoughFundsError(Exception):
     """Not enough funds to match HIT form."""
     pass
 
-def simulate_standard_form(availabile_utxo_vals, desired_spend):
+class StandardFormState(object):
+    """The last solution found by `simulate_standard_form`, to warm start it.
+
+    A wallet's UTXO set usually changes little between consecutive sends, so
+    the amount doubled for one send is likely to work for the next. A state
+    must only be used by one thread at a time, by searches made in the order
+    of the sends.
+
+    Attributes:
+        solution (Optional[(int, List[int], List[int])]): The doubled amount,
+            inputs and outputs of the last solution found, or None.
+        num_warm (int): Number of solutions found by repairing the previous
+            one.
+        num_cold (int): Number of full searches.
+    """
+    def __init__(self):
+        self.solution = None
+        self.num_warm = 0
+        self.num_cold = 0
+
+    def get_stats_str(self):
+        """Returns a one line summary of how often warm starts succeeded."""
+        return "%d warm starts, %d full searches" % (self.num_warm,
+                                                     self.num_cold)
+
+def get_warm_start_amts(prev_amt, desired_spend, max_amt_to_double, step):
+    """Returns the amounts to double that a warm start should try first.
+
+    Only amounts the full search would also try are returned, namely the ones
+    nearest `prev_amt` on its grid of `step` from `desired_spend`, so a warm
+    start succeeds only if the full search would.
+    """
+    offset = prev_amt - desired_spend
+    if offset % step == 0:
+        amts = [prev_amt]
+    else:
+        amts = [prev_amt + step - offset % step, prev_amt - offset % step]
+    return [amt for amt in amts if desired_spend <= amt <= max_amt_to_double]
+
+def simulate_standard_form(availabile_utxo_vals, desired_spend, state=None):
     """Determines whether standard form is possible based on utxos and spend.
 
+    With a `state`, the amount doubled by the previous solution is tried
+    first, and the full search from `desired_spend` up is only made if that
+    fails. The previous inputs and outputs are reused without matching again
+    if they're still the largest UTXO values, since matching would select
+    them again. Whether standard form is possible doesn't depend on the state,
+    but the solution returned may double a larger amount than the full search
+    would.
+
+    Args:
+        availabile_utxo_vals (List[int]): UTXO values available as inputs.
+        desired_spend (int): The amount the user wants to send.
+        state (Optional[`StandardFormState`]): The previous solution for the
+            same wallet, which is updated with the new one.
+
+    Returns:
+        (List[int], List[int]): The input and output values of the simulated
+            transaction. The first two outputs are the doubled amount, which is
+            at least the desired spend.
+
     Raises:
         NotEnoughFundsError: If there are not enough funds to match the standard
             form.
     """
     if len(availabile_utxo_vals) <= 1:
-        print 'Not enough funds for standard form for this transaction.'
+        print_not_enough_funds(form="standard")
         raise NotEnoughFundsError
     if sum(availabile_utxo_vals) < desired_spend * 2:
-        print 'Not enough funds for standard form for this transaction.'
+        print_not_enough_funds(form="standard")
         raise NotEnoughFundsError
 
-    solution_found = False
     max_amt_to_double = sum(availabile_utxo_vals) / 2
     step = 1
     if MAX_STANDARD_FORM_ATTEMPTS is not None:
         step = int(math.ceil((max_amt_to_double - desired_spend + 1) * 1.0 /
                              MAX_STANDARD_FORM_ATTEMPTS))
+
+    solution = None if state is None else state.solution
+    if solution is not None:
+        prev_amt, prev_inputs, prev_outputs = solution
+        largest_vals = sorted(availabile_utxo_vals,
+                              reverse=True)[:len(prev_inputs)]
+        for amt_to_double in get_warm_start_amts(
+                prev_amt, desired_spend, max_amt_to_double, step):
+            if amt_to_double == prev_amt and largest_vals == prev_inputs:
+                print_tx(form="standard", inputs=prev_inputs,
+                         outputs=prev_outputs)
+                state.num_warm += 1
+                return list(prev_inputs), list(prev_outputs)
+            try:
+                inputs, outputs = match_standard_form(
+                    availabile_utxo_vals,
+                    required_outputs=[amt_to_double, amt_to_double])
+            except NotEnoughFundsError:
+                continue
+            state.solution = (amt_to_double, inputs, outputs)
+            state.num_warm += 1
+            return inputs, outputs
+
+    if state is not None:
+        state.num_cold += 1
     for amt_to_double in range(desired_spend, max_amt_to_double + 1, step):
         required_outputs = [amt_to_double, amt_to_double]
         try:
-            match_standard_form(availabile_utxo_vals,
-                                required_outputs=required_outputs)
-            solution_found = True
-            break
+            inputs, outputs = match_standard_form(
+                availabile_utxo_vals, required_outputs=required_outputs)
         except NotEnoughFundsError:
-            pass
-    if not solution_found:
-        print 'Not enough funds for standard form for this transaction.'
-        raise NotEnoughFundsError
+            continue
+        if state is not None:
+            state.solution = (amt_to_double, inputs, outputs)
+        return inputs, outputs
+    print_not_enough_funds(form="standard")
+    raise NotEnoughFundsError
 
 def match_standard_form(available_utxo_vals, required_outputs=None):
     """Tries to match standard form using outputs that MUST appear in the tx.
@@ -65,6 +160,9 @@ def match_standard_form(available_utxo_vals, required_outputs=None):
             inputs.
         required_outputs (Optional[List[int]]): Values that must be included in
             the outputs, e.g. as the user's desired spend.
+    Returns:
+        (List[int], List[int]): The input and output values of the matched
+            transaction.
     Raises:
         NotEnoughFundsError: If there are not enough funds to match the standard
             form.
@@ -139,6 +237,7 @@ def match_standard_form(available_utxo_vals, required_outputs=None):
                               'and outputs=%s') % (str(inputs), str(outputs)))
 
     print_tx(form="standard", inputs=inputs, outputs=outputs)
+    return inputs, outputs
 
 def add_largest_input(remaining_utxos, inputs):
     """Add the largest utxo value in the remaining set to the inputs.
@@ -157,6 +256,18 @@ def balance_outputs_with_new_inputs(remaining_utxos, inputs, outputs):
     while sum(inputs) < sum(outputs) or len(inputs) < len(outputs):
         add_largest_input(remaining_utxos, inputs)
 
+def set_thread_print(enabled):
+    """Enable or disable printing of simulated transactions in this thread.
+
+    Lets worker threads simulate transactions without printing them, so that
+    the thread collecting their results can print them in order.
+    """
+    _THREAD_PRINT.enabled = enabled
+
+def is_thread_print_enabled():
+    """Returns whether `set_thread_print` left printing enabled."""
+    return getattr(_THREAD_PRINT, 'enabled', True)
+
 def print_tx(form, inputs, outputs):
     """Print details about the transaction.
 
@@ -165,6 +276,8 @@ def print_tx(form, inputs, outputs):
         inputs (List[int]): Input values
         outputs (List[int]): Output values
     """
+    if not ENABLE_TX_PRINT or not is_thread_print_enabled():
+        return
     print "Transaction: %s form" % form
     print "\tInputs:"
     for tx_input in inputs:
@@ -173,6 +286,19 @@ def print_tx(form, inputs, outputs):
     for tx_output in outputs:
         print "\t\t%d" % tx_output
 
+def print_not_enough_funds(form):
+    """Print that there weren't enough funds for a transaction.
+
+    Args:
+        form (str): Standard form or alternate form.
+    """
+    if not ENABLE_TX_PRINT or not is_thread_print_enabled():
+        return
+    if form == "standard":
+        print 'Not enough funds for standard form for this transaction.'
+    else:
+        print "Not enough funds for alternative form for this transaction."
+
 def break_into_parts(int_val, num_parts):
     """Creates a list of integers that add up to the specified value."""
     assert isinstance(int_val, int) or isinstance(int_val, long)
@@ -224,6 +350,11 @@ def alternate_form_round(avail_utxo_vals, inputs, outputs, desired_spend):
 def simulate_alternate_form(avail_utxo_vals, desired_spend):
     """Determines whether alternate form is possible based on utxos and spend.
 
+    Returns:
+        (List[int], List[int]): The input and output values of the simulated
+            transaction. The first output is the desired spend, which appears
+            twice.
+
     Raises:
         NotEnoughFundsError: If there are not enough funds to match the
         alternate form.
@@ -233,24 +364,25 @@ def simulate_alternate_form(avail_utxo_vals, desired_spend):
     outputs = []
 
     if desired_spend * 2 > sum(avail_utxo_vals):
-        print "Not enough funds for alternative form for this transaction."
+        print_not_enough_funds(form="alternate")
         raise NotEnoughFundsError
 
     #round 1
     try:
         alternate_form_round(avail_utxo_vals, inputs, outputs, desired_spend)
     except NotEnoughFundsError:
-        print "Not enough funds for alternative form for this transaction."
+        print_not_enough_funds(form="alternate")
         raise
 
     #Repeat step 1 to create a second spend output and change output.
     try:
         alternate_form_round(avail_utxo_vals, inputs, outputs, desired_spend)
     except NotEnoughFundsError:
-        print "Not enough funds for alternative form for this transaction."
+        print_not_enough_funds(form="alternate")
         raise
 
     print_tx(form="alternate", inputs=inputs, outputs=outputs)
+    return inputs, outputs
 
 def dprint(data):
     """Print debug information, if flag is set to True."""
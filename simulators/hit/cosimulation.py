@@ -0,0 +1,152 @@
+"""Tests HIT compliance of many wallets in a single chronological pass.
+
+`wallet_simulation` replays each wallet on its own, so a transaction shared by
+several wallets of the batch, e.g. one wallet paying another, is fetched and
+decoded once per wallet. Here the histories of all wallets are merged by
+(block_height, block_pos) into one time-ordered stream instead. Every
+occurrence of a transaction in the stream is adjacent to the others, so it's
+decoded once and then applied to each affected wallet from the shared decoded
+tx cache, and each wallet is tested for HIT compliance just before each of its
+sends, exactly as in `wallet_simulation.test`.
+
+Transactions not yet in a block have no height or position, and are ordered
+after all transactions that are.
+"""
+import heapq
+import json
+import sys
+
+from wallet import Wallet #wallet.py
+import http #http.py
+import bitcoind_rpc #bitcoind_rpc.py
+import outpoint_index #outpoint_index.py
+from .wallet_simulation import (evaluate_send, FILE_JSON_LIST_OF_WALLET_IDS,
+                                MAX_NUM_WALLETS, MAX_TXS_PER_WALLET)
+
+ENABLE_DEBUG_PRINT = False
+
+#Block height and position given to transactions that aren't in a block yet
+NOT_IN_BLOCK = sys.maxint
+
+def load_wallets(wallet_ids, conn):
+    """Download the histories of the specified wallets.
+
+    Wallets missing from the API or with too many transactions are skipped.
+
+    Returns:
+        List[`Wallet`]
+    """
+    wallets = []
+    for wallet_id in wallet_ids:
+        try:
+            wallets.append(Wallet(wallet_label=wallet_id,
+                                  max_txs_download=MAX_TXS_PER_WALLET,
+                                  conn=conn))
+        except http.WalletNotFoundError:
+            print "Skipped %s because it's missing from API" % wallet_id
+        except http.MaxTransactionsExceededError:
+            print "Skipped %s because it has too many txs" % wallet_id
+    return wallets
+
+def get_block_position(txn):
+    """Returns the (block_height, block_pos) a transaction is ordered by."""
+    if txn.block_height is None:
+        return (NOT_IN_BLOCK, NOT_IN_BLOCK)
+    if txn.block_pos is None:
+        return (txn.block_height, NOT_IN_BLOCK)
+    return (txn.block_height, txn.block_pos)
+
+def iter_wallet_events(wallet_pos, wallet):
+    """Yields a sortable event for each transaction in a wallet's history.
+
+    Each event is a tuple of (block_height, block_pos, txid, wallet_pos). The
+    txid keeps occurrences of the same transaction in different wallets next
+    to each other, and the position of the wallet in the batch breaks ties.
+    The events are yielded in the order the wallet replays its transactions,
+    which should be by block position. A transaction listed after one in a
+    later block takes that one's position instead, so the events stay sorted
+    as `heapq.merge` requires.
+    """
+    prev_position = None
+    for txn in wallet.txs:
+        position = max(get_block_position(txn), prev_position)
+        if position != get_block_position(txn):
+            dprint("Tx %s of %s is out of block order" %
+                   (txn.txid, wallet.wallet_label))
+        prev_position = position
+        yield position + (txn.txid, wallet_pos)
+
+def iter_events(wallets):
+    """Merges the events of the wallets into one stream, in block order."""
+    return heapq.merge(*[iter_wallet_events(wallet_pos, wallet)
+                         for wallet_pos, wallet in enumerate(wallets)])
+
+def cosimulate(wallets):
+    """Replay all wallets together and test each of their sends.
+
+    A wallet whose replay fails is reported and dropped from the rest of the
+    run, without affecting the other wallets.
+
+    Args:
+        wallets (List[`Wallet`]): Wallets that have not been iterated yet.
+
+    Returns:
+        Dict[str, List[int]]: For each wallet label, the number of its sends
+            that were compliant with [both forms, standard form only,
+            alternate form only, neither form].
+    """
+    results = dict((wallet.wallet_label, [0, 0, 0, 0]) for wallet in wallets)
+    failed = set()
+    for block_height, _, txid, wallet_pos in iter_events(wallets):
+        if wallet_pos in failed:
+            continue
+        wallet = wallets[wallet_pos]
+        try:
+            if wallet.tx_index > 0 and wallet.is_next_tx_send():
+                standard_success, alternate_success = evaluate_send(
+                    wallet.utxos, wallet.get_current_desired_spend())
+                if standard_success and alternate_success:
+                    results[wallet.wallet_label][0] += 1
+                elif standard_success:
+                    results[wallet.wallet_label][1] += 1
+                elif alternate_success:
+                    results[wallet.wallet_label][2] += 1
+                else:
+                    results[wallet.wallet_label][3] += 1
+            wallet.next_tx()
+        except Exception as err:
+            print(("WARNING: Dropping wallet %s after failing to process tx %s "
+                   "in block %s: %s") % (wallet.wallet_label, txid,
+                                         block_height, str(err)))
+            failed.add(wallet_pos)
+    return results
+
+def main():
+    """Co-simulate the wallets listed in `FILE_JSON_LIST_OF_WALLET_IDS`."""
+    with open(FILE_JSON_LIST_OF_WALLET_IDS) as json_file:
+        wallet_ids = json.load(json_file)
+    if MAX_NUM_WALLETS is not None:
+        wallet_ids = wallet_ids[:MAX_NUM_WALLETS]
+
+    wallets = load_wallets(wallet_ids, conn=bitcoind_rpc.RPCConnection())
+    print "Co-simulating %d wallets..." % len(wallets)
+    results = cosimulate(wallets)
+
+    totals = [0, 0, 0, 0]
+    for wallet_id, counts in sorted(results.iteritems()):
+        dprint("%s: %s" % (wallet_id, str(counts)))
+        totals = [total + count for total, count in zip(totals, counts)]
+    print(("Stats: Total txs standard & alternate compliant: %d; standard "
+           "only: %d; alternate only: %d; neither: %d") % tuple(totals))
+    print "Decoded tx cache: %s" % (
+        bitcoind_rpc.DECODED_TX_CACHE.get_stats_str())
+    print "Outpoint index: %s" % (
+        outpoint_index.OUTPOINT_INDEX.get_stats_str())
+
+def dprint(msg):
+    """Debug print statements."""
+    if ENABLE_DEBUG_PRINT:
+        print "DEBUG: %s" % msg
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Memoizes the outcome of HIT form simulations.
+
+Whether a standard or alternate form transaction can be built depends only on
+the multiset of available UTXO values and the desired spend, and the same
+combination comes up over and over: `random_simulation` draws from a small
+range of values, and real wallets often have nearly identical UTXO sets at
+consecutive sends. `FormMemo` canonicalizes each query by sorting the UTXO
+values, and remembers the transaction each form simulated, if any. The
+standard form transaction found by a warm started search also depends on the
+previous solution, so that is part of its query.
+
+Saved outcomes are only reused by runs with the same `MEMO_FORMAT`,
+`core.SIMULATION_VERSION` and `core.MAX_STANDARD_FORM_ATTEMPTS`.
+"""
+import functools
+import os
+import tempfile
+import cPickle as pickle
+
+import cache #cache.py
+from . import core
+from .core import NotEnoughFundsError
+
+#Bounds the memory used by a memo by the total number of UTXO values in its
+#   keys and of input and output values in its transactions.
+MAX_MEMO_SIZE = 1000000
+
+#Increment when the layout of memo keys or outcomes changes
+MEMO_FORMAT = 2
+
+STANDARD_FORM = 'standard'
+ALTERNATE_FORM = 'alternate'
+
+#Returned by lookups of queries that haven't been memoized
+NOT_MEMOIZED = object()
+
+def get_simulation_version():
+    """Returns the settings that memoized outcomes are only valid for."""
+    return (MEMO_FORMAT, core.SIMULATION_VERSION,
+            core.MAX_STANDARD_FORM_ATTEMPTS)
+
+class FormMemo(object):
+    """LRU memo of HIT form outcomes, optionally persisted to disk.
+
+    The methods mirror `core.simulate_standard_form` and
+    `core.simulate_alternate_form`, returning the simulated transaction or
+    raising `NotEnoughFundsError` when the form isn't possible, but only run
+    the simulation for combinations of UTXO values and desired spend that
+    aren't already in the memo. Memoized outcomes are printed as the
+    simulation would have printed them, so the output doesn't depend on what
+    is in the memo. The caller's list of UTXO values is never modified.
+
+    Attributes:
+        path (str): File the memo is loaded from and saved to, or None.
+        version (tuple): `get_simulation_version` when the results were
+            simulated. The results are discarded if it changes.
+        results (`LRUCache`): Maps (form, sorted UTXO values, desired spend,
+            previous solution) to the (inputs, outputs) of the simulated
+            transaction, or None if the form wasn't possible. The previous
+            solution is None except for warm started standard form searches.
+
+    Args:
+        max_size (Optional[int]): Maximum total number of UTXO values across
+            all memoized queries and transactions.
+        path (Optional[str]): File to load previously saved results from, and
+            that `save` writes to. Results saved under a different
+            `get_simulation_version` are ignored.
+    """
+    def __init__(self, max_size=MAX_MEMO_SIZE, path=None):
+        self.path = path
+        self.version = get_simulation_version()
+        self.results = cache.LRUCache(max_size=max_size)
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as memo_file:
+                saved = pickle.load(memo_file)
+            if (isinstance(saved, dict) and
+                    saved.get('version') == self.version):
+                for key, outcome in saved['results']:
+                    self.put(key, outcome)
+
+    def put(self, key, outcome):
+        """Memoize the outcome of a simulation."""
+        size = len(key[1]) + 1
+        if key[3] is not None:
+            size += len(key[3][1]) + len(key[3][2])
+        if outcome is not None:
+            size += len(outcome[0]) + len(outcome[1])
+        self.results.put(key, outcome, size=size)
+
+    def save(self):
+        """Write the memoized results to `path`, atomically."""
+        assert self.path is not None
+        if os.path.dirname(self.path):
+            cache.make_dirs(os.path.dirname(self.path))
+        tmp_fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+        with os.fdopen(tmp_fd, 'wb') as memo_file:
+            pickle.dump({'version': self.version,
+                         'results': self.results.items()},
+                        memo_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.path)
+
+    def simulate(self, form, simulate_func, utxo_vals, desired_spend,
+                 prev_solution=None):
+        """Look up or run one form's simulation.
+
+        Args:
+            prev_solution (Optional[(int, Tuple[int], Tuple[int])]): The
+                solution the simulation is warm started from, if any.
+
+        Returns:
+            (List[int], List[int]): The input and output values of the
+                simulated transaction.
+
+        Raises:
+            NotEnoughFundsError: If there are not enough funds to match the
+                form.
+        """
+        version = get_simulation_version()
+        if version != self.version:
+            #the simulations changed since these results were memoized
+            self.version = version
+            self.results.clear()
+        key = (form, tuple(sorted(utxo_vals, reverse=True)), desired_spend,
+               prev_solution)
+        outcome = self.results.get(key, NOT_MEMOIZED)
+        if outcome is NOT_MEMOIZED:
+            try:
+                inputs, outputs = simulate_func(list(key[1]), desired_spend)
+                outcome = (tuple(inputs), tuple(outputs))
+            except NotEnoughFundsError:
+                outcome = None
+            self.put(key, outcome)
+        elif outcome is None:
+            core.print_not_enough_funds(form=form)
+        else:
+            core.print_tx(form=form, inputs=outcome[0], outputs=outcome[1])
+        if outcome is None:
+            raise NotEnoughFundsError
+        return list(outcome[0]), list(outcome[1])
+
+    def simulate_standard_form(self, utxo_vals, desired_spend, state=None):
+        """Memoized version of `core.simulate_standard_form`.
+
+        The transaction found depends on the solution in `state`, so that is
+        part of the key. When the outcome is memoized, `state` is updated with
+        the solution as the search would have updated it, but its counts of
+        searches are not, since no search is made.
+        """
+        prev_solution = None
+        if state is not None and state.solution is not None:
+            prev_amt, prev_inputs, prev_outputs = state.solution
+            prev_solution = (prev_amt, tuple(prev_inputs), tuple(prev_outputs))
+        inputs, outputs = self.simulate(
+            STANDARD_FORM,
+            functools.partial(core.simulate_standard_form, state=state),
+            utxo_vals, desired_spend, prev_solution)
+        if state is not None:
+            #the first two outputs are the doubled amount
+            state.solution = (outputs[0], inputs, outputs)
+        return inputs, outputs
+
+    def simulate_alternate_form(self, utxo_vals, desired_spend):
+        """Memoized version of `core.simulate_alternate_form`."""
+        return self.simulate(ALTERNATE_FORM, core.simulate_alternate_form,
+                             utxo_vals, desired_spend)
+
+    def get_stats_str(self):
+        """Returns a one line summary of the memo's usage."""
+        return self.results.get_stats_str()
@@ -1,10 +1,20 @@
-"""Simulates the attempt to comply with the BIP using random wallet UTXOs."""
+"""Simulates the attempt to comply with the BIP using random wallet UTXOs.
 
+By default, `NUM_TESTS` random wallets are sampled. Run with `--exact` to
+instead enumerate every wallet and desired spend that can be sampled, and print
+the exact probability of each outcome.
+"""
+
+import bisect
+import math
+import sys
+from fractions import Fraction
 from random import randint
 
 from . import core
 from .core import NotEnoughFundsError
 from .core import dprint
+from .memo import FormMemo
 
 MAX_UTXOS = 10
 
@@ -13,6 +23,11 @@ MAX_VALUE = 10
 
 NUM_TESTS = 10000
 
+#Remember the outcome of each combination of UTXO values and desired spend
+USE_MEMO = True
+
+MEMO = FormMemo()
+
 def generate_utxos():
     """Returns: List of utxo values as integers."""
     num_utxos = randint(1, MAX_UTXOS)
@@ -42,22 +57,208 @@ def test():
     desired_spend = generate_desired_spend(sum_avail_utxos)
     print "Desired Spend: %d" % desired_spend
 
+    simulate_standard_form = core.simulate_standard_form
+    simulate_alternate_form = core.simulate_alternate_form
+    if USE_MEMO:
+        simulate_standard_form = MEMO.simulate_standard_form
+        simulate_alternate_form = MEMO.simulate_alternate_form
+
     dprint("Attempting standard form...")
     try:
-        core.simulate_standard_form(available_utxos, desired_spend)
+        simulate_standard_form(available_utxos, desired_spend)
     except NotEnoughFundsError:
         standard_success = False
         print "Not enough funds for standard form."
 
     dprint("Attempting alternate form...")
     try:
-        core.simulate_alternate_form(available_utxos, desired_spend)
+        simulate_alternate_form(available_utxos, desired_spend)
     except NotEnoughFundsError:
         alternate_success = False
         print "Not enough funds for alternate form."
 
     return (standard_success, alternate_success)
 
+def get_alternate_successes(utxo_vals):
+    """Find the desired spends for which alternate form succeeds.
+
+    Equivalent to calling `core.simulate_alternate_form` for each desired spend
+    from 1 to the wallet's balance, but computed from prefix sums: the first
+    round consumes the shortest prefix of the UTXOs covering the spend, and the
+    second round succeeds if what remains covers it again.
+
+    Args:
+        utxo_vals (List[int]): UTXO values sorted from largest to smallest.
+
+    Returns:
+        List[bool]: Element d is whether a desired spend of d succeeds; element
+            0 is unused.
+    """
+    prefix_sums = []
+    running_sum = 0
+    for utxo_val in utxo_vals:
+        running_sum += utxo_val
+        prefix_sums.append(running_sum)
+    successes = [False]
+    for desired_spend in range(1, running_sum + 1):
+        if desired_spend * 2 > running_sum:
+            successes.append(False)
+            continue
+        round_1_end = bisect.bisect_left(prefix_sums, desired_spend)
+        successes.append(
+            running_sum - prefix_sums[round_1_end] >= desired_spend)
+    return successes
+
+def is_standard_match(utxo_vals, amt_to_double):
+    """Whether `core.match_standard_form` succeeds doubling the amount."""
+    try:
+        core.match_standard_form(utxo_vals,
+                                 required_outputs=[amt_to_double,
+                                                   amt_to_double])
+        return True
+    except NotEnoughFundsError:
+        return False
+
+def get_standard_successes(utxo_vals, inherited_matches):
+    """Find the desired spends for which standard form succeeds.
+
+    Equivalent to calling `core.simulate_standard_form` for each desired spend
+    from 1 to the wallet's balance. That function succeeds if any amount it
+    tries to double can be matched, and the amounts tried depend on the spend
+    only through their lower bound and step, so each amount's match is
+    computed once and shared between all spends.
+
+    Matches are also shared with wallets that extend this one with smaller
+    UTXOs: the greedy matching only ever takes the largest remaining UTXO, so
+    if it succeeds without running out of UTXOs, it succeeds identically when
+    smaller UTXOs are appended.
+
+    Args:
+        utxo_vals (List[int]): UTXO values sorted from largest to smallest.
+        inherited_matches (Set[int]): Amounts known to be matched by a wallet
+            whose UTXO values are a prefix of `utxo_vals`. Newly found matches
+            are added to this set.
+
+    Returns:
+        List[bool]: Element d is whether a desired spend of d succeeds; element
+            0 is unused.
+    """
+    balance = sum(utxo_vals)
+    successes = [False] * (balance + 1)
+    if len(utxo_vals) <= 1:
+        return successes
+    max_amt_to_double = balance / 2
+    known_matches = {}
+
+    def is_match(amt_to_double):
+        """Memoized `is_standard_match` for this wallet."""
+        if amt_to_double in inherited_matches:
+            return True
+        if amt_to_double not in known_matches:
+            known_matches[amt_to_double] = is_standard_match(utxo_vals,
+                                                             amt_to_double)
+            if known_matches[amt_to_double]:
+                inherited_matches.add(amt_to_double)
+        return known_matches[amt_to_double]
+
+    #With a step of 1, a spend succeeds iff it's at most the largest amount
+    #   that can be matched, so search for that amount from the top down.
+    largest_match = None
+    for desired_spend in range(1, max_amt_to_double + 1):
+        step = 1
+        if core.MAX_STANDARD_FORM_ATTEMPTS is not None:
+            step = int(math.ceil((max_amt_to_double - desired_spend + 1) * 1.0
+                                 / core.MAX_STANDARD_FORM_ATTEMPTS))
+        if step == 1:
+            if largest_match is None:
+                largest_match = 0
+                for amt_to_double in range(max_amt_to_double, 0, -1):
+                    if is_match(amt_to_double):
+                        largest_match = amt_to_double
+                        break
+            successes[desired_spend] = desired_spend <= largest_match
+        else:
+            successes[desired_spend] = any(
+                is_match(amt_to_double) for amt_to_double in
+                range(desired_spend, max_amt_to_double + 1, step))
+    return successes
+
+def enumerate_wallets(utxo_vals, multinomial, inherited_matches, counts):
+    """Tally the outcomes of every wallet extending `utxo_vals`.
+
+    Wallets are visited depth first as non-increasing sequences of UTXO values,
+    so each multiset of values is visited exactly once, after the wallet that
+    is its prefix.
+
+    Args:
+        utxo_vals (List[int]): UTXO values of the current wallet, sorted from
+            largest to smallest.
+        multinomial (int): Number of orderings of `utxo_vals` that
+            `generate_utxos` could produce.
+        inherited_matches (Set[int]): As for `get_standard_successes`.
+        counts (Dict): Maps (number of UTXOs, balance) to a list of weighted
+            counts of [both, standard only, alternate only, neither].
+    """
+    if utxo_vals:
+        standard_successes = get_standard_successes(utxo_vals,
+                                                    inherited_matches)
+        alternate_successes = get_alternate_successes(utxo_vals)
+        balance = sum(utxo_vals)
+        tally = counts.setdefault((len(utxo_vals), balance), [0, 0, 0, 0])
+        for desired_spend in range(1, balance + 1):
+            standard_success = standard_successes[desired_spend]
+            alternate_success = alternate_successes[desired_spend]
+            if standard_success and alternate_success:
+                tally[0] += multinomial
+            elif standard_success:
+                tally[1] += multinomial
+            elif alternate_success:
+                tally[2] += multinomial
+            else:
+                tally[3] += multinomial
+    if len(utxo_vals) == MAX_UTXOS:
+        return
+
+    max_next_val = utxo_vals[-1] if utxo_vals else MAX_VALUE
+    for next_val in range(max_next_val, MIN_VALUE - 1, -1):
+        num_equal = 1
+        while (num_equal <= len(utxo_vals) and
+               utxo_vals[-num_equal] == next_val):
+            num_equal += 1
+        enumerate_wallets(utxo_vals + [next_val],
+                          multinomial * (len(utxo_vals) + 1) / num_equal,
+                          set(inherited_matches), counts)
+
+def get_exact_probabilities():
+    """Compute the exact probability of each outcome of `test`.
+
+    Returns:
+        List[`Fraction`]: Probabilities of [both, standard only, alternate
+            only, neither].
+    """
+    print_tx_enabled = core.ENABLE_TX_PRINT
+    core.ENABLE_TX_PRINT = False
+    counts = {}
+    try:
+        enumerate_wallets([], 1, set(), counts)
+    finally:
+        core.ENABLE_TX_PRINT = print_tx_enabled
+
+    num_values = MAX_VALUE - MIN_VALUE + 1
+    probabilities = [Fraction(0)] * 4
+    for (num_utxos, balance), tally in counts.iteritems():
+        denominator = MAX_UTXOS * num_values ** num_utxos * balance
+        for i, count in enumerate(tally):
+            probabilities[i] += Fraction(count, denominator)
+    return probabilities
+
+def main_exact():
+    """Print the exact probability of each outcome."""
+    probabilities = get_exact_probabilities()
+    print(("Exact probabilities: %.6f%% compatible with both, %.6f%% standard "
+           "only, %.6f%% alternate only, %.6f%% neither.") %
+          tuple(float(probability) * 100 for probability in probabilities))
+
 def main():
     """Run a bunch of tests."""
     num_standard_only = 0
@@ -81,6 +282,11 @@ def main():
            "alternate only, %d neither.") %
           (NUM_TESTS, num_both, num_standard_only, num_alternate_only,
            num_neither))
+    if USE_MEMO:
+        print "Memo: %s" % MEMO.get_stats_str()
 
 if __name__ == "__main__":
-    main()
+    if '--exact' in sys.argv[1:]:
+        main_exact()
+    else:
+        main()
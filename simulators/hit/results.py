@@ -0,0 +1,150 @@
+"""Stores the outcome of every send tested for HIT compliance.
+
+`wallet_simulation` records each send it evaluates in a SQLite database, so
+new questions about a run can be answered with queries instead of repeating
+it. Block height stands in for time.
+
+Usage:
+    python -m simulators.hit.results [--by-size | --by-blocks N] [db_file]
+"""
+import argparse
+import math
+import os
+import sqlite3
+
+import cache #cache.py
+
+DEFAULT_RESULTS_FILENAME = 'cache/results.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sends (
+    wallet_id TEXT, txid TEXT, block_height INTEGER, wallet_num_txs INTEGER,
+    utxo_count INTEGER, utxo_total INTEGER, desired_spend INTEGER,
+    standard_success INTEGER, alternate_success INTEGER,
+    PRIMARY KEY (wallet_id, txid));
+CREATE INDEX IF NOT EXISTS sends_block_height ON sends (block_height);
+CREATE INDEX IF NOT EXISTS sends_wallet_num_txs ON sends (wallet_num_txs);
+"""
+
+#Counts of sends that were compliant with [both forms, standard form only,
+#   alternate form only, neither form], as returned by the queries below.
+COUNTS_SQL = """
+    SUM(standard_success AND alternate_success),
+    SUM(standard_success AND NOT alternate_success),
+    SUM(alternate_success AND NOT standard_success),
+    SUM(NOT standard_success AND NOT alternate_success)"""
+
+class ResultStore(object):
+    """A database of tested sends, one row per (wallet, send).
+
+    Args:
+        path (Optional[str]): Location of the database, which is created if
+            needed.
+    """
+    def __init__(self, path=DEFAULT_RESULTS_FILENAME):
+        if os.path.dirname(path):
+            cache.make_dirs(os.path.dirname(path))
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def add(self, wallet_id, wallet_num_txs, txid, block_height, utxo_vals,
+            desired_spend, standard_success, alternate_success):
+        """Record the outcome of a send, replacing any earlier outcome.
+
+        Args:
+            wallet_id (str): ID assigned by WalletExplorer.com.
+            wallet_num_txs (int): Number of txs in the wallet's history.
+            txid (str): Transaction hash of the send.
+            block_height (int): Height of the block containing the send.
+            utxo_vals (Sequence[int]): The amounts of the wallet's UTXOs just
+                before the send.
+            desired_spend (int): The amount the send intended to pay.
+            standard_success (bool): Whether standard form was possible.
+            alternate_success (bool): Whether alternate form was possible.
+        """
+        self.db.execute(
+            'INSERT OR REPLACE INTO sends VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (wallet_id, txid, block_height, wallet_num_txs, len(utxo_vals),
+             sum(utxo_vals), desired_spend,
+             bool(standard_success), bool(alternate_success)))
+
+    def commit(self):
+        """Write recorded outcomes to disk."""
+        self.db.commit()
+
+    def close(self):
+        """Commit and close the database."""
+        self.db.commit()
+        self.db.close()
+
+    def query(self, sql, params=()):
+        """Returns the rows of an arbitrary query over the `sends` table."""
+        return self.db.execute(sql, params).fetchall()
+
+    def get_totals(self):
+        """Returns the number of sends compliant with [both, standard only,
+        alternate only, neither] forms."""
+        row = self.db.execute('SELECT %s FROM sends' % COUNTS_SQL).fetchone()
+        return [count or 0 for count in row]
+
+    def get_totals_by_wallet_size(self):
+        """Returns `get_totals` for wallets in each power of 10 of txs.
+
+        Returns:
+            List[(int, List[int])]: The power of 10 and the totals.
+        """
+        totals = {}
+        rows = self.db.execute(
+            'SELECT wallet_num_txs, %s FROM sends GROUP BY wallet_num_txs' %
+            COUNTS_SQL)
+        for row in rows:
+            magnitude = int(math.log10(max(row[0], 1)))
+            counts = totals.setdefault(magnitude, [0, 0, 0, 0])
+            for i, count in enumerate(row[1:]):
+                counts[i] += count
+        return sorted(totals.items())
+
+    def get_totals_by_blocks(self, num_blocks):
+        """Returns `get_totals` for each range of `num_blocks` blocks.
+
+        Returns:
+            List[(int, List[int])]: The first block height of each range and
+                the totals.
+        """
+        rows = self.db.execute(
+            'SELECT (block_height / ?) * ? AS start, %s FROM sends '
+            'GROUP BY start ORDER BY start' % COUNTS_SQL,
+            (num_blocks, num_blocks))
+        return [(row[0], list(row[1:])) for row in rows]
+
+def format_totals(totals):
+    """Returns a summary of counts as returned by `get_totals`."""
+    return ("standard & alternate: %d; standard only: %d; alternate only: %d; "
+            "neither: %d") % tuple(totals)
+
+def main():
+    """Print totals from a results database."""
+    parser = argparse.ArgumentParser(
+        description="Summarize the sends recorded by wallet_simulation.")
+    parser.add_argument('path', nargs='?', default=DEFAULT_RESULTS_FILENAME)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--by-size', action='store_true',
+                       help="group by wallet size, in powers of 10 of txs")
+    group.add_argument('--by-blocks', type=int, metavar='NUM_BLOCKS',
+                       help="group by ranges of this many blocks")
+    args = parser.parse_args()
+
+    store = ResultStore(args.path)
+    if args.by_size:
+        for magnitude, totals in store.get_totals_by_wallet_size():
+            print "10^%d txs: %s" % (magnitude, format_totals(totals))
+    elif args.by_blocks:
+        for start, totals in store.get_totals_by_blocks(args.by_blocks):
+            print "Blocks %d-%d: %s" % (start, start + args.by_blocks - 1,
+                                        format_totals(totals))
+    else:
+        print "All sends: %s" % format_totals(store.get_totals())
+    store.close()
+
+if __name__ == '__main__':
+    main()
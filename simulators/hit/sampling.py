@@ -0,0 +1,255 @@
+"""Estimates the share of sends compatible with each HIT form by sampling.
+
+Rather than testing every send of every wallet, wallets are drawn at random
+within strata of similar size, measured by number of transactions on a log10
+scale, and each of their sends is tested with a fixed probability. Wallets are
+drawn from the stratum that has been sampled least in proportion to its size.
+
+The shares are estimated with a combined ratio estimator, treating each
+wallet as a cluster of sends, and reported with 95% confidence intervals
+after each wallet. Sampling stops once every interval is narrower than the
+target precision, or when every wallet has been sampled. Variance estimates
+from a handful of wallets are too unreliable to stop on, so the precision
+isn't considered known until `MIN_WALLETS_PER_STRATUM` wallets have been
+sampled from each stratum, or all of them if it has fewer.
+
+The intervals rely on a normal approximation, so they're somewhat optimistic
+when few wallets have been sampled.
+"""
+import math
+import random
+from multiprocessing.pool import ThreadPool
+
+import http #http.py
+
+#Target half-width of each 95% confidence interval, as a fraction
+DEFAULT_PRECISION = 0.02
+
+#Probability that each send of a sampled wallet is tested
+DEFAULT_SEND_SAMPLING_RATE = 1.0
+
+#Sample at least this many wallets from each stratum before trusting its
+#   variance estimate
+MIN_WALLETS_PER_STRATUM = 10
+
+#Number of wallets whose sizes are looked up at once
+NUM_SIZING_WORKERS = 16
+
+Z_95 = 1.96
+
+CATEGORIES = ('standard & alternate', 'standard only', 'alternate only',
+              'neither')
+
+def get_stratum(num_txs):
+    """Returns the stratum of a wallet with the specified number of txs."""
+    if num_txs < 1:
+        return 0
+    return int(math.log10(num_txs))
+
+def get_num_txs(wallet_id):
+    """Returns the number of txs in a wallet, or None if it can't be found."""
+    try:
+        return http.get_num_txs(wallet_id)
+    except Exception as err:
+        print "WARNING: Couldn't size wallet %s: %s" % (wallet_id, str(err))
+        return None
+
+def stratify(wallet_ids, num_workers=NUM_SIZING_WORKERS):
+    """Group wallets into strata by size.
+
+    Wallets that can't be found are left out.
+
+    Returns:
+        Dict[int, List[str]]: The wallet IDs in each stratum.
+    """
+    pool = ThreadPool(num_workers)
+    try:
+        sizes = pool.map(get_num_txs, wallet_ids)
+    finally:
+        pool.terminate()
+    strata = {}
+    for wallet_id, num_txs in zip(wallet_ids, sizes):
+        if num_txs is not None:
+            strata.setdefault(get_stratum(num_txs), []).append(wallet_id)
+    return strata
+
+def sample_wallet(wallet_id, send_sampling_rate, rand, iter_send_snapshots,
+                  evaluate_send):
+    """Test a random sample of a wallet's sends.
+
+    Wallets that are skipped by `iter_send_snapshots` have no sends to test.
+
+    Args:
+        wallet_id (str): ID assigned by WalletExplorer.com.
+        send_sampling_rate (float): Probability that each send is tested.
+        rand (`random.Random`): Random generator.
+        iter_send_snapshots (Callable): Yields the UTXO set and desired spend
+            of each send of a wallet, as `wallet_simulation.iter_send_snapshots`
+            does.
+        evaluate_send (Callable): Tests a send for both forms, as
+            `wallet_simulation.evaluate_send` does.
+
+    Returns:
+        List[int]: Number of sampled sends in each of `CATEGORIES`.
+    """
+    counts = [0, 0, 0, 0]
+    try:
+        for utxos, desired_spend in iter_send_snapshots(wallet_id):
+            if rand.random() >= send_sampling_rate:
+                continue
+            standard_success, alternate_success = evaluate_send(
+                utxos, desired_spend)
+            if standard_success and alternate_success:
+                counts[0] += 1
+            elif standard_success:
+                counts[1] += 1
+            elif alternate_success:
+                counts[2] += 1
+            else:
+                counts[3] += 1
+    except http.WalletNotFoundError:
+        print "Skipped %s because it's missing from API" % wallet_id
+    except http.MaxTransactionsExceededError:
+        print "Skipped %s because it has too many txs" % wallet_id
+    return counts
+
+class StratifiedEstimate(object):
+    """Running estimate of the share of sends in each category.
+
+    Attributes:
+        stratum_sizes (Dict[int, int]): Number of wallets in each stratum.
+        samples (Dict[int, List[List[int]]]): Counts of sampled sends in each
+            category for each wallet sampled, by stratum.
+
+    Args:
+        stratum_sizes (Dict[int, int]): Number of wallets in each stratum.
+    """
+    def __init__(self, stratum_sizes):
+        self.stratum_sizes = stratum_sizes
+        self.samples = dict((stratum, []) for stratum in stratum_sizes)
+
+    def add(self, stratum, counts):
+        """Add a sampled wallet's counts of sends in each category."""
+        self.samples[stratum].append(counts)
+
+    def get_num_sampled(self, stratum):
+        """Returns the number of wallets sampled from a stratum."""
+        return len(self.samples[stratum])
+
+    def get_num_sends(self):
+        """Returns the total number of sends tested."""
+        return sum(sum(counts) for samples in self.samples.itervalues()
+                   for counts in samples)
+
+    def get_next_stratum(self):
+        """Returns the stratum to sample next, or None if all are exhausted.
+
+        This is the stratum with the fewest samples in proportion to its size.
+        """
+        candidates = [(len(self.samples[stratum]) * 1.0 / size, stratum)
+                      for stratum, size in self.stratum_sizes.iteritems()
+                      if len(self.samples[stratum]) < size]
+        if not candidates:
+            return None
+        return min(candidates)[1]
+
+    def get_estimate(self, category):
+        """Estimate the share of sends in a category.
+
+        Returns:
+            (float, float): The estimated share and the half-width of its 95%
+                confidence interval. The half-width is infinite while a stratum
+                has fewer than `MIN_WALLETS_PER_STRATUM` samples.
+        """
+        weighted_total = 0.0
+        weighted_sends = 0.0
+        for stratum, samples in self.samples.iteritems():
+            if samples:
+                weight = self.stratum_sizes[stratum] * 1.0 / len(samples)
+                weighted_total += weight * sum(counts[category]
+                                               for counts in samples)
+                weighted_sends += weight * sum(sum(counts)
+                                               for counts in samples)
+        if weighted_sends == 0:
+            return (0.0, float('inf'))
+        share = weighted_total / weighted_sends
+
+        variance = 0.0
+        for stratum, samples in self.samples.iteritems():
+            size = self.stratum_sizes[stratum]
+            num_sampled = len(samples)
+            if num_sampled == size:
+                continue #every wallet in the stratum has been sampled
+            if num_sampled < max(2, MIN_WALLETS_PER_STRATUM):
+                return (share, float('inf'))
+            residuals = [counts[category] - share * sum(counts)
+                         for counts in samples]
+            mean = sum(residuals) / num_sampled
+            sample_variance = (sum((residual - mean) ** 2
+                                   for residual in residuals) /
+                               (num_sampled - 1))
+            variance += (size ** 2 * (1 - num_sampled * 1.0 / size) *
+                         sample_variance / num_sampled)
+        return (share, Z_95 * math.sqrt(variance) / weighted_sends)
+
+    def get_max_half_width(self):
+        """Returns the widest half-width among the categories' intervals."""
+        return max(self.get_estimate(category)[1]
+                   for category in range(0, len(CATEGORIES)))
+
+    def get_stats_str(self):
+        """Returns a one line summary of the estimates."""
+        parts = []
+        for category, name in enumerate(CATEGORIES):
+            share, half_width = self.get_estimate(category)
+            parts.append("%s %.1f%% +/- %.1f%%" % (name, share * 100,
+                                                    half_width * 100))
+        return "; ".join(parts)
+
+def run(wallet_ids, iter_send_snapshots, evaluate_send,
+        precision=DEFAULT_PRECISION,
+        send_sampling_rate=DEFAULT_SEND_SAMPLING_RATE, seed=None):
+    """Sample wallets and sends until the target precision is reached.
+
+    Args:
+        wallet_ids (List[str]): The population of wallets.
+        iter_send_snapshots (Callable): As for `sample_wallet`.
+        evaluate_send (Callable): As for `sample_wallet`.
+        precision (Optional[float]): Stop once the half-width of every 95%
+            confidence interval is at most this.
+        send_sampling_rate (Optional[float]): Probability that each send of a
+            sampled wallet is tested.
+        seed (Optional[int]): Seed of the random generator.
+
+    Returns:
+        `StratifiedEstimate`
+    """
+    assert 0 < send_sampling_rate <= 1
+    rand = random.Random(seed)
+    strata = stratify(wallet_ids)
+    for stratum_wallet_ids in strata.itervalues():
+        rand.shuffle(stratum_wallet_ids)
+    estimate = StratifiedEstimate(dict(
+        (stratum, len(stratum_wallet_ids))
+        for stratum, stratum_wallet_ids in strata.iteritems()))
+    print "Sampling from %s wallets in strata of sizes %s" % (
+        sum(estimate.stratum_sizes.values()),
+        ', '.join("10^%d: %d" % item
+                  for item in sorted(estimate.stratum_sizes.items())))
+
+    while True:
+        stratum = estimate.get_next_stratum()
+        if stratum is None:
+            print "Sampled every wallet."
+            break
+        wallet_id = strata[stratum][estimate.get_num_sampled(stratum)]
+        print "Sampling wallet %s..." % wallet_id
+        estimate.add(stratum, sample_wallet(
+            wallet_id, send_sampling_rate, rand, iter_send_snapshots,
+            evaluate_send))
+        print "Estimate after %d sends: %s" % (estimate.get_num_sends(),
+                                               estimate.get_stats_str())
+        if estimate.get_max_half_width() <= precision:
+            print "Reached target precision of +/- %.1f%%." % (precision * 100)
+            break
+    return estimate
@@ -0,0 +1,138 @@
+"""Splits a list of wallets across hosts and merges their results.
+
+Each wallet is assigned to one of N shards by hashing its ID, so every host
+given the same wallet list and N selects the same wallets without
+coordinating with the others. Each host saves its shard's totals to a small
+JSON file, and the files are merged once all shards have finished. Merging
+flags shards that are missing, duplicated, didn't complete, or were run on a
+different wallet list, since the totals would be wrong without them.
+"""
+import glob
+import hashlib
+import json
+import os
+
+import cache #cache.py
+
+#Shard result files are saved in this directory of the cache
+SHARD_RESULTS_DIR = 'shards'
+
+def parse_shard(shard_str):
+    """Parse a shard given as "i/N", where 0 <= i < N.
+
+    Returns:
+        (int, int): The shard index and the number of shards.
+
+    Raises:
+        ValueError: If the shard isn't of the form "i/N" with 0 <= i < N.
+    """
+    parts = shard_str.split('/')
+    if len(parts) != 2:
+        raise ValueError("Shard must be of the form i/N: %s" % shard_str)
+    shard_index, num_shards = int(parts[0]), int(parts[1])
+    if not 0 <= shard_index < num_shards:
+        raise ValueError("Shard index must be in [0, %d): %s" %
+                         (num_shards, shard_str))
+    return (shard_index, num_shards)
+
+def get_shard(wallet_id, num_shards):
+    """Returns the index of the shard a wallet belongs to."""
+    digest = hashlib.sha256(wallet_id.encode('utf-8')).hexdigest()
+    return int(digest, 16) % num_shards
+
+def select_shard(wallet_ids, shard_index, num_shards):
+    """Returns the wallets in a shard, in their original order."""
+    return [wallet_id for wallet_id in wallet_ids
+            if get_shard(wallet_id, num_shards) == shard_index]
+
+def get_wallet_list_digest(wallet_ids):
+    """Returns a digest identifying the list of wallets being sharded."""
+    return hashlib.sha256(
+        '\n'.join(wallet_ids).encode('utf-8')).hexdigest()
+
+def get_shard_path(shard_index, num_shards):
+    """Returns the default location of a shard's result file."""
+    return cache.get_path(SHARD_RESULTS_DIR, 'shard_%d_of_%d.json' %
+                          (shard_index, num_shards))
+
+def find_shard_results():
+    """Returns the locations of all shard result files in the cache."""
+    return sorted(glob.glob(cache.get_path(SHARD_RESULTS_DIR, '*.json')))
+
+def save_shard_result(path, shard_index, num_shards, wallet_list_digest,
+                      num_wallets, totals, complete):
+    """Save the totals of a shard.
+
+    Args:
+        path (str): Location of the result file.
+        shard_index (int): Index of the shard.
+        num_shards (int): Number of shards the wallet list was split into.
+        wallet_list_digest (str): As returned by `get_wallet_list_digest` for
+            the whole list of wallets.
+        num_wallets (int): Number of wallets tested in the shard.
+        totals (List[int]): Number of sends compliant with [both, standard
+            only, alternate only, neither] forms.
+        complete (bool): Whether every wallet in the shard was tested.
+    """
+    result = {'shard_index': shard_index, 'num_shards': num_shards,
+              'wallet_list_digest': wallet_list_digest,
+              'num_wallets': num_wallets, 'totals': list(totals),
+              'complete': complete}
+    if os.path.dirname(path):
+        cache.make_dirs(os.path.dirname(path))
+    cache.save_str(path, json.dumps(result, indent=2, sort_keys=True))
+
+def merge(paths):
+    """Combine shard result files into totals for the whole wallet list.
+
+    Args:
+        paths (List[str]): Locations of the result files.
+
+    Returns:
+        (List[int], int, List[str]): The combined totals, as for
+            `save_shard_result`, the number of wallets tested, and a
+            description of each problem that makes the totals incomplete or
+            wrong. The totals are only correct if there are no problems.
+    """
+    results = []
+    for path in paths:
+        with open(path) as result_file:
+            results.append((path, json.load(result_file)))
+    problems = []
+    if not results:
+        return ([0, 0, 0, 0], 0, ["No shard result files given"])
+
+    num_shards = results[0][1]['num_shards']
+    digest = results[0][1]['wallet_list_digest']
+    results_by_shard = {}
+    for path, result in results:
+        if result['num_shards'] != num_shards:
+            problems.append("%s is 1 of %d shards, not %d" %
+                            (path, result['num_shards'], num_shards))
+            continue
+        if result['wallet_list_digest'] != digest:
+            problems.append("%s was run on a different wallet list" % path)
+            continue
+        if not result['complete']:
+            problems.append("%s didn't finish its shard" % path)
+        results_by_shard.setdefault(result['shard_index'], []).append(
+            (path, result))
+
+    totals = [0, 0, 0, 0]
+    num_wallets = 0
+    for shard_index in range(0, num_shards):
+        shard_results = results_by_shard.get(shard_index, [])
+        if not shard_results:
+            problems.append("Shard %d/%d is missing" %
+                            (shard_index, num_shards))
+            continue
+        if len(shard_results) > 1:
+            problems.append("Shard %d/%d is duplicated in %s" %
+                            (shard_index, num_shards,
+                             ', '.join(path for path, _ in shard_results)))
+        #count a duplicated shard once
+        result = shard_results[0][1]
+        num_wallets += result['num_wallets']
+        for i, count in enumerate(result['totals']):
+            totals[i] += count
+    return (totals, num_wallets, problems)
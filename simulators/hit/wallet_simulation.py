@@ -6,100 +6,471 @@ A utxo is represented in this code as a 3-tuple of (txid, output_index, amt)
 where txid is the transaction that created the ouput, output_index its order in
 that tx's list of outputs, and amt is the satoshi integer amount.
 """
+import argparse
+import collections
 import json
+import os
+import sys
+from multiprocessing.pool import ThreadPool
 
 from wallet import Wallet #wallet.py
+from out_of_core_wallet import OutOfCoreWallet #out_of_core_wallet.py
 import http #http.py
+import bitcoind_rpc #bitcoind_rpc.py
+import outpoint_index #outpoint_index.py
+import wallet_history #wallet_history.py
 from . import core
-from .core import NotEnoughFundsError
+from .core import NotEnoughFundsError, StandardFormState
+from .memo import FormMemo, STANDARD_FORM, ALTERNATE_FORM
+from . import sampling
+from . import sharding
+from .results import ResultStore
 
-#If a wallet has more txs than this, skip it.
+#If a wallet has more txs than this, skip it, or replay it out of core.
 MAX_TXS_PER_WALLET = 100
 
+#Replay wallets with more than `MAX_TXS_PER_WALLET` txs with their transactions
+#   and UTXO set on disk, in bounded memory, instead of skipping them.
+ENABLE_OUT_OF_CORE = False
+
 MAX_NUM_WALLETS = None # Set to None to disable
 
 FILE_JSON_LIST_OF_WALLET_IDS = 'data/block_398159_wallets.json'
 
 ENABLE_DEBUG_PRINT = True
 
-def test(wallet_id):
+#Rebuild snapshots from histories exported by `wallet_history` when available,
+#   instead of replaying the wallet over the network.
+USE_EXPORTED_HISTORIES = True
+
+#Results of HIT form simulations are memoized in this file across runs
+FILE_FORM_MEMO = 'cache/form_memo.pickle' # Set to None to disable
+
+FORM_MEMO = FormMemo(path=FILE_FORM_MEMO)
+
+#Evaluate sends on this many threads while the wallet is replayed, so waiting
+#   on the network overlaps with simulating HIT forms.
+NUM_EVALUATION_WORKERS = 4 # Set to None to evaluate each send in turn
+
+#Most sends awaiting evaluation, bounding the snapshots held in memory
+MAX_PENDING_SENDS = 32
+
+#The outcome of every send tested is recorded in this database
+FILE_RESULTS_DB = 'cache/results.sqlite' # Set to None to disable
+
+#A wallet's state just before one of its sends.
+#   txid: Transaction hash of the send.
+#   block_height: Height of the block containing the send.
+#   wallet_num_txs: Number of txs in the wallet's history.
+#   utxos: The UTXO set, with each utxo as a tuple of
+#       (txid, output_index, amt_satoshis), or None for wallets replayed out
+#       of core, whose UTXO set may not fit in memory.
+#   utxo_vals: The amounts of the UTXOs in descending order, in satoshis.
+#   desired_spend: The amount the send intended to pay, in satoshis.
+SendSnapshot = collections.namedtuple(
+    'SendSnapshot', ['txid', 'block_height', 'wallet_num_txs', 'utxos',
+                     'utxo_vals', 'desired_spend'])
+
+def get_utxo_vals(utxos):
+    """Returns the amounts of UTXOs in descending order."""
+    return sorted([utxo[2] for utxo in utxos], reverse=True)
+
+def iter_sends(wallet_id):
+    """Yields the wallet's state just before each send.
+
+    Reads the wallet's exported history from the cache if there is one, and
+    otherwise replays the wallet with `Wallet`, or with `OutOfCoreWallet` if
+    it's too large and `ENABLE_OUT_OF_CORE` is set.
+
+    Yields:
+        `SendSnapshot`: Each snapshot's UTXO set is a tuple, which later sends
+            don't modify. Only the amounts of the UTXOs are kept for
+            wallets replayed out of core, read from disk in order.
+
+    Raises:
+        http.WalletNotFoundError: If wallet not found at walletexplorer.com.
+        http.MaxTransactionsExceededError: If the wallet has more than
+            `MAX_TXS_PER_WALLET` transactions and `ENABLE_OUT_OF_CORE` isn't
+            set.
+    """
+    history_path = wallet_history.get_history_path(wallet_id)
+    if USE_EXPORTED_HISTORIES and os.path.exists(history_path):
+        history = wallet_history.WalletHistory(history_path)
+        try:
+            if (MAX_TXS_PER_WALLET is None or
+                    history.get_num_txs() <= MAX_TXS_PER_WALLET):
+                num_txs = history.get_num_txs()
+                for tx_index, utxos, desired_spend in history.iter_sends():
+                    yield SendSnapshot(
+                        history.get_txid(tx_index),
+                        history.get_block_height(tx_index), num_txs,
+                        tuple(utxos), get_utxo_vals(utxos), desired_spend)
+                return
+            if not ENABLE_OUT_OF_CORE:
+                raise http.MaxTransactionsExceededError
+        finally:
+            history.close()
+
+    try:
+        test_wallet = Wallet(wallet_label=wallet_id, iterate_until_send=True,
+                             max_txs_download=MAX_TXS_PER_WALLET)
+    except http.MaxTransactionsExceededError:
+        if not ENABLE_OUT_OF_CORE:
+            raise
+        print "Replaying %s out of core because it has many txs" % wallet_id
+        test_wallet = OutOfCoreWallet(wallet_label=wallet_id,
+                                      iterate_until_send=True)
+    try:
+        for send in iter_wallet_sends(test_wallet):
+            yield send
+    finally:
+        if isinstance(test_wallet, OutOfCoreWallet):
+            test_wallet.close()
+
+def iter_wallet_sends(test_wallet):
+    """Replays a wallet, yielding its state just before each send.
+
+    Args:
+        test_wallet (`Wallet`): A wallet created with `iterate_until_send=True`,
+            or an `OutOfCoreWallet`. Each transaction is replayed only when the
+            next snapshot is requested.
+
+    Yields:
+        `SendSnapshot`: As for `iter_sends`.
+    """
+    for utxos in test_wallet:
+        txn = test_wallet.txs[test_wallet.tx_index]
+        if isinstance(test_wallet, OutOfCoreWallet):
+            #keep only the amounts, compactly
+            utxos, utxo_vals = None, utxos.get_amts()
+        else:
+            #copy the live UTXO set, which the next send will modify
+            utxos = tuple(utxos)
+            utxo_vals = get_utxo_vals(utxos)
+        yield SendSnapshot(txn.txid, txn.block_height,
+                           test_wallet.get_num_txs(), utxos, utxo_vals,
+                           test_wallet.get_current_desired_spend())
+
+def iter_send_snapshots(wallet_id):
+    """Yields the UTXO amounts and desired spend just before each send.
+
+    Yields:
+        (Sequence[int], int): The amounts of the UTXO set in descending order,
+            and the desired spend, to be tested with `evaluate_utxo_vals`.
+
+    Raises:
+        As for `iter_sends`.
+    """
+    for send in iter_sends(wallet_id):
+        yield (send.utxo_vals, send.desired_spend)
+
+def evaluate_send(utxos, desired_spend, standard_state=None):
+    """Tests standard and alternate forms for a single send.
+
+    Args:
+        utxos (List[utxo]): The wallet's UTXO set just before the send.
+        desired_spend (int): The amount the send intended to pay, in satoshis.
+        standard_state (Optional[`StandardFormState`]): The standard form
+            solution of an earlier send of the same wallet, to warm start the
+            search, which is updated with this send's.
+
+    Returns:
+        (bool, bool): (standard_success, alternate_success)
+    """
+    return evaluate_utxo_vals(get_utxo_vals(utxos), desired_spend,
+                              standard_state)
+
+def evaluate_utxo_vals(utxo_vals, desired_spend, standard_state=None):
+    """Tests standard and alternate forms for a send, given only UTXO amounts.
+
+    Args:
+        utxo_vals (Sequence[int]): The amounts of the wallet's UTXOs just
+            before the send, in descending order.
+        desired_spend (int): The amount the send intended to pay, in satoshis.
+        standard_state (Optional[`StandardFormState`]): As for
+            `evaluate_send`.
+
+    Returns:
+        (bool, bool): (standard_success, alternate_success)
+    """
+    standard_tx, alternate_tx = simulate_send(utxo_vals, desired_spend,
+                                              standard_state)
+    return (standard_tx is not None, alternate_tx is not None)
+
+def simulate_send(utxo_vals, desired_spend, standard_state=None):
+    """Simulates standard and alternate form transactions for a send.
+
+    Args:
+        As for `evaluate_utxo_vals`.
+
+    Returns:
+        (Optional[(List[int], List[int])], Optional[(List[int], List[int])]):
+            The input and output values of the standard and alternate form
+            transactions, or None for each form that isn't possible.
+    """
+    return (simulate_standard_tx(utxo_vals, desired_spend, standard_state),
+            simulate_alternate_tx(utxo_vals, desired_spend))
+
+def simulate_standard_tx(utxo_vals, desired_spend, standard_state=None):
+    """Simulates the standard form transaction for a send.
+
+    Args:
+        As for `evaluate_utxo_vals`.
+
+    Returns:
+        Optional[(List[int], List[int])]: The input and output values of the
+            transaction, or None if standard form isn't possible.
+    """
+    try:
+        return FORM_MEMO.simulate_standard_form(utxo_vals, desired_spend,
+                                                state=standard_state)
+    except NotEnoughFundsError:
+        return None
+
+def simulate_alternate_tx(utxo_vals, desired_spend):
+    """Simulates the alternate form transaction for a send.
+
+    Args:
+        As for `evaluate_utxo_vals`.
+
+    Returns:
+        Optional[(List[int], List[int])]: The input and output values of the
+            transaction, or None if alternate form isn't possible.
+    """
+    try:
+        return FORM_MEMO.simulate_alternate_form(utxo_vals, desired_spend)
+    except NotEnoughFundsError:
+        return None
+
+def simulate_quietly(func, *args):
+    """Calls one of the simulate functions without printing transactions."""
+    core.set_thread_print(False)
+    try:
+        return func(*args)
+    finally:
+        core.set_thread_print(True)
+
+def print_send(send, txs):
+    """Print a send's UTXO set and its simulated transactions.
+
+    Args:
+        send (`SendSnapshot`): The send.
+        txs: As returned by `simulate_send`.
+    """
+    if send.utxos is None:
+        print "UTXOS=<%d utxos>" % len(send.utxo_vals)
+    else:
+        print "UTXOS=%s" % str(list(send.utxos))
+    for form, simulated_tx in zip([STANDARD_FORM, ALTERNATE_FORM], txs):
+        if simulated_tx is None:
+            core.print_not_enough_funds(form=form)
+        else:
+            core.print_tx(form=form, inputs=simulated_tx[0],
+                          outputs=simulated_tx[1])
+
+def record_outcome(wallet_id, send, txs, counts, results):
+    """Print a send's simulated transactions, tally its outcome, and record it
+    in the results store if any.
+
+    Args:
+        wallet_id (str): ID assigned by WalletExplorer.com.
+        send (`SendSnapshot`): The send.
+        txs: As returned by `simulate_send`.
+        counts (List[int]): Running totals as returned by `test`, updated in
+            place.
+        results (Optional[`ResultStore`]): Records the outcome of each send.
+    """
+    print_send(send, txs)
+    standard_success = txs[0] is not None
+    alternate_success = txs[1] is not None
+    if results is not None:
+        results.add(wallet_id, send.wallet_num_txs, send.txid,
+                    send.block_height, send.utxo_vals, send.desired_spend,
+                    standard_success, alternate_success)
+    if standard_success and alternate_success:
+        counts[0] += 1
+    elif standard_success:
+        counts[1] += 1
+    elif alternate_success:
+        counts[2] += 1
+    else:
+        counts[3] += 1
+
+def record_next_pending(wallet_id, pending, counts, results):
+    """Wait for the oldest send being evaluated by workers, and record it.
+
+    Args:
+        wallet_id (str): ID assigned by WalletExplorer.com.
+        pending (Deque[(`SendSnapshot`, `AsyncResult`, `AsyncResult`)]): The
+            sends being evaluated, with their standard and alternate form
+            simulations, oldest first.
+        counts (List[int]): As for `record_outcome`.
+        results (Optional[`ResultStore`]): As for `record_outcome`.
+    """
+    send, standard_tx, alternate_tx = pending.popleft()
+    record_outcome(wallet_id, send, (standard_tx.get(), alternate_tx.get()),
+                   counts, results)
+
+def evaluate_sends(wallet_id, sends, results=None):
+    """Tests standard and alternate forms for each of a wallet's sends.
+
+    If `NUM_EVALUATION_WORKERS` is set, sends are evaluated by workers while
+    the next ones are read from `sends`, with up to `MAX_PENDING_SENDS` sends
+    awaiting evaluation. The standard form searches run on a single worker,
+    in the order of the sends, so each is warm started from the previous
+    send's solution as when evaluating sends in turn. Only the alternate
+    forms are spread over a pool of `NUM_EVALUATION_WORKERS`. The workers
+    don't print, and each send's UTXO set and transactions are printed as
+    its outcome is recorded, in the order of the sends.
+
+    Args:
+        wallet_id (str): ID assigned by WalletExplorer.com for the wallet.
+        sends (Iterable[`SendSnapshot`]): The wallet's sends, in order.
+        results (Optional[`ResultStore`]): Records the outcome of each send.
+
+    Returns:
+        (int, int, int, int): As for `test`.
+
+    Raises:
+        Any exception raised by `sends`, once the workers are stopped.
+    """
+    counts = [0, 0, 0, 0]
+    standard_state = StandardFormState()
+    pending = collections.deque()
+    standard_pool = None
+    alternate_pool = None
+    if NUM_EVALUATION_WORKERS:
+        standard_pool = ThreadPool(1)
+        alternate_pool = ThreadPool(NUM_EVALUATION_WORKERS)
+    try:
+        for send in sends:
+            if standard_pool is None:
+                record_outcome(wallet_id, send,
+                               simulate_quietly(simulate_send,
+                                                send.utxo_vals,
+                                                send.desired_spend,
+                                                standard_state),
+                               counts, results)
+                continue
+            pending.append((
+                send,
+                standard_pool.apply_async(
+                    simulate_quietly,
+                    (simulate_standard_tx, send.utxo_vals, send.desired_spend,
+                     standard_state)),
+                alternate_pool.apply_async(
+                    simulate_quietly,
+                    (simulate_alternate_tx, send.utxo_vals,
+                     send.desired_spend))))
+            if len(pending) > MAX_PENDING_SENDS:
+                record_next_pending(wallet_id, pending, counts, results)
+        while pending:
+            record_next_pending(wallet_id, pending, counts, results)
+    finally:
+        for pool in (standard_pool, alternate_pool):
+            if pool is not None:
+                pool.terminate()
+
+    print "Standard form searches: %s" % standard_state.get_stats_str()
+    return tuple(counts)
+
+def test(wallet_id, results=None):
     """Tests standard and alternate forms using utxos from specified wallet.
 
+    The sends yielded by `iter_sends` are evaluated with `evaluate_sends`.
+
     Args:
         wallet_id (str): ID assigned by WalletExplorer.com for specified wallet.
+        results (Optional[`ResultStore`]): Records the outcome of each send.
 
     Returns:
         (int, int, int, int): Number of transactions for this wallet that felt
             into various categories (both_sucess, standard_success,
             alternate_success, none_sucess)
     """
-    num_both_success = 0
-    num_standard_only = 0
-    num_alternate_only = 0
-    num_neither = 0
     try:
-        test_wallet = Wallet(wallet_label=wallet_id, iterate_until_send=True,
-                             max_txs_download=MAX_TXS_PER_WALLET)
+        return evaluate_sends(wallet_id, iter_sends(wallet_id), results)
     except http.WalletNotFoundError:
         print "Skipped %s because it's missing from API" % wallet_id
-        return (0, 0, 0, 0)
     except http.MaxTransactionsExceededError:
         print "Skipped %s because it has too many txs" % wallet_id
-        return (0, 0, 0, 0)
-    for utxos in test_wallet:
-        print "UTXOS=%s" % str(utxos)
-        utxo_vals = sorted([utxo[2] for utxo in utxos], reverse=True)
-        desired_spend = test_wallet.get_current_desired_spend()
-        standard_success = True
-        alternate_success = True
-        try:
-            core.simulate_standard_form(utxo_vals, desired_spend)
-        except NotEnoughFundsError:
-            standard_success = False
+    return (0, 0, 0, 0)
 
-        try:
-            core.simulate_alternate_form(utxo_vals, desired_spend)
-        except NotEnoughFundsError:
-            alternate_success = False
-
-        if standard_success and alternate_success:
-            num_both_success += 1
-        if standard_success and not alternate_success:
-            num_standard_only += 1
-        if not standard_success and alternate_success:
-            num_alternate_only += 1
-        else:
-            num_neither += 1
+def finish_run():
+    """Print how effective the caches were, and save the form memo."""
+    print "Decoded tx cache: %s" % (
+        bitcoind_rpc.DECODED_TX_CACHE.get_stats_str())
+    print "WalletExplorer tx cache: %s" % (
+        http.TX_DATA_CACHE.get_stats_str())
+    if http.HEDGING_ENABLED:
+        print "Hedged requests: %s" % http.HEDGE_POLICY.get_stats_str()
+    print "Outpoint index: %s" % (
+        outpoint_index.OUTPOINT_INDEX.get_stats_str())
+    print "HIT form memo: %s" % FORM_MEMO.get_stats_str()
+    if FILE_FORM_MEMO is not None:
+        FORM_MEMO.save()
 
-    return (num_both_success, num_standard_only, num_alternate_only, num_neither)
+def main_sample(precision, send_sampling_rate, seed):
+    """Estimate the compliance of the sends of the wallets by sampling."""
+    with open(FILE_JSON_LIST_OF_WALLET_IDS) as json_file:
+        wallet_ids = json.load(json_file)
+    if MAX_NUM_WALLETS is not None:
+        wallet_ids = wallet_ids[:MAX_NUM_WALLETS]
+    try:
+        estimate = sampling.run(wallet_ids, iter_send_snapshots,
+                                evaluate_utxo_vals,
+                                precision=precision,
+                                send_sampling_rate=send_sampling_rate,
+                                seed=seed)
+        print "Estimated share of sends: %s" % estimate.get_stats_str()
+    finally:
+        finish_run()
 
-def main():
+def main(shard=None):
     """Determine number of spends from wallets involved in block 38159 could be
     BIP compliant.
 
+    Args:
+        shard (Optional[(int, int)]): Only test the wallets in this shard of
+            the list, given as (shard_index, num_shards), and save the totals
+            to be merged with those of the other shards.
     """
     num_both_success = 0
     num_standard_only = 0
     num_alternate_only = 0
     num_neither = 0
+    num_wallets_tested = 0
+    wallet_list_digest = None
+    complete = False
+    results = None
+    if FILE_RESULTS_DB is not None:
+        results = ResultStore(FILE_RESULTS_DB)
     try:
         with open(FILE_JSON_LIST_OF_WALLET_IDS) as json_file:
             wallet_ids = json.load(json_file)
-            for i, wallet_id in enumerate(wallet_ids):
-                if i == MAX_NUM_WALLETS:
-                    break
-
-                print "Evaluating compatibility for wallet %s..." % wallet_id
-                results = test(wallet_id)
-                num_both_success += results[0]
-                num_standard_only += results[1]
-                num_alternate_only += results[2]
-                num_neither += results[3]
-
-                print(("Stats: Total txs standard & alternate compliant: %d; "
-                       "standard only: %d; alternate only: %d; neither: %d") %
-                      (num_both_success, num_standard_only, num_alternate_only,
-                       num_neither))
+        if MAX_NUM_WALLETS is not None:
+            wallet_ids = wallet_ids[:MAX_NUM_WALLETS]
+        if shard is not None:
+            wallet_list_digest = sharding.get_wallet_list_digest(wallet_ids)
+            wallet_ids = sharding.select_shard(wallet_ids, *shard)
+            print "Testing the %d wallets in shard %d/%d" % (
+                (len(wallet_ids),) + shard)
+        for wallet_id in wallet_ids:
+            print "Evaluating compatibility for wallet %s..." % wallet_id
+            counts = test(wallet_id, results=results)
+            num_both_success += counts[0]
+            num_standard_only += counts[1]
+            num_alternate_only += counts[2]
+            num_neither += counts[3]
+            num_wallets_tested += 1
+            if results is not None:
+                results.commit()
+
+            print(("Stats: Total txs standard & alternate compliant: %d; "
+                   "standard only: %d; alternate only: %d; neither: %d") %
+                  (num_both_success, num_standard_only, num_alternate_only,
+                   num_neither))
+        complete = True
     except Exception as err:
         print "Encountered unhandled exception: %s" % str(err)
     finally:
@@ -107,7 +478,68 @@ def main():
                "only: %d; alternate only: %d; neither: %d") %
               (num_both_success, num_standard_only, num_alternate_only,
                num_neither))
+        if results is not None:
+            results.close()
+            print "Results of each send saved to %s" % FILE_RESULTS_DB
+        if wallet_list_digest is not None:
+            shard_path = sharding.get_shard_path(*shard)
+            sharding.save_shard_result(
+                shard_path, shard[0], shard[1], wallet_list_digest,
+                num_wallets_tested, [num_both_success, num_standard_only,
+                                     num_alternate_only, num_neither],
+                complete)
+            print "Shard totals saved to %s" % shard_path
+        finish_run()
         print "All wallets completed."
 
+def main_merge(paths):
+    """Combine the totals saved by each shard into totals for all wallets.
+
+    Args:
+        paths (List[str]): Shard result files to merge. Defaults to all of
+            those in the cache.
+
+    Returns:
+        bool: Whether the shards were complete and consistent.
+    """
+    if not paths:
+        paths = sharding.find_shard_results()
+    totals, num_wallets, problems = sharding.merge(paths)
+    for problem in problems:
+        print "WARNING: %s" % problem
+    print(("Stats: Total txs standard & alternate compliant: %d; standard "
+           "only: %d; alternate only: %d; neither: %d") % tuple(totals))
+    print "Merged %d shard files covering %d wallets." % (len(paths),
+                                                          num_wallets)
+    return not problems
+
 if __name__ == "__main__":
-    main()
+    PARSER = argparse.ArgumentParser(
+        description="Test HIT compliance of the sends of real wallets.")
+    PARSER.add_argument('--sample', action='store_true',
+                        help=("estimate compliance from a stratified sample of "
+                              "wallets and sends"))
+    PARSER.add_argument('--precision', type=float,
+                        default=sampling.DEFAULT_PRECISION,
+                        help=("with --sample, stop once each 95%% confidence "
+                              "interval is within this of the estimate"))
+    PARSER.add_argument('--send-rate', type=float,
+                        default=sampling.DEFAULT_SEND_SAMPLING_RATE,
+                        help=("with --sample, probability that each send of a "
+                              "sampled wallet is tested"))
+    PARSER.add_argument('--seed', type=int,
+                        help="with --sample, seed of the random generator")
+    PARSER.add_argument('--shard', type=sharding.parse_shard, metavar='I/N',
+                        help=("only test the wallets in shard I of N "
+                              "(0 <= I < N), and save the shard's totals"))
+    PARSER.add_argument('--merge', nargs='*', metavar='SHARD_FILE',
+                        help=("combine the totals saved by each shard, from "
+                              "the given files or all of those in the cache"))
+    ARGS = PARSER.parse_args()
+    if ARGS.merge is not None:
+        if not main_merge(ARGS.merge):
+            sys.exit(1)
+    elif ARGS.sample:
+        main_sample(ARGS.precision, ARGS.send_rate, ARGS.seed)
+    else:
+        main(shard=ARGS.shard)
@@ -1,15 +1,37 @@
 """Prints the UTXO set and desired spend for each outgoing transaction.
 
+With --jsonl, prints one JSON object per line for each outgoing transaction
+instead, holding only the UTXOs added and removed since the previous one, so
+the output grows with the number of changes rather than with the wallet's size:
+
+    {"tx_index": 7, "added": [[txid, output_index, amt], ...],
+     "removed": [[txid, output_index, amt], ...], "desired_spend": 150000}
 """
 
+import argparse
+import json
 import sys
 
 import http #http.py
 from wallet import Wallet #wallet.py
 
+def print_deltas(sample_wallet):
+    """Print the changes to the wallet's UTXO set as JSON lines."""
+    for delta in sample_wallet.iter_deltas():
+        print json.dumps({'tx_index': sample_wallet.tx_index,
+                          'added': delta.added, 'removed': delta.removed,
+                          'desired_spend': delta.desired_spend},
+                         separators=(',', ':'), sort_keys=True)
+
 def main():
+    parser = argparse.ArgumentParser(
+        description="Print a wallet's UTXO set before each send.")
+    parser.add_argument('wallet_id', help="e.g. 3562f0c16b41b2f9")
+    parser.add_argument('--jsonl', action='store_true',
+                        help="print only the changes, as JSON lines")
+    args = parser.parse_args()
     try:
-        wallet_id = sys.argv[1]
+        wallet_id = args.wallet_id
         sample_wallet = None
         try:
             sample_wallet = Wallet(wallet_label=wallet_id,
@@ -17,6 +39,9 @@ def main():
         except http.WalletNotFoundError:
             print "Couldn't find that wallet."
             sys.exit()
+        if args.jsonl:
+            print_deltas(sample_wallet)
+            return
         for utxos in sample_wallet:
             print "UTXOs: %s" % str(utxos)
             print("Desired Spend (in satoshis): %d" %
@@ -24,7 +49,7 @@ def main():
 
     except Exception as err:
         print "Error: %s" % str(err)
-        print "Usage: print.py 3562f0c16b41b2f9"
+        print "Usage: print.py [--jsonl] 3562f0c16b41b2f9"
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,151 @@
+"""Unit tests for `simulators.hit.alternate_history` that run offline."""
+
+import collections
+import unittest
+
+from utxo_state import UTXOState
+from simulators.hit import alternate_history
+from simulators.hit import core
+from simulators.hit.memo import STANDARD_FORM, ALTERNATE_FORM
+
+#A transaction of `ScriptedWallet`, with the UTXOs it spends and creates.
+ScriptedTx = collections.namedtuple(
+    'ScriptedTx', ['txid', 'type', 'desired_spend', 'removed', 'added'])
+
+def receive(txid, amt):
+    """Returns a tx paying the wallet one UTXO."""
+    return ScriptedTx(txid, 'received', None, [], [(txid, 0, amt)])
+
+def send(txid, desired_spend, removed, change):
+    """Returns a send spending `removed` with one change output, if any."""
+    added = [(txid, 1, change)] if change else []
+    return ScriptedTx(txid, 'sent', desired_spend, removed, added)
+
+#Sends at 3 and 7 fork branches that can afford every later send, but no
+#   branch can afford the send at 5.
+HISTORY = [
+    receive('r0', 500),
+    receive('r1', 400),
+    receive('r2', 300),
+    send('s3', 100, [('r0', 0, 500)], 400),
+    receive('r4', 200),
+    send('s5', 5000, [], 0),
+    receive('r6', 600),
+    send('s7', 50, [('r1', 0, 400)], 350),
+    receive('r8', 80),
+    send('s9', 60, [('r2', 0, 300)], 240)]
+
+class ScriptedWallet(object):
+    """Replays `HISTORY` through the parts of `Wallet` that `explore` uses."""
+
+    def __init__(self, txs):
+        self.txs = txs
+        self.tx_index = 0
+        self.last_added_utxos = []
+        self.last_removed_utxos = []
+
+    def get_num_txs(self):
+        return len(self.txs)
+
+    def is_next_tx_send(self):
+        return (self.tx_index < len(self.txs) and
+                self.txs[self.tx_index].type == 'sent')
+
+    def get_current_desired_spend(self):
+        return self.txs[self.tx_index].desired_spend
+
+    def next_tx(self):
+        txn = self.txs[self.tx_index]
+        self.tx_index += 1
+        self.last_removed_utxos = txn.removed
+        self.last_added_utxos = txn.added
+
+def get_real_states():
+    """Returns the real UTXO set just before each tx of `HISTORY`."""
+    utxos = set()
+    states = []
+    for txn in HISTORY:
+        states.append(set(utxos))
+        utxos.difference_update(txn.removed)
+        utxos.update(txn.added)
+    return states
+
+class RecordingBranch(alternate_history.Branch):
+    """A `Branch` that remembers the UTXO set it forked with."""
+    forks = []
+
+    def __init__(self, fork_tx_index, state):
+        super(RecordingBranch, self).__init__(fork_tx_index, state)
+        RecordingBranch.forks.append((fork_tx_index, set(state)))
+
+class ExploreTest(unittest.TestCase):
+    """Explores the alternate histories of a scripted wallet."""
+
+    def setUp(self):
+        self.saved = (alternate_history.Branch, core.ENABLE_TX_PRINT)
+        alternate_history.Branch = RecordingBranch
+        RecordingBranch.forks = []
+        core.ENABLE_TX_PRINT = False
+
+    def tearDown(self):
+        alternate_history.Branch, core.ENABLE_TX_PRINT = self.saved
+
+    def test_forks_at_each_send(self):
+        branches = alternate_history.explore(ScriptedWallet(HISTORY))
+        self.assertEqual([branch.fork_tx_index for branch in branches],
+                         [3, 5, 7, 9])
+        self.assertEqual([branch.failed_tx_index for branch in branches],
+                         [5, 5, None, None])
+        self.assertEqual([branch.num_standard + branch.num_alternate
+                          for branch in branches], [1, 0, 2, 1])
+
+    def test_max_branches(self):
+        branches = alternate_history.explore(ScriptedWallet(HISTORY),
+                                             max_branches=2)
+        self.assertEqual([branch.fork_tx_index for branch in branches],
+                         [3, 5])
+
+    def test_forks_from_real_state(self):
+        alternate_history.explore(ScriptedWallet(HISTORY))
+        real_states = get_real_states()
+        self.assertEqual(len(RecordingBranch.forks), 4)
+        for fork_tx_index, state in RecordingBranch.forks:
+            self.assertEqual(state, real_states[fork_tx_index])
+
+    def test_change_keyed_by_synthetic_txid(self):
+        branches = alternate_history.explore(ScriptedWallet(HISTORY))
+        real_utxos = set(utxo for txn in HISTORY for utxo in txn.added)
+        for branch in branches:
+            for utxo in branch.state:
+                if utxo in real_utxos:
+                    continue
+                txid, fork_tx_index = utxo[0].split(':')
+                self.assertIn(txid, ['s3', 's5', 's7', 's9'])
+                self.assertEqual(int(fork_tx_index), branch.fork_tx_index)
+                self.assertGreater(utxo[1], 0)
+        #the failed branches stopped receiving payments
+        for branch in branches[:2]:
+            self.assertNotIn(('r6', 0, 600), branch.state)
+            self.assertNotIn(('r8', 0, 80), branch.state)
+
+    def test_make_hit(self):
+        state = UTXOState([('a', 0, 500), ('b', 0, 400), ('c', 0, 300)])
+        new_state, form = alternate_history.make_hit(state, 100, 'x:3')
+        self.assertIn(form, [STANDARD_FORM, ALTERNATE_FORM])
+        simulate = (core.simulate_standard_form if form == STANDARD_FORM
+                    else core.simulate_alternate_form)
+        inputs, outputs = simulate(state.get_utxo_vals(), 100)
+        self.assertGreaterEqual(outputs[0], 100)
+        self.assertEqual(new_state.get_balance(),
+                         state.get_balance() - outputs[0])
+        self.assertEqual(sorted(utxo for utxo in new_state
+                                if utxo[0] == 'x:3'),
+                         sorted(('x:3', i, amt)
+                                for i, amt in enumerate(outputs) if i > 0))
+        self.assertEqual(len(new_state),
+                         len(state) - len(inputs) + len(outputs) - 1)
+        self.assertRaises(core.NotEnoughFundsError,
+                          alternate_history.make_hit, state, 5000, 'y:5')
+
+if __name__ == '__main__':
+    unittest.main()
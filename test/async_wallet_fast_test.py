@@ -0,0 +1,93 @@
+"""Unit tests for `async_wallet` that run offline."""
+
+import threading
+import time
+import unittest
+
+import async_wallet #async_wallet.py
+import bitcoind_rpc #bitcoind_rpc.py
+import http #http.py
+
+class RecordingWallet(object):
+    """Stands in for `AsyncWallet`, recording the pools it's given."""
+    lock = threading.Lock()
+    loaded = []
+
+    def __init__(self, wallet_label, pool=None, rpc_pool=None):
+        if wallet_label == 'missing':
+            raise http.WalletNotFoundError
+        with self.lock:
+            self.loaded.append((wallet_label, pool, rpc_pool))
+
+class FakeRPCPool(object):
+    """Decodes transactions from a script, tracking the calls in flight."""
+    def __init__(self, decoded_txs):
+        self.decoded_txs = decoded_txs
+        self.lock = threading.Lock()
+        self.num_in_flight = 0
+        self.max_in_flight = 0
+        self.requested = []
+
+    def get_decoded_tx(self, txid):
+        """Return the scripted decoding of a transaction."""
+        with self.lock:
+            self.requested.append(txid)
+            self.num_in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.num_in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.num_in_flight -= 1
+        return self.decoded_txs[txid]
+
+class LoadWalletsTest(unittest.TestCase):
+    """Checks the request pools shared by wallets loaded at once."""
+
+    def setUp(self):
+        self.saved = (async_wallet.AsyncWallet, bitcoind_rpc.get_service_url)
+        async_wallet.AsyncWallet = RecordingWallet
+        RecordingWallet.loaded = []
+        bitcoind_rpc.get_service_url = lambda: 'http://u:p@localhost:8332'
+
+    def tearDown(self):
+        async_wallet.AsyncWallet, bitcoind_rpc.get_service_url = self.saved
+
+    def test_pools_sized_by_max_concurrent_requests(self):
+        results = dict(async_wallet.load_wallets(
+            ['a', 'missing', 'b', 'c'], max_concurrent_wallets=2,
+            max_concurrent_requests=3))
+        self.assertIsInstance(results['missing'], http.WalletNotFoundError)
+        self.assertEqual(sorted(wallet_label for wallet_label, _, _
+                                in RecordingWallet.loaded), ['a', 'b', 'c'])
+        pools = set(pool for _, pool, _ in RecordingWallet.loaded)
+        rpc_pools = set(rpc_pool for _, _, rpc_pool in RecordingWallet.loaded)
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(len(rpc_pools), 1)
+        self.assertEqual(rpc_pools.pop().size, 3)
+
+class PrefetchTest(unittest.TestCase):
+    """Checks that prefetching decodes on the wallet's RPC pool."""
+
+    def test_prefetch_uses_rpc_pool(self):
+        rpc_pool = FakeRPCPool({
+            't1': {'vin': [{'coinbase': '00'}], 'vout': []},
+            't2': {'vin': [{'txid': 't1', 'vout': 0},
+                           {'txid': 'x', 'vout': 1}], 'vout': []},
+            'x': {'vin': [], 'vout': []}})
+        wallet_class = async_wallet.AsyncWallet
+        test_wallet = wallet_class.__new__(wallet_class)
+        test_wallet.wallet_label = 'w'
+        test_wallet.txs = [http.WalletTx({'txid': 't1', 'type': 'received',
+                                          'amount': 1}),
+                           http.WalletTx({'txid': 't2', 'type': 'sent',
+                                          'outputs': []})]
+        test_wallet.rpc_pool = rpc_pool
+        test_wallet.pool = async_wallet.ThreadPool(2)
+        try:
+            test_wallet.prefetch_decoded_txs()
+        finally:
+            test_wallet.pool.terminate()
+        self.assertEqual(sorted(rpc_pool.requested), ['t1', 't2', 'x'])
+        self.assertLessEqual(rpc_pool.max_in_flight, 2)
+
+if __name__ == '__main__':
+    unittest.main()
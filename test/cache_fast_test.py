@@ -0,0 +1,65 @@
+"""Unit tests for `cache` that run offline."""
+
+import unittest
+
+import cache
+
+class LRUCacheTest(unittest.TestCase):
+    """Checks eviction, statistics and sizing of `LRUCache`."""
+
+    def test_evicts_least_recently_used(self):
+        lru = cache.LRUCache(max_size=3)
+        for key in ['a', 'b', 'c']:
+            lru.put(key, key.upper())
+        self.assertEqual(lru.get('a'), 'A')
+        lru.put('d', 'D')
+        self.assertNotIn('b', lru)
+        self.assertEqual([key for key, _ in lru.items()], ['c', 'a', 'd'])
+        self.assertEqual(lru.size, 3)
+
+    def test_evicts_by_size(self):
+        lru = cache.LRUCache(max_size=10, sizeof=len)
+        lru.put('a', 'x' * 4)
+        lru.put('b', 'x' * 4)
+        lru.put('c', 'x' * 5)
+        self.assertEqual([key for key, _ in lru.items()], ['b', 'c'])
+        self.assertEqual(lru.size, 9)
+        #values larger than the whole cache aren't stored
+        lru.put('d', 'x' * 11)
+        self.assertNotIn('d', lru)
+        self.assertIn('c', lru)
+
+    def test_counts_hits_and_misses(self):
+        lru = cache.LRUCache(max_size=2)
+        lru.put('a', None)
+        self.assertIs(lru.get('a', 0), None)
+        self.assertEqual(lru.get('b', 0), 0)
+        self.assertEqual(lru.get('b'), None)
+        self.assertIn('a', lru) #doesn't count as a lookup
+        self.assertEqual((lru.hits, lru.misses), (1, 2))
+        self.assertAlmostEqual(lru.get_hit_rate(), 1 / 3.0)
+        lru.clear()
+        self.assertEqual((len(lru), lru.size, lru.hits, lru.misses),
+                         (0, 0, 0, 0))
+
+    def test_replaces_existing_key(self):
+        lru = cache.LRUCache(max_size=10)
+        lru.put('a', 1, size=4)
+        lru.put('b', 2, size=4)
+        lru.put('a', 3, size=6)
+        self.assertEqual(lru.size, 10)
+        self.assertEqual(lru.items(), [('b', 2), ('a', 3)])
+        lru.put('b', 4, size=1)
+        self.assertEqual(lru.size, 7)
+        self.assertEqual(lru.items(), [('a', 3), ('b', 4)])
+
+    def test_estimate_size_counts_contents(self):
+        decoded_tx = {'txid': 'ab' * 32,
+                      'vout': [{'value': 5000, 'n': 0}]}
+        small = cache.estimate_size(decoded_tx)
+        self.assertGreater(small, len(decoded_tx['txid']))
+        decoded_tx['vout'].append({'value': 6000, 'n': 1})
+        self.assertGreater(cache.estimate_size(decoded_tx), small)
+
+if __name__ == '__main__':
+    unittest.main()
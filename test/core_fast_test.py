@@ -0,0 +1,108 @@
+"""Unit tests for `simulators.hit.core` that run offline."""
+
+import random
+import sys
+import unittest
+from StringIO import StringIO
+
+from simulators.hit import core
+
+class NullWriter(object):
+    """Discards `core`'s messages about insufficient funds."""
+    def write(self, _):
+        pass
+
+class WarmStartTest(unittest.TestCase):
+    """Compares warm started standard form searches against full searches."""
+
+    def setUp(self):
+        self.saved = (core.MAX_STANDARD_FORM_ATTEMPTS, core.ENABLE_TX_PRINT,
+                      sys.stdout)
+        core.ENABLE_TX_PRINT = False
+        sys.stdout = NullWriter()
+
+    def tearDown(self):
+        (core.MAX_STANDARD_FORM_ATTEMPTS, core.ENABLE_TX_PRINT,
+         sys.stdout) = self.saved
+
+    def is_possible(self, utxo_vals, desired_spend, state=None):
+        """Returns whether standard form is possible, checking the solution."""
+        try:
+            inputs, outputs = core.simulate_standard_form(
+                list(utxo_vals), desired_spend, state=state)
+        except core.NotEnoughFundsError:
+            return False
+        self.assertEqual(sum(inputs), sum(outputs))
+        self.assertEqual(len(inputs), len(outputs))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertGreaterEqual(outputs[0], desired_spend)
+        self.assertGreaterEqual(outputs.count(max(outputs)), 2)
+        return True
+
+    def check_evolving_wallets(self, max_attempts, max_magnitude):
+        """Assert warm starts agree with full searches as wallets change."""
+        core.MAX_STANDARD_FORM_ATTEMPTS = max_attempts
+        rand = random.Random(4)
+        num_warm = 0
+        for _ in range(0, 40):
+            utxo_vals = [rand.randint(1, 10 ** rand.randint(2, max_magnitude))
+                         for _ in range(0, rand.randint(2, 12))]
+            state = core.StandardFormState()
+            for _ in range(0, 15):
+                utxo_vals.pop(rand.randrange(0, len(utxo_vals)))
+                utxo_vals.append(
+                    rand.randint(1, 10 ** rand.randint(2, max_magnitude)))
+                desired_spend = rand.randint(1, max(1, sum(utxo_vals) / 3))
+                self.assertEqual(
+                    self.is_possible(utxo_vals, desired_spend),
+                    self.is_possible(utxo_vals, desired_spend, state))
+            num_warm += state.num_warm
+        self.assertGreater(num_warm, 0)
+
+    def test_warm_start_with_step(self):
+        self.check_evolving_wallets(20, 7)
+
+    def test_warm_start_without_step(self):
+        self.check_evolving_wallets(None, 3)
+
+    def test_reuses_previous_solution(self):
+        state = core.StandardFormState()
+        solution = core.simulate_standard_form([20, 20, 20, 7], 18,
+                                               state=state)
+        self.assertEqual(state.num_cold, 1)
+        #a UTXO smaller than any input leaves the solution alone
+        self.assertEqual(
+            core.simulate_standard_form([20, 20, 20, 7, 1], 18, state=state),
+            solution)
+        self.assertEqual((state.num_warm, state.num_cold), (1, 1))
+
+class PrintTest(unittest.TestCase):
+    """Checks the switches that silence simulated transactions."""
+
+    def setUp(self):
+        self.saved = (core.ENABLE_TX_PRINT, sys.stdout)
+
+    def tearDown(self):
+        core.ENABLE_TX_PRINT, sys.stdout = self.saved
+        core.set_thread_print(True)
+
+    def get_printed(self):
+        """Returns what a simulated tx and a failed one print."""
+        sys.stdout = StringIO()
+        core.print_tx(form="standard", inputs=[2, 2], outputs=[2, 2])
+        core.print_not_enough_funds(form="alternate")
+        printed = sys.stdout.getvalue()
+        sys.stdout = self.saved[1]
+        return printed
+
+    def test_switches(self):
+        core.ENABLE_TX_PRINT = True
+        self.assertIn("Not enough funds", self.get_printed())
+        core.set_thread_print(False)
+        self.assertEqual(self.get_printed(), "")
+        core.set_thread_print(True)
+        core.ENABLE_TX_PRINT = False
+        self.assertEqual(self.get_printed(), "")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""Unit tests for `simulators.hit.cosimulation` that run offline."""
+
+import sys
+import unittest
+from StringIO import StringIO
+
+from simulators import benchmark
+from simulators.hit import core
+from simulators.hit import cosimulation
+from simulators.hit import wallet_simulation
+from simulators.hit.memo import FormMemo
+
+def make_wallet(seed):
+    """Returns a synthetic wallet whose last txs aren't in a block yet."""
+    conn = benchmark.SyntheticConnection(benchmark.SyntheticProxy())
+    test_wallet = benchmark.SyntheticWallet(120, 0.4, 4, seed, conn)
+    for txn in test_wallet.txs[-5:]:
+        txn.block_height = None
+        txn.block_pos = None
+    return test_wallet
+
+class CosimulateTest(unittest.TestCase):
+    """Compares co-simulating wallets against testing each in turn."""
+
+    def setUp(self):
+        self.saved = (wallet_simulation.iter_sends,
+                      wallet_simulation.FORM_MEMO, core.ENABLE_TX_PRINT,
+                      sys.stdout)
+        wallet_simulation.iter_sends = lambda wallet_id: (
+            wallet_simulation.iter_wallet_sends(make_wallet(int(wallet_id))))
+        wallet_simulation.FORM_MEMO = FormMemo()
+        core.ENABLE_TX_PRINT = False
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        (wallet_simulation.iter_sends, wallet_simulation.FORM_MEMO,
+         core.ENABLE_TX_PRINT, sys.stdout) = self.saved
+
+    def test_events_in_block_order(self):
+        events = list(cosimulation.iter_events(
+            [make_wallet(seed) for seed in range(0, 3)]))
+        positions = [event[:2] for event in events]
+        self.assertEqual(positions, sorted(positions))
+        self.assertEqual(events[-1][:2], (cosimulation.NOT_IN_BLOCK,
+                                          cosimulation.NOT_IN_BLOCK))
+
+    def test_counts_match_wallet_simulation(self):
+        wallets = [make_wallet(seed) for seed in range(0, 3)]
+        results = cosimulation.cosimulate(wallets)
+        for seed, test_wallet in enumerate(wallets):
+            self.assertEqual(results[test_wallet.wallet_label],
+                             list(wallet_simulation.test(str(seed))))
+            self.assertGreater(sum(results[test_wallet.wallet_label]), 0)
+
+if __name__ == '__main__':
+    unittest.main()
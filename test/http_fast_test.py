@@ -0,0 +1,59 @@
+"""Unit tests for hedged requests in `http` that run offline."""
+
+import threading
+import time
+import unittest
+
+import http #http.py
+
+class HedgingTest(unittest.TestCase):
+    """Fetches from a fake server whose first response to each url is slow."""
+
+    def setUp(self):
+        self.orig_fetch_once = http._fetch_once
+        self.orig_policy = http.HEDGE_POLICY
+        self.num_fetches = {}
+        self.lock = threading.Lock()
+        http._fetch_once = self.fake_fetch_once
+        http.HEDGE_POLICY = http.HedgePolicy(percentile=50, budget=0.4,
+                                             min_samples=2)
+        #as if two fast requests had already been made
+        for _ in range(0, 2):
+            http.HEDGE_POLICY.start_request()
+            http.HEDGE_POLICY.record_latency(0.01)
+
+    def tearDown(self):
+        http._fetch_once = self.orig_fetch_once
+        http.HEDGE_POLICY = self.orig_policy
+
+    def fake_fetch_once(self, url):
+        """Responds slowly to the first request for each url."""
+        with self.lock:
+            num_fetches = self.num_fetches.get(url, 0)
+            self.num_fetches[url] = num_fetches + 1
+        if url.startswith('fail'):
+            raise IOError(url)
+        if num_fetches == 0:
+            time.sleep(1)
+            return 'slow'
+        return 'fast'
+
+    def test_slow_request_is_hedged(self):
+        start_time = time.time()
+        self.assertEqual(http._fetch_hedged('a'), 'fast')
+        self.assertLess(time.time() - start_time, 0.5)
+        self.assertEqual(self.num_fetches['a'], 2)
+        self.assertEqual(http.HEDGE_POLICY.num_hedges_won, 1)
+
+    def test_budget_limits_hedges(self):
+        self.assertEqual(http._fetch_hedged('a'), 'fast')
+        #a second hedge would exceed 40% of the 4 requests made
+        self.assertEqual(http._fetch_hedged('b'), 'slow')
+        self.assertEqual(http.HEDGE_POLICY.num_hedged, 1)
+
+    def test_failure_is_raised(self):
+        with self.assertRaises(IOError):
+            http._fetch_hedged('fail')
+
+if __name__ == '__main__':
+    unittest.main()
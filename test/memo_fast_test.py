@@ -0,0 +1,112 @@
+"""Unit tests for `simulators.hit.memo` that run offline."""
+
+import functools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from simulators.hit import core
+from simulators.hit.memo import FormMemo
+
+class FormMemoTest(unittest.TestCase):
+    """Compares memoized simulations against running them directly."""
+
+    def setUp(self):
+        self.saved = (core.MAX_STANDARD_FORM_ATTEMPTS,
+                      core.SIMULATION_VERSION, core.ENABLE_TX_PRINT,
+                      sys.stdout)
+        core.ENABLE_TX_PRINT = True
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'memo.pickle')
+
+    def tearDown(self):
+        (core.MAX_STANDARD_FORM_ATTEMPTS, core.SIMULATION_VERSION,
+         core.ENABLE_TX_PRINT, sys.stdout) = self.saved
+        shutil.rmtree(self.tmp_dir)
+
+    def run_printed(self, simulate_func, utxo_vals, desired_spend):
+        """Returns the outcome of a simulation and what it printed."""
+        sys.stdout = StringIO()
+        try:
+            outcome = simulate_func(utxo_vals, desired_spend)
+        except core.NotEnoughFundsError:
+            outcome = None
+        printed = sys.stdout.getvalue()
+        sys.stdout = self.saved[3]
+        return (outcome, printed)
+
+    def test_hits_match_simulation(self):
+        memo = FormMemo()
+        for utxo_vals, desired_spend in [([20, 20, 20, 7], 18), ([5, 3], 9),
+                                         ([9, 4, 1], 4)]:
+            for memoized, direct in [
+                    (memo.simulate_standard_form, core.simulate_standard_form),
+                    (memo.simulate_alternate_form,
+                     core.simulate_alternate_form)]:
+                expected = self.run_printed(direct, list(utxo_vals),
+                                            desired_spend)
+                #the first call is a miss, and the second a hit
+                for _ in range(0, 2):
+                    self.assertEqual(
+                        self.run_printed(memoized, list(utxo_vals),
+                                         desired_spend), expected)
+        self.assertEqual(memo.results.hits, 6)
+
+    def test_saved_results_depend_on_version(self):
+        memo = FormMemo(path=self.path)
+        self.run_printed(memo.simulate_standard_form, [20, 20, 20, 7], 18)
+        memo.save()
+        self.assertEqual(len(FormMemo(path=self.path).results), 1)
+        self.assertEqual(os.listdir(self.tmp_dir), ['memo.pickle'])
+
+        core.MAX_STANDARD_FORM_ATTEMPTS = 10
+        self.assertEqual(len(FormMemo(path=self.path).results), 0)
+        core.MAX_STANDARD_FORM_ATTEMPTS = self.saved[0]
+        core.SIMULATION_VERSION += 1
+        self.assertEqual(len(FormMemo(path=self.path).results), 0)
+
+    def test_discards_results_when_version_changes(self):
+        memo = FormMemo()
+        self.run_printed(memo.simulate_alternate_form, [9, 4, 1], 4)
+        core.SIMULATION_VERSION += 1
+        self.run_printed(memo.simulate_alternate_form, [9, 4, 1], 4)
+        self.assertEqual(memo.results.hits, 0)
+
+    def test_warm_starts_match_simulation(self):
+        memo = FormMemo()
+        rand = random.Random(5)
+        num_differing = 0
+        for _ in range(0, 20):
+            utxo_vals = [rand.randint(1, 1000) for _ in range(0, 10)]
+            memo_state = core.StandardFormState()
+            direct_state = core.StandardFormState()
+            for _ in range(0, 10):
+                utxo_vals.pop(rand.randrange(0, len(utxo_vals)))
+                utxo_vals.append(rand.randint(1, 1000))
+                desired_spend = rand.randint(1, sum(utxo_vals) / 3)
+                #memoize the cold search for the same query
+                cold = self.run_printed(memo.simulate_standard_form,
+                                        list(utxo_vals), desired_spend)
+                warm = self.run_printed(
+                    functools.partial(core.simulate_standard_form,
+                                      state=direct_state),
+                    list(utxo_vals), desired_spend)
+                num_differing += cold != warm
+                #the second call is a hit from the same previous solution
+                prev_solution = memo_state.solution
+                for _ in range(0, 2):
+                    memo_state.solution = prev_solution
+                    self.assertEqual(self.run_printed(
+                        functools.partial(memo.simulate_standard_form,
+                                          state=memo_state),
+                        list(utxo_vals), desired_spend), warm)
+                    self.assertEqual(memo_state.solution,
+                                     direct_state.solution)
+        self.assertGreater(num_differing, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Unit tests for `out_of_core_wallet` that run offline."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from out_of_core_wallet import OutOfCoreWallet, StoredUTXOSet, WalletStore
+
+class StoredUTXOSetTest(unittest.TestCase):
+    """Keeps a UTXO set in a SQLite database, as `Wallet` keeps it in memory."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = WalletStore(os.path.join(self.tmp_dir, 'w.sqlite'))
+        self.utxos = StoredUTXOSet(self.store)
+        self.utxos.extend([('a', 0, 5), ('b', 1, 7)])
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_in_order_added(self):
+        self.utxos.extend([('c', 0, 1)])
+        self.assertEqual(list(self.utxos),
+                         [('a', 0, 5), ('b', 1, 7), ('c', 0, 1)])
+        self.assertEqual(len(self.utxos), 3)
+        self.assertEqual(list(self.utxos.get_amts()), [7, 5, 1])
+        self.assertEqual(self.utxos.get(('b', 1)), ('b', 1, 7))
+        self.assertIsNone(self.utxos.get(('b', 0)))
+
+    def test_remove(self):
+        self.assertRaises(ValueError, self.utxos.remove, ('a', 0, 6))
+        self.utxos.remove(('a', 0, 5))
+        self.assertEqual(list(self.utxos), [('b', 1, 7)])
+        self.assertRaises(ValueError, self.utxos.remove, ('a', 0, 5))
+
+    def test_duplicate_outpoints_ignored(self):
+        added = self.utxos.extend([('a', 0, 9), ('c', 0, 1), ('c', 0, 1)])
+        self.assertEqual(added, [('c', 0, 1)])
+        self.assertEqual(list(self.utxos),
+                         [('a', 0, 5), ('b', 1, 7), ('c', 0, 1)])
+
+    def test_persisted(self):
+        self.store.close()
+        self.store = WalletStore(os.path.join(self.tmp_dir, 'w.sqlite'))
+        self.assertEqual(list(StoredUTXOSet(self.store)),
+                         [('a', 0, 5), ('b', 1, 7)])
+
+    def test_wallet_warns_of_duplicates(self):
+        test_wallet = OutOfCoreWallet.__new__(OutOfCoreWallet)
+        test_wallet.wallet_label = 'w'
+        test_wallet.utxos = self.utxos
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            added = test_wallet.add_utxos([('a', 0, 9), ('c', 0, 1),
+                                           ('c', 0, 1)])
+            warnings = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(added, [('c', 0, 1)])
+        self.assertEqual(len(warnings), 2)
+        self.assertTrue(all(line.startswith("WARNING: Outpoint")
+                            for line in warnings))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Unit tests for `outpoint_index` that run offline."""
+
+import unittest
+
+from outpoint_index import OutpointIndex
+
+class OutpointIndexTest(unittest.TestCase):
+    """Looks up owners of outpoints named by wallet label or ID."""
+
+    def setUp(self):
+        self.index = OutpointIndex()
+        #a /tx response paying a labelled wallet and an unlabelled one
+        self.index.add_tx_json('t1', {'out': [
+            {'wallet_id': 'aaaa', 'label': 'Exchange.com', 'amount': 5},
+            {'wallet_id': 'bbbb', 'amount': 7}]})
+
+    def test_label_and_id_are_the_same_owner(self):
+        self.index.add_utxos([('t2', 0, 3)], 'Exchange.com')
+        self.index.add_outputs('t3', ['aaaa', 'bbbb'])
+        for outpoint in [('t1', 0), ('t2', 0), ('t3', 0)]:
+            owner = self.index.get_owner(outpoint)
+            self.assertTrue(self.index.is_owner(owner, 'Exchange.com'))
+            self.assertTrue(self.index.is_owner(owner, 'aaaa'))
+            self.assertFalse(self.index.is_owner(owner, 'bbbb'))
+
+    def test_outputs_sent_to_wallet_by_label(self):
+        self.assertEqual(
+            self.index.get_outputs_sent_to_wallet('t1', 'Exchange.com',
+                                                  [5, 7]),
+            [('t1', 0, 5)])
+        self.assertEqual(
+            self.index.get_outputs_sent_to_wallet('t1', 'aaaa', [5, 7]),
+            [('t1', 0, 5)])
+
+    def test_classify_own_inputs_by_label(self):
+        self.index.add_utxos([('t2', 0, 3)], 'aaaa')
+        stats = self.index.classify_inputs(
+            's1', 'Exchange.com', [('t1', 0, 5), ('t2', 0, 3)], [])
+        self.assertEqual((stats.num_own, stats.num_foreign,
+                          stats.num_wallets), (2, 0, 1))
+
+    def test_bounded(self):
+        index = OutpointIndex(max_outpoints=3)
+        index.add_outputs('t1', ['a', 'b'])
+        index.add_outputs('t2', ['a', 'b'])
+        self.assertEqual(len(index.owners), 3)
+        #an owner of t1 was forgotten, so its outputs can't be listed
+        self.assertIsNone(index.get_outputs_sent_to_wallet('t1', 'a', [1, 2]))
+        self.assertEqual(index.get_outputs_sent_to_wallet('t2', 'a', [1, 2]),
+                         [('t2', 0, 1)])
+
+    def test_labels_bounded(self):
+        index = OutpointIndex(max_labels=1)
+        index.add_tx_json('t1', {'out': [
+            {'wallet_id': 'aaaa', 'label': 'Exchange.com', 'amount': 5},
+            {'wallet_id': 'bbbb', 'label': 'Casino.com', 'amount': 7}]})
+        self.assertEqual(len(index.wallet_ids), 1)
+        self.assertEqual(index.get_wallet_id('Casino.com'), 'bbbb')
+        self.assertEqual(index.get_wallet_id('Exchange.com'), 'Exchange.com')
+
+if __name__ == '__main__':
+    unittest.main()
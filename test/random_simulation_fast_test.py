@@ -0,0 +1,77 @@
+"""Unit tests for `simulators.hit.random_simulation` that run offline."""
+
+import itertools
+import unittest
+from fractions import Fraction
+
+from simulators.hit import core
+from simulators.hit import random_simulation
+
+class ExactEnumerationTest(unittest.TestCase):
+    """Compares the exact enumeration mode against brute force."""
+
+    def setUp(self):
+        self.saved = (random_simulation.MAX_UTXOS, random_simulation.MIN_VALUE,
+                      random_simulation.MAX_VALUE,
+                      core.MAX_STANDARD_FORM_ATTEMPTS, core.ENABLE_TX_PRINT)
+        core.ENABLE_TX_PRINT = False
+
+    def tearDown(self):
+        (random_simulation.MAX_UTXOS, random_simulation.MIN_VALUE,
+         random_simulation.MAX_VALUE, core.MAX_STANDARD_FORM_ATTEMPTS,
+         core.ENABLE_TX_PRINT) = self.saved
+
+    def get_brute_force_probabilities(self):
+        """Run `core` on every sequence of UTXOs and every desired spend."""
+        min_val = random_simulation.MIN_VALUE
+        max_val = random_simulation.MAX_VALUE
+        max_utxos = random_simulation.MAX_UTXOS
+        probabilities = [Fraction(0)] * 4
+        for num_utxos in range(1, max_utxos + 1):
+            for utxo_vals in itertools.product(range(min_val, max_val + 1),
+                                               repeat=num_utxos):
+                balance = sum(utxo_vals)
+                for desired_spend in range(1, balance + 1):
+                    utxo_list = sorted(utxo_vals, reverse=True)
+                    standard = alternate = True
+                    try:
+                        core.simulate_standard_form(list(utxo_list),
+                                                    desired_spend)
+                    except core.NotEnoughFundsError:
+                        standard = False
+                    try:
+                        core.simulate_alternate_form(list(utxo_list),
+                                                     desired_spend)
+                    except core.NotEnoughFundsError:
+                        alternate = False
+                    outcome = (0 if standard and alternate else
+                               1 if standard else 2 if alternate else 3)
+                    probabilities[outcome] += Fraction(
+                        1, max_utxos * (max_val - min_val + 1) ** num_utxos *
+                        balance)
+        return probabilities
+
+    def test_matches_brute_force(self):
+        """Every standard form attempt is tried when the balance is small."""
+        random_simulation.MAX_UTXOS = 4
+        random_simulation.MIN_VALUE = 1
+        random_simulation.MAX_VALUE = 4
+        self.assertEqual(random_simulation.get_exact_probabilities(),
+                         self.get_brute_force_probabilities())
+
+    def test_matches_brute_force_with_step(self):
+        """Standard form attempts are spaced out when there are too many."""
+        random_simulation.MAX_UTXOS = 2
+        random_simulation.MIN_VALUE = 2
+        random_simulation.MAX_VALUE = 20
+        core.MAX_STANDARD_FORM_ATTEMPTS = 3
+        self.assertEqual(random_simulation.get_exact_probabilities(),
+                         self.get_brute_force_probabilities())
+
+    def test_probabilities_sum_to_one(self):
+        """The four outcomes are exhaustive."""
+        random_simulation.MAX_UTXOS = 3
+        self.assertEqual(sum(random_simulation.get_exact_probabilities()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
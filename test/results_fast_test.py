@@ -0,0 +1,46 @@
+"""Unit tests for `simulators.hit.results` that run offline."""
+
+import unittest
+
+from simulators.hit.results import ResultStore
+
+class ResultStoreTest(unittest.TestCase):
+    """Records sends in an in-memory database and totals them."""
+
+    def setUp(self):
+        self.store = ResultStore(':memory:')
+        #(wallet_id, wallet_num_txs, txid, block_height, standard, alternate)
+        sends = [('a', 5, 't1', 100, True, True),
+                 ('a', 5, 't2', 250, True, False),
+                 ('b', 40, 't3', 120, False, True),
+                 ('b', 40, 't4', 260, False, False),
+                 ('b', 40, 't5', 299, False, False)]
+        for wallet_id, num_txs, txid, height, standard, alternate in sends:
+            self.store.add(wallet_id, num_txs, txid, height,
+                           [3, 4], 5, standard, alternate)
+        self.store.commit()
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_totals(self):
+        self.assertEqual(self.store.get_totals(), [1, 1, 1, 2])
+
+    def test_totals_by_wallet_size(self):
+        self.assertEqual(self.store.get_totals_by_wallet_size(),
+                         [(0, [1, 1, 0, 0]), (1, [0, 0, 1, 2])])
+
+    def test_totals_by_blocks(self):
+        self.assertEqual(self.store.get_totals_by_blocks(100),
+                         [(100, [1, 0, 1, 0]), (200, [0, 1, 0, 2])])
+
+    def test_add_replaces_send(self):
+        self.store.add('a', 5, 't1', 100, [3], 5, False, False)
+        self.assertEqual(self.store.get_totals(), [0, 1, 1, 3])
+        self.assertEqual(
+            self.store.query('SELECT utxo_count, utxo_total FROM sends '
+                             'WHERE txid = ?', ('t1',)),
+            [(1, 3)])
+
+if __name__ == '__main__':
+    unittest.main()
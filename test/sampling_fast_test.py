@@ -0,0 +1,69 @@
+"""Unit tests for `simulators.hit.sampling` that run offline."""
+
+import random
+import unittest
+
+import http #http.py
+from simulators.hit import sampling
+
+class SamplingTest(unittest.TestCase):
+    """Samples a synthetic population of wallets with known compliance."""
+
+    def setUp(self):
+        rand = random.Random(1)
+        #each wallet's sends are (standard_success, alternate_success) pairs
+        self.wallets = {}
+        for i in range(0, 300):
+            num_txs = int(10 ** rand.uniform(0, 3))
+            compliance = rand.random()
+            self.wallets['w%d' % i] = [
+                (rand.random() < compliance, rand.random() < 0.5)
+                for _ in range(0, num_txs / 2)]
+        self.saved_get_num_txs = http.get_num_txs
+        http.get_num_txs = lambda wallet_id: 2 * len(self.wallets[wallet_id])
+
+    def tearDown(self):
+        http.get_num_txs = self.saved_get_num_txs
+
+    def iter_send_snapshots(self, wallet_id):
+        """Yield each send as a fake snapshot."""
+        for send in self.wallets[wallet_id]:
+            yield ([], send)
+
+    @staticmethod
+    def evaluate_send(_, send):
+        """Returns the predetermined outcome of a fake send."""
+        return send
+
+    def get_true_shares(self):
+        """Returns the share of all sends in each category."""
+        counts = [0, 0, 0, 0]
+        for sends in self.wallets.itervalues():
+            for standard, alternate in sends:
+                counts[(not standard) * 2 + (not alternate)] += 1
+        return [count * 1.0 / sum(counts) for count in counts]
+
+    def run_sampling(self, precision):
+        """Sample the synthetic wallets."""
+        return sampling.run(sorted(self.wallets), self.iter_send_snapshots,
+                            self.evaluate_send, precision=precision, seed=0)
+
+    def test_census_is_exact(self):
+        estimate = self.run_sampling(precision=0)
+        for category, true_share in enumerate(self.get_true_shares()):
+            share, half_width = estimate.get_estimate(category)
+            self.assertAlmostEqual(share, true_share)
+            self.assertEqual(half_width, 0)
+
+    def test_stops_at_target_precision(self):
+        estimate = self.run_sampling(precision=0.05)
+        self.assertLessEqual(estimate.get_max_half_width(), 0.05)
+        num_sampled = sum(estimate.get_num_sampled(stratum)
+                          for stratum in estimate.stratum_sizes)
+        self.assertLess(num_sampled, len(self.wallets))
+        for category, true_share in enumerate(self.get_true_shares()):
+            share, half_width = estimate.get_estimate(category)
+            self.assertLessEqual(abs(share - true_share), 2 * half_width)
+
+if __name__ == '__main__':
+    unittest.main()
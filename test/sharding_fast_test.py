@@ -0,0 +1,61 @@
+"""Unit tests for `simulators.hit.sharding` that run offline."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from simulators.hit import sharding
+
+class ShardingTest(unittest.TestCase):
+    """Splits a list of wallets into shards and merges their totals."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.wallet_ids = ['%016x' % (i * 7919) for i in range(0, 200)]
+        self.digest = sharding.get_wallet_list_digest(self.wallet_ids)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def save(self, name, shard_index, num_shards, totals, complete=True,
+             digest=None):
+        """Save a shard result file and return its path."""
+        path = os.path.join(self.tmp_dir, name)
+        sharding.save_shard_result(path, shard_index, num_shards,
+                                   digest or self.digest, 10, totals, complete)
+        return path
+
+    def test_shards_partition_wallets(self):
+        shards = [sharding.select_shard(self.wallet_ids, i, 3)
+                  for i in range(0, 3)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(self.wallet_ids))
+        for shard in shards:
+            self.assertGreater(len(shard), 0)
+        self.assertEqual(shards[1],
+                         sharding.select_shard(self.wallet_ids, 1, 3))
+
+    def test_parse_shard(self):
+        self.assertEqual(sharding.parse_shard('2/5'), (2, 5))
+        for shard_str in ['5/5', '-1/5', '2', '1/2/3']:
+            with self.assertRaises(ValueError):
+                sharding.parse_shard(shard_str)
+
+    def test_merge(self):
+        paths = [self.save('a.json', 0, 2, [1, 2, 3, 4]),
+                 self.save('b.json', 1, 2, [10, 20, 30, 40])]
+        self.assertEqual(sharding.merge(paths), ([11, 22, 33, 44], 20, []))
+
+    def test_merge_flags_problems(self):
+        paths = [self.save('a.json', 0, 3, [1, 2, 3, 4]),
+                 self.save('b.json', 0, 3, [1, 2, 3, 4]),
+                 self.save('c.json', 1, 3, [1, 1, 1, 1], complete=False),
+                 self.save('d.json', 2, 3, [5, 5, 5, 5], digest='other')]
+        totals, num_wallets, problems = sharding.merge(paths)
+        self.assertEqual((totals, num_wallets), ([2, 3, 4, 5], 20))
+        self.assertEqual(len(problems), 4)
+        self.assertTrue(any('2/3 is missing' in p for p in problems))
+        self.assertTrue(any('0/3 is duplicated' in p for p in problems))
+
+if __name__ == '__main__':
+    unittest.main()
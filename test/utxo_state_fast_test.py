@@ -0,0 +1,69 @@
+"""Unit tests for `utxo_state` that run offline."""
+
+import random
+import unittest
+
+from utxo_state import UTXOState
+
+class UTXOStateTest(unittest.TestCase):
+    """Compares `UTXOState` against a plain set of UTXOs."""
+
+    def check_state(self, state, expected):
+        """Assert that a state holds exactly the expected UTXOs."""
+        self.assertEqual(len(state), len(expected))
+        self.assertEqual(state.get_balance(),
+                         sum(utxo[2] for utxo in expected))
+        self.assertEqual(state.get_utxos(),
+                         sorted(expected, key=lambda utxo: (utxo[2], utxo)))
+        self.assertEqual(state.get_utxo_vals(),
+                         sorted([utxo[2] for utxo in expected], reverse=True))
+        for utxo in expected:
+            self.assertIn(utxo, state)
+
+    def test_random_operations(self):
+        rand = random.Random(0)
+        state = UTXOState()
+        expected = set()
+        for i in range(0, 2000):
+            if expected and rand.random() < 0.4:
+                utxo = rand.choice(sorted(expected))
+                state = state.remove(utxo)
+                expected.remove(utxo)
+                self.assertNotIn(utxo, state)
+            else:
+                utxo = ('%064x' % rand.randint(0, 20), i % 3,
+                        rand.randint(1, 50))
+                state = state.add(utxo)
+                expected.add(utxo)
+            if i % 100 == 0:
+                self.check_state(state, expected)
+        self.check_state(state, expected)
+
+    def test_forks_are_independent(self):
+        base = UTXOState([('a', 0, 5), ('b', 0, 7), ('c', 1, 7)])
+        fork_1 = base.apply([('b', 0, 7)], [('d', 0, 3)])
+        fork_2 = base.remove(('a', 0, 5)).add(('e', 2, 11))
+        self.check_state(base, [('a', 0, 5), ('b', 0, 7), ('c', 1, 7)])
+        self.check_state(fork_1, [('a', 0, 5), ('c', 1, 7), ('d', 0, 3)])
+        self.check_state(fork_2, [('b', 0, 7), ('c', 1, 7), ('e', 2, 11)])
+
+    def test_remove_missing_utxo(self):
+        state = UTXOState([('a', 0, 5)])
+        with self.assertRaises(ValueError):
+            state.remove(('a', 1, 5))
+        with self.assertRaises(ValueError):
+            UTXOState().remove(('a', 0, 5))
+
+    def test_add_existing_utxo(self):
+        state = UTXOState([('a', 0, 5)])
+        self.assertIs(state.add(('a', 0, 5)), state)
+
+    def test_find_by_amount(self):
+        state = UTXOState([('b', 0, 7), ('a', 1, 7), ('c', 0, 9)])
+        self.assertEqual(state.find_by_amount(7), ('a', 1, 7))
+        self.assertEqual(state.find_by_amount(9), ('c', 0, 9))
+        self.assertIsNone(state.find_by_amount(8))
+        self.assertIsNone(UTXOState().find_by_amount(8))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+"""Unit tests for `wallet` that run offline, on synthetic wallets."""
+
+import collections
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import cache #cache.py
+import http #http.py
+import wallet #wallet.py
+from outpoint_index import OutpointIndex
+from simulators import benchmark
+
+def make_wallet(iterate_until_send=True):
+    """Returns a reproducible synthetic wallet."""
+    conn = benchmark.SyntheticConnection(benchmark.SyntheticProxy())
+    test_wallet = benchmark.SyntheticWallet(300, 0.4, 4, 3, conn)
+    test_wallet.iterate_until_send = iterate_until_send
+    return test_wallet
+
+class IterDeltasTest(unittest.TestCase):
+    """Compares `Wallet.iter_deltas` against iterating the wallet."""
+
+    def check_deltas(self, iterate_until_send):
+        """Assert that the deltas rebuild each snapshot of the wallet."""
+        snapshots = []
+        test_wallet = make_wallet(iterate_until_send)
+        for utxos in test_wallet:
+            desired_spend = None
+            if test_wallet.is_next_tx_send():
+                desired_spend = test_wallet.get_current_desired_spend()
+            snapshots.append((list(utxos), desired_spend))
+
+        utxos = collections.OrderedDict()
+        num_steps = 0
+        for delta in make_wallet(iterate_until_send).iter_deltas():
+            for utxo in delta.removed:
+                del utxos[utxo[:2]]
+            for utxo in delta.added:
+                self.assertNotIn(utxo[:2], utxos)
+                utxos[utxo[:2]] = utxo
+            self.assertEqual((utxos.values(), delta.desired_spend),
+                             snapshots[num_steps])
+            num_steps += 1
+        self.assertEqual(num_steps, len(snapshots))
+
+    def test_deltas_until_send(self):
+        self.check_deltas(True)
+
+    def test_deltas_each_tx(self):
+        self.check_deltas(False)
+
+class UTXOSetTest(unittest.TestCase):
+    """Keeps the UTXO list and the outpoint index of a wallet in step."""
+
+    def setUp(self):
+        self.wallet = make_wallet()
+        self.wallet.outpoint_index = None
+        self.wallet.set_utxos([('a', 0, 5), ('b', 1, 7)])
+
+    def check_consistent(self):
+        """Assert the index holds exactly the UTXOs in the list."""
+        self.assertEqual(sorted(self.wallet.outpoints.values()),
+                         sorted(self.wallet.utxos))
+        self.assertEqual(len(self.wallet.outpoints), len(self.wallet.utxos))
+
+    def test_remove_mismatched_value(self):
+        self.assertRaises(ValueError, self.wallet.remove_utxo, ('a', 0, 6))
+        self.assertEqual(self.wallet.outpoints.get(('a', 0)), ('a', 0, 5))
+        self.check_consistent()
+        self.wallet.remove_utxo(('a', 0, 5))
+        self.assertEqual(self.wallet.utxos, [('b', 1, 7)])
+        self.check_consistent()
+
+    def test_add_duplicate_outpoint(self):
+        stdout = sys.stdout
+        sys.stdout = StringIO() #discard the warnings
+        try:
+            added = self.wallet.add_utxos([('a', 0, 9), ('c', 0, 1),
+                                           ('c', 0, 1)])
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(added, [('c', 0, 1)])
+        self.assertEqual(self.wallet.utxos,
+                         [('a', 0, 5), ('b', 1, 7), ('c', 0, 1)])
+        self.check_consistent()
+
+class OutputsSentToWalletTest(unittest.TestCase):
+    """Falls back on the /tx endpoint for outputs the index can't place."""
+
+    def setUp(self):
+        self.get_tx_data_json = http.get_tx_data_json
+        self.wallet = make_wallet()
+        tx_json = {'out': [
+            {'wallet_id': 'aaaa', 'label': self.wallet.wallet_label,
+             'amount': 5},
+            {'wallet_id': 'bbbb', 'amount': 7}]}
+        http.get_tx_data_json = lambda txid: tx_json
+
+    def tearDown(self):
+        http.get_tx_data_json = self.get_tx_data_json
+
+    def get_outputs(self):
+        """Returns the outputs of a tx paying 5 and 7 sent to the wallet."""
+        return self.wallet.get_outputs_sent_to_wallet(
+            't1', {'vout': [{'value': 5}, {'value': 7}]})
+
+    def test_fallback_indexes_owners(self):
+        index = OutpointIndex()
+        self.wallet.outpoint_index = index
+        self.assertEqual(self.get_outputs(), [('t1', 0, 5)])
+        self.assertEqual(index.get_owner(('t1', 1)), 'bbbb')
+        self.assertTrue(index.is_owner(index.get_owner(('t1', 0)),
+                                       self.wallet.wallet_label))
+
+    def test_fallback_without_index(self):
+        self.wallet.outpoint_index = None
+        self.assertEqual(self.get_outputs(), [('t1', 0, 5)])
+
+class SnapshotTest(unittest.TestCase):
+    """Compares `Wallet.snapshot_at` against a full replay."""
+
+    def setUp(self):
+        self.saved = (cache.CACHE_DIR, wallet.CHECKPOINT_FORMAT)
+        cache.CACHE_DIR = tempfile.mkdtemp()
+        self.snapshots = [[]]
+        test_wallet = self.make_wallet()
+        while test_wallet.tx_index < test_wallet.get_num_txs():
+            test_wallet.next_tx()
+            self.snapshots.append(list(test_wallet.utxos))
+
+    def tearDown(self):
+        shutil.rmtree(cache.CACHE_DIR)
+        cache.CACHE_DIR, wallet.CHECKPOINT_FORMAT = self.saved
+
+    def make_wallet(self):
+        """Returns a synthetic wallet checkpointed every 20 txs."""
+        test_wallet = make_wallet(iterate_until_send=False)
+        test_wallet.checkpoint_interval = 20
+        return test_wallet
+
+    def test_snapshots_match_replay(self):
+        test_wallet = self.make_wallet()
+        self.assertIsNotNone(test_wallet.load_checkpoint(40))
+        #forwards from the current position, and back to a checkpoint
+        for tx_index in [0, 1, 19, 20, 45, 300, 7, 120, 121]:
+            self.assertEqual(test_wallet.snapshot_at(tx_index),
+                             self.snapshots[tx_index])
+        self.assertEqual(test_wallet.tx_index, 121)
+
+    def test_checkpoint_format(self):
+        #a doctored checkpoint shows whether the snapshot resumed from it
+        test_wallet = self.make_wallet()
+        checkpoint_path = test_wallet.get_checkpoint_path(40)
+        checkpoint = cache.load_json(checkpoint_path)
+        checkpoint['utxos'] = []
+        cache.save_json(checkpoint_path, checkpoint)
+        self.assertNotEqual(self.snapshots[40], [])
+        self.assertEqual(test_wallet.snapshot_at(40), [])
+
+        wallet.CHECKPOINT_FORMAT += 1
+        test_wallet = self.make_wallet()
+        self.assertIsNone(test_wallet.load_checkpoint(40))
+        self.assertEqual(test_wallet.snapshot_at(40), self.snapshots[40])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Unit tests for `wallet_history` that run offline, on synthetic wallets."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import wallet_history
+from simulators import benchmark
+
+def make_wallet():
+    """Returns a reproducible synthetic wallet."""
+    conn = benchmark.SyntheticConnection(benchmark.SyntheticProxy())
+    return benchmark.SyntheticWallet(300, 0.4, 4, 3, conn)
+
+class ExportTest(unittest.TestCase):
+    """Compares exported histories against iterating the wallet."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'history.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_snapshots_round_trip(self):
+        snapshots = []
+        test_wallet = make_wallet()
+        for utxos in test_wallet:
+            snapshots.append((list(utxos),
+                              test_wallet.get_current_desired_spend()))
+        self.assertGreater(len(snapshots), 0)
+
+        test_wallet = make_wallet()
+        txs = test_wallet.txs
+        txs[5].block_height = None
+        txs[5].block_pos = None
+        wallet_history.export_wallet(test_wallet, self.path)
+        history = wallet_history.WalletHistory(self.path)
+        try:
+            self.assertEqual(list(history.iter_send_snapshots()), snapshots)
+            self.assertEqual(history.get_num_txs(), len(txs))
+            for i, txn in enumerate(txs):
+                self.assertEqual(history.get_txid(i), txn.txid)
+                self.assertEqual(history.get_block_height(i),
+                                 txn.block_height)
+                self.assertEqual(history.get_block_pos(i), txn.block_pos)
+        finally:
+            history.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Unit tests for `simulators.hit.wallet_simulation` that run offline."""
+
+import random
+import sys
+import unittest
+from StringIO import StringIO
+
+from simulators.hit import core
+from simulators.hit import wallet_simulation
+from simulators.hit.memo import FormMemo
+
+def make_sends(seed, num_sends):
+    """Returns the snapshots of a random wallet's sends."""
+    rand = random.Random(seed)
+    utxos = [('tx%d' % i, 0, rand.randint(1, 10 ** rand.randint(2, 6)))
+             for i in range(0, 8)]
+    sends = []
+    for send_num in range(0, num_sends):
+        utxos.pop(rand.randrange(0, len(utxos)))
+        utxos.append(('send%d' % send_num, 1,
+                      rand.randint(1, 10 ** rand.randint(2, 6))))
+        total = sum(utxo[2] for utxo in utxos)
+        sends.append(wallet_simulation.SendSnapshot(
+            'send%d' % send_num, send_num, num_sends, tuple(utxos),
+            wallet_simulation.get_utxo_vals(utxos),
+            rand.randint(1, max(1, total / 3))))
+    return sends
+
+class PipelineTest(unittest.TestCase):
+    """Compares evaluating sends on a pool of workers and in turn."""
+
+    def setUp(self):
+        self.saved = (wallet_simulation.iter_sends,
+                      wallet_simulation.FORM_MEMO,
+                      wallet_simulation.NUM_EVALUATION_WORKERS,
+                      wallet_simulation.MAX_PENDING_SENDS,
+                      core.ENABLE_TX_PRINT, sys.stdout)
+        wallet_simulation.iter_sends = lambda wallet_id: iter(
+            make_sends(int(wallet_id), 60))
+        wallet_simulation.MAX_PENDING_SENDS = 5
+        core.ENABLE_TX_PRINT = True
+
+    def tearDown(self):
+        (wallet_simulation.iter_sends, wallet_simulation.FORM_MEMO,
+         wallet_simulation.NUM_EVALUATION_WORKERS,
+         wallet_simulation.MAX_PENDING_SENDS, core.ENABLE_TX_PRINT,
+         sys.stdout) = self.saved
+
+    def run_test(self, num_workers, wallet_id):
+        """Returns the totals of `test` and what it printed."""
+        wallet_simulation.NUM_EVALUATION_WORKERS = num_workers
+        wallet_simulation.FORM_MEMO = FormMemo()
+        sys.stdout = StringIO()
+        try:
+            counts = wallet_simulation.test(wallet_id)
+            return (counts, sys.stdout.getvalue())
+        finally:
+            sys.stdout = self.saved[5]
+
+    def check_output(self, output, wallet_id):
+        """Assert each send's transactions are printed after its UTXO set."""
+        headers = [line for line in output.splitlines()
+                   if not line.startswith('\t')]
+        sends = make_sends(int(wallet_id), 60)
+        self.assertEqual(len(headers), 3 * len(sends) + 1)
+        for send, pos in zip(sends, range(0, len(headers), 3)):
+            self.assertEqual(headers[pos], "UTXOS=%s" % str(list(send.utxos)))
+            self.assertIn(headers[pos + 1], [
+                "Transaction: standard form",
+                "Not enough funds for standard form for this transaction."])
+            self.assertIn(headers[pos + 2], [
+                "Transaction: alternate form",
+                "Not enough funds for alternative form for this transaction."])
+
+    def test_output_in_send_order(self):
+        for wallet_id in ['1', '2', '3']:
+            counts, output = self.run_test(None, wallet_id)
+            self.check_output(output, wallet_id)
+            self.assertEqual(sum(counts), 60)
+            self.assertEqual(self.run_test(4, wallet_id), (counts, output))
+
+    def test_pipelined_searches_are_warm_started(self):
+        output = self.run_test(4, '1')[1]
+        stats = output.splitlines()[-1]
+        self.assertTrue(stats.startswith("Standard form searches: "))
+        self.assertGreater(int(stats.split()[3]), 0)
+
+if __name__ == '__main__':
+    unittest.main()
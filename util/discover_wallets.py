@@ -0,0 +1,98 @@
+"""Builds a list of wallets that made transactions in a range of blocks.
+
+Transaction IDs are listed through bitcoind's RPC interface and each
+transaction's wallet is looked up with WalletExplorer.com's /tx endpoint. The
+lookups run concurrently and go through the on-disk tx cache, so re-running
+over overlapping ranges only fetches transactions not seen before.
+
+The output is a JSON list of wallet labels, the same format as
+`data/block_398159_wallets.json`. Each label is written as soon as it's
+discovered, so a long run can be inspected while it's still in progress.
+
+Usage:
+    python -m util.discover_wallets start_height end_height [output_file]
+"""
+import json
+import sys
+from multiprocessing.pool import ThreadPool
+
+import http #http.py
+import bitcoind_rpc #bitcoind_rpc.py
+
+ENABLE_DEBUG_PRINT = False
+
+NUM_WORKERS = 16
+
+DEFAULT_OUTPUT_FILENAME = 'data/wallets.json'
+
+def iter_txids(conn, start_height, end_height):
+    """Yields the ID of every transaction in the blocks from start to end.
+
+    Both `start_height` and `end_height` are inclusive.
+    """
+    for block_height in range(start_height, end_height + 1):
+        txids = conn.get_tx_ids_at_height(block_height)
+        dprint("Block %d has %d txs" % (block_height, len(txids)))
+        for txid in txids:
+            yield txid
+
+def resolve_label(txid):
+    """Get the wallet label for a tx, or None if it has no wallet."""
+    try:
+        return http.get_tx_wallet_label(txid)
+    except Exception as err:
+        print "WARNING: Couldn't resolve wallet for tx %s: %s" % (txid,
+                                                                  str(err))
+        return None
+
+def discover_wallets(start_height, end_height, out_file,
+                     num_workers=NUM_WORKERS):
+    """Write the unique wallet labels in a block range to `out_file`.
+
+    Returns:
+        int: The number of unique wallets written.
+    """
+    conn = bitcoind_rpc.RPCConnection()
+    pool = ThreadPool(num_workers)
+    unique_labels = set()
+    out_file.write('[')
+    try:
+        for label in pool.imap_unordered(
+                resolve_label, iter_txids(conn, start_height, end_height)):
+            if label is None or label in unique_labels:
+                continue
+            if unique_labels:
+                out_file.write(',')
+            out_file.write('\n%s' % json.dumps(label))
+            out_file.flush()
+            unique_labels.add(label)
+            dprint("Found wallet %s" % label)
+    finally:
+        pool.terminate()
+        out_file.write('\n]\n')
+    return len(unique_labels)
+
+def main():
+    """Discover wallets in the block range given on the command line."""
+    try:
+        start_height = int(sys.argv[1])
+        end_height = int(sys.argv[2])
+    except (IndexError, ValueError):
+        print __doc__
+        sys.exit(1)
+    output_filename = DEFAULT_OUTPUT_FILENAME
+    if len(sys.argv) > 3:
+        output_filename = sys.argv[3]
+
+    with open(output_filename, 'w') as out_file:
+        num_wallets = discover_wallets(start_height, end_height, out_file)
+    print "Wrote %d wallets from blocks %d-%d to %s" % (
+        num_wallets, start_height, end_height, output_filename)
+
+def dprint(msg):
+    """Debug print statements."""
+    if ENABLE_DEBUG_PRINT:
+        print "DEBUG: %s" % msg
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""A persistent UTXO set whose versions share structure.
+
+`UTXOState` is immutable: adding or removing a UTXO returns a new state in
+O(log n) time and leaves the original untouched, sharing all but O(log n) of
+its nodes with it. Keeping a reference to a state is therefore all it takes to
+fork a wallet's history, and many forks of a large UTXO set take little more
+memory than one.
+
+A utxo is represented as a 3-tuple of (txid, output_index, amt_satoshis), as
+in `wallet`. Internally the UTXOs are held in a treap ordered by amount, so
+iteration is by amount and UTXOs of a given amount can be found quickly.
+"""
+
+class _Node(object):
+    """An immutable treap node, keyed by (amt, txid, output_index)."""
+    __slots__ = ('key', 'priority', 'left', 'right', 'size', 'total')
+
+    def __init__(self, key, priority, left, right):
+        self.key = key
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = 1
+        self.total = key[0]
+        if left is not None:
+            self.size += left.size
+            self.total += left.total
+        if right is not None:
+            self.size += right.size
+            self.total += right.total
+
+def _to_key(utxo):
+    """Returns the treap key for a utxo."""
+    return (utxo[2], utxo[0], utxo[1])
+
+def _to_utxo(key):
+    """Returns the utxo for a treap key."""
+    return (key[1], key[2], key[0])
+
+def _split(node, key):
+    """Split a treap into the nodes with keys less than `key`, and the rest."""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        return _Node(node.key, node.priority, node.left, left), right
+    left, right = _split(node.left, key)
+    return left, _Node(node.key, node.priority, right, node.right)
+
+def _merge(left, right):
+    """Join two treaps, where every key in `left` is less than in `right`."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        return _Node(left.key, left.priority, left.left,
+                     _merge(left.right, right))
+    return _Node(right.key, right.priority, _merge(left, right.left),
+                 right.right)
+
+def _insert(node, key, priority):
+    """Returns a treap with the key inserted, which must not be present."""
+    if node is None or priority > node.priority:
+        left, right = _split(node, key)
+        return _Node(key, priority, left, right)
+    if key < node.key:
+        return _Node(node.key, node.priority,
+                     _insert(node.left, key, priority), node.right)
+    return _Node(node.key, node.priority, node.left,
+                 _insert(node.right, key, priority))
+
+def _remove(node, key):
+    """Returns a treap with the key removed.
+
+    Raises:
+        ValueError: If the key is not in the treap.
+    """
+    if node is None:
+        raise ValueError
+    if key == node.key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        return _Node(node.key, node.priority, _remove(node.left, key),
+                     node.right)
+    return _Node(node.key, node.priority, node.left,
+                 _remove(node.right, key))
+
+class UTXOState(object):
+    """An immutable set of UTXOs.
+
+    Args:
+        utxos (Optional[Iterable[utxo]]): Initial UTXOs, each a tuple of
+            (txid, output_index, amt_satoshis).
+    """
+    __slots__ = ('root',)
+
+    def __init__(self, utxos=()):
+        self.root = None
+        for utxo in utxos:
+            key = _to_key(utxo)
+            if not self._contains_key(key):
+                self.root = _insert(self.root, key, hash(key))
+
+    @classmethod
+    def _from_root(cls, root):
+        """Wrap a treap in a new state."""
+        state = cls()
+        state.root = root
+        return state
+
+    def _contains_key(self, key):
+        """Returns whether the treap has the specified key."""
+        node = self.root
+        while node is not None:
+            if key == node.key:
+                return True
+            node = node.left if key < node.key else node.right
+        return False
+
+    def add(self, utxo):
+        """Returns a state that also has the UTXO.
+
+        If the UTXO is already in this state, this state is returned.
+        """
+        key = _to_key(utxo)
+        if self._contains_key(key):
+            return self
+        return self._from_root(_insert(self.root, key, hash(key)))
+
+    def remove(self, utxo):
+        """Returns a state without the UTXO.
+
+        Raises:
+            ValueError: If the UTXO is not in this state.
+        """
+        return self._from_root(_remove(self.root, _to_key(utxo)))
+
+    def apply(self, removed_utxos, added_utxos):
+        """Returns the state after a transaction.
+
+        Args:
+            removed_utxos (List[utxo]): UTXOs spent by the transaction.
+            added_utxos (List[utxo]): UTXOs created by the transaction.
+
+        Raises:
+            ValueError: If a removed UTXO is not in this state.
+        """
+        state = self
+        for utxo in removed_utxos:
+            state = state.remove(utxo)
+        for utxo in added_utxos:
+            state = state.add(utxo)
+        return state
+
+    def find_by_amount(self, amt):
+        """Returns a UTXO of the specified amount, or None if there isn't one.
+
+        When several UTXOs have the amount, the one with the lowest
+        (txid, output_index) is returned.
+        """
+        node = self.root
+        found = None
+        while node is not None:
+            if node.key[0] < amt:
+                node = node.right
+            else:
+                if node.key[0] == amt:
+                    found = node.key
+                node = node.left
+        if found is None:
+            return None
+        return _to_utxo(found)
+
+    def get_balance(self):
+        """Returns the total amount of the UTXOs in satoshis."""
+        if self.root is None:
+            return 0
+        return self.root.total
+
+    def get_utxos(self):
+        """Returns a list of the UTXOs in order of increasing amount."""
+        return list(self)
+
+    def get_utxo_vals(self):
+        """Returns a list of the UTXO amounts, largest first."""
+        return [key[0] for key in self._iter_keys(reverse=True)]
+
+    def _iter_keys(self, reverse=False):
+        """Yields the treap's keys in order."""
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.right if reverse else node.left
+            else:
+                node = stack.pop()
+                yield node.key
+                node = node.left if reverse else node.right
+
+    def __iter__(self):
+        for key in self._iter_keys():
+            yield _to_utxo(key)
+
+    def __len__(self):
+        if self.root is None:
+            return 0
+        return self.root.size
+
+    def __contains__(self, utxo):
+        return self._contains_key(_to_key(utxo))
+
+    def __repr__(self):
+        return "UTXOState(%d utxos, %d satoshis)" % (len(self),
+                                                     self.get_balance())
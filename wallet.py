@@ -1,17 +1,43 @@
 """Using cluster analysis, represents UTXO set of a wallet over time."""
 
+import collections
 from enum import IntEnum
 
 import http #http.py
 import bitcoind_rpc #bitcoind_rpc.py
-from satoshi_convert import float_to_satoshis #satoshi_convert.py
+import cache #cache.py
+import outpoint_index #outpoint_index.py
 
 ENABLE_DEBUG_PRINT = False
 
+#Save a snapshot of the UTXO set to disk after every this many transactions, so
+#   that `Wallet.snapshot_at` never needs to replay more than this many txs.
+CHECKPOINT_INTERVAL = 100 #Set to None to disable
+
+#Increment when the layout of checkpoints, or the UTXO sets replaying produces,
+#   change, so that checkpoints saved by earlier versions are ignored.
+CHECKPOINT_FORMAT = 1
+
+#Decode the wallet's transactions a whole block at a time with `getblock`
+#   rather than one at a time with `getrawtransaction`.
+USE_BULK_BLOCK_FETCH = False
+
+#Record the owner of each output seen in `outpoint_index.OUTPOINT_INDEX`, and
+#   consult it to classify foreign inputs and find the wallet's outputs.
+USE_OUTPOINT_INDEX = True
+
 class TransactionType(IntEnum):
     RECEIVE = 1
     SEND = 2
 
+#The changes to a wallet's UTXO set made by one step of iteration.
+#   added: UTXOs added to the set, in the order they were added.
+#   removed: UTXOs removed from the set that were present before the step.
+#   desired_spend: The desired spend of the send transaction about to be made,
+#       or None if the next transaction isn't a send.
+UTXODelta = collections.namedtuple('UTXODelta',
+                                   ['added', 'removed', 'desired_spend'])
+
 class OutputNotFoundError(Exception):
     """Could not locate an output we were looking for in a previous tx."""
     pass
@@ -38,14 +64,26 @@ class Wallet(object):
             send transaction is hit.
         wallet_label (str): The label designated for the wallet by the
             WalletExplorer.com API.
-        txs (List): The 'txs' section of the JSON object returned by calling
-            `json.loads` on WalletExplorer.com's API for /wallet.
+        txs (List[`http.WalletTx`]): The wallet's transactions from
+            WalletExplorer.com's API for /wallet, in chronological order.
         utxos (List): The current set of UTXOs for the wallet. Each UTXO is
             represented by a 3-tuple of (txid, output_index, amt_satoshis).
+        outpoints (Dict): Index of `utxos` keyed by (txid, output_index).
         tx_index (int): The current index of transactions as callers iterate
             through this object.
+        last_added_utxos (List): UTXOs added to the set by the most recently
+            processed transaction.
+        last_removed_utxos (List): UTXOs removed from the set by the most
+            recently processed transaction.
         conn (`RPCConnection`): A connetion object to the bitcoind RPC
             interface.
+        bulk_fetch (bool): Whether transactions are decoded a block at a time.
+        txids_by_height (Dict[int, Set[str]]): The wallet's txids in each block,
+            if `bulk_fetch` is set.
+        checkpoint_interval (Optional[int]): Number of transactions between
+            UTXO set checkpoints saved to the cache, or None if disabled.
+        outpoint_index (`outpoint_index.OutpointIndex`): Index of output
+            owners shared with other wallets, or None if disabled.
 
     Args:
         wallet_label (str): The name of the wallet you're iterating through.
@@ -54,6 +92,17 @@ class Wallet(object):
             before a new send transaction is hit. Set to False by default.
         max_txs_download (Optional[int]): If set, only the specified number of
             transactions will be downloaded at most.
+        checkpoint_interval (Optional[int]): Save a checkpoint of the UTXO set
+            to the cache after every this many transactions. Defaults to
+            `CHECKPOINT_INTERVAL`; set to None to disable.
+        conn (Optional[`RPCConnection`]): Connection to the bitcoind RPC
+            interface, e.g. one shared between wallets. A new connection is
+            created if omitted.
+        bulk_fetch (Optional[bool]): Decode the wallet's transactions with one
+            `getblock` call per block containing any of them. This works with
+            nodes that don't maintain a transaction index, except for the
+            previous transactions of inputs contributed by other wallets.
+            Defaults to `USE_BULK_BLOCK_FETCH`.
 
     Raises:
         http.WalletNotFoundError: Raised if not found at walletexplorer.com API.
@@ -61,31 +110,98 @@ class Wallet(object):
             in the wallet exceeds the specified `max_txs_download` param.
     """
     def __init__(self, wallet_label, iterate_until_send=False,
-                 max_txs_download=None):
+                 max_txs_download=None, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 conn=None, bulk_fetch=USE_BULK_BLOCK_FETCH):
         assert isinstance(iterate_until_send, bool)
         assert max_txs_download is None or isinstance(max_txs_download, int)
+        assert checkpoint_interval is None or checkpoint_interval > 0
         self.iterate_until_send = iterate_until_send
         self.wallet_label = wallet_label
         try:
-            self.txs = http.get_all_wallet_txs(wallet_label,
-                                               max_num_txs=max_txs_download)
+            self.txs = self.fetch_txs(max_txs_download)
         except http.WalletNotFoundError:
             raise
         except http.MaxTransactionsExceededError:
             raise
         dprint("Fetched %d transactions for %s" % (len(self.txs), wallet_label))
         self.utxos = []
+        self.outpoints = {}
         self.tx_index = 0 #incremented each time next_tx() is called
-        self.conn = bitcoind_rpc.RPCConnection()
+        self.last_added_utxos = []
+        self.last_removed_utxos = []
+        self.conn = conn
+        if self.conn is None:
+            self.conn = bitcoind_rpc.RPCConnection()
         self.max_txs_download = max_txs_download
+        self.checkpoint_interval = checkpoint_interval
+        self.bulk_fetch = bulk_fetch
+        self.outpoint_index = None
+        if USE_OUTPOINT_INDEX:
+            self.outpoint_index = outpoint_index.OUTPOINT_INDEX
+        self.txids_by_height = {}
+        if bulk_fetch:
+            for txn in self.txs:
+                if txn.block_height is not None:
+                    self.txids_by_height.setdefault(
+                        txn.block_height, set()).add(txn.txid)
+
+    def fetch_txs(self, max_txs_download):
+        """Download the wallet's transactions in chronological order."""
+        return http.get_all_wallet_txs(self.wallet_label,
+                                       max_num_txs=max_txs_download)
 
     def get_num_txs(self):
         """Returns the number of transactions for this wallet as integer."""
         return len(self.txs)
 
+    def add_utxos(self, utxos):
+        """Add UTXOs to the end of the wallet's current set.
+
+        UTXOs whose outpoint is already in the set are skipped, so that the
+        set and its outpoint index always agree.
+
+        Returns:
+            List[utxo]: The UTXOs that were added.
+        """
+        new_utxos = []
+        for utxo in utxos:
+            if utxo[:2] in self.outpoints:
+                print(("WARNING: Outpoint %s of %s is already in the UTXO set "
+                       "of wallet %s. It will be ignored.") %
+                      (str(utxo[:2]), str(utxo), self.wallet_label))
+                continue
+            self.outpoints[utxo[:2]] = utxo
+            new_utxos.append(utxo)
+        self.utxos.extend(new_utxos)
+        if self.outpoint_index is not None:
+            self.outpoint_index.add_utxos(new_utxos, self.wallet_label)
+        return new_utxos
+
+    def remove_utxo(self, utxo):
+        """Remove a UTXO from the wallet's current set.
+
+        Raises:
+            ValueError: If the UTXO is not in the set, in which case the set
+                is left unchanged.
+        """
+        if self.outpoints.get(utxo[:2]) != utxo:
+            raise ValueError
+        del self.outpoints[utxo[:2]]
+        self.utxos.remove(utxo)
+
+    def set_utxos(self, utxos):
+        """Replace the wallet's current set of UTXOs."""
+        self.utxos = []
+        self.outpoints = {}
+        self.add_utxos(utxos)
+
     def get_inputs(self, txid):
         """Get a list of inputs for the specified transaction.
 
+        Inputs spending one of the wallet's own UTXOs are resolved from its
+        outpoint index; only foreign inputs, such as those contributed by
+        other participants in a CoinJoin, require a call to the RPC interface.
+
         Returns:
             List of utxos as tuples of (txid, output_index, amt_in_satoshis).
         """
@@ -94,10 +210,12 @@ class Wallet(object):
         for vin in tx_rpc_json['vin']:
             input_prev_txid = vin['txid']
             input_prev_index = vin['vout']
-            input_rpc_json = self.conn.get_decoded_tx(input_prev_txid)
-            input_amt = input_rpc_json['vout'][input_prev_index]['value']
-            input_satoshis = float_to_satoshis(input_amt)
-            utxo = (input_prev_txid,input_prev_index, input_satoshis)
+            utxo = self.outpoints.get((input_prev_txid, input_prev_index))
+            if utxo is None:
+                input_rpc_json = self.conn.get_decoded_tx(input_prev_txid)
+                input_satoshis = (
+                    input_rpc_json['vout'][input_prev_index]['value'])
+                utxo = (input_prev_txid, input_prev_index, input_satoshis)
             inputs.append(utxo)
         return inputs
 
@@ -117,7 +235,7 @@ class Wallet(object):
         tx_rpc_json = self.conn.get_decoded_tx(txid)
         utxos = []
         for i, vout in enumerate(tx_rpc_json['vout']):
-            output_val = float_to_satoshis(vout['value'])
+            output_val = vout['value']
             if output_val not in amt_list:
                 utxo = (txid, i, output_val)
                 utxos.append(utxo)
@@ -130,13 +248,10 @@ class Wallet(object):
             int: The total desired spend implied by this sending transaction.
         """
         current_tx = self.txs[self.tx_index]
-        if current_tx['type'] != 'sent':
+        if current_tx.type != 'sent':
             dprint(str(current_tx))
             raise CurrentTxNotSendError
-        desired_spend = 0
-        for output in current_tx['outputs']:
-            desired_spend += float_to_satoshis(output['amount'])
-        return desired_spend
+        return sum(current_tx.output_amounts)
 
     def get_utxos(self, txid, output_amt):
         """Find outputs for specified tx sent to this wallet.
@@ -165,17 +280,15 @@ class Wallet(object):
         tx_rpc_json = self.conn.get_decoded_tx(txid)
         utxo = None
         for i, vout in enumerate(tx_rpc_json['vout']):
-            if float_to_satoshis(vout['value']) == output_amt:
+            if vout['value'] == output_amt:
                 if utxo is None:
                     utxo = (txid, i, output_amt)
                 else:
                     #resolve ambiguity as to which output is correct
-                    utxos = http.get_outputs_sent_to_wallet(txid,
-                                                            self.wallet_label)
-                    return utxos
+                    return self.get_outputs_sent_to_wallet(txid, tx_rpc_json)
         if utxo is None:
             #there may be multiple outputs that add up the specified amount
-            utxos = http.get_outputs_sent_to_wallet(txid, self.wallet_label)
+            utxos = self.get_outputs_sent_to_wallet(txid, tx_rpc_json)
             utxo_sum = 0
             for utxo in utxos:
                 utxo_sum += utxo[2]
@@ -186,6 +299,52 @@ class Wallet(object):
         else:
             return [utxo]
 
+    def get_outputs_sent_to_wallet(self, txid, tx_rpc_json):
+        """Find all outputs of the specified tx sent to this wallet.
+
+        The outpoint index answers this locally if it knows the owner of every
+        output. Otherwise, or if the index attributes none of the outputs to
+        this wallet, WalletExplorer.com's /tx API endpoint is used, and the
+        owners it lists are recorded in the index.
+
+        Returns:
+            List[utxos], with each utxo as a tuple of
+                (txid, output_index, amt_satoshis).
+        """
+        if self.outpoint_index is not None:
+            utxos = self.outpoint_index.get_outputs_sent_to_wallet(
+                txid, self.wallet_label,
+                [vout['value'] for vout in tx_rpc_json['vout']])
+            if utxos:
+                return utxos
+            self.outpoint_index.add_tx_json(txid, http.get_tx_data_json(txid))
+        return http.get_outputs_sent_to_wallet(txid, self.wallet_label)
+
+    def index_sent_outputs(self, txid, txn):
+        """Record the owners of the outputs of a send in the outpoint index.
+
+        An output paying the amount paid to a recipient is owned by that
+        recipient, and the rest are change owned by this wallet. Owners of
+        outputs of the same amount as more outputs than recipients were paid
+        are left unknown, since some of them may be change.
+        """
+        recipients = {}
+        for wallet_id, amt in zip(txn.output_wallet_ids, txn.output_amounts):
+            if recipients.get(amt, wallet_id) != wallet_id:
+                wallet_id = None #paid to several recipients; ambiguous
+            recipients[amt] = wallet_id
+        vout_amts = [vout['value']
+                     for vout in self.conn.get_decoded_tx(txid)['vout']]
+        owners = []
+        for amt in vout_amts:
+            if amt not in recipients:
+                owners.append(self.wallet_label)
+            elif vout_amts.count(amt) > txn.output_amounts.count(amt):
+                owners.append(None)
+            else:
+                owners.append(recipients[amt])
+        self.outpoint_index.add_outputs(txid, owners)
+
     def is_next_tx_send(self):
         """Returns whether the next transaction to be iterated is a send.
 
@@ -196,7 +355,7 @@ class Wallet(object):
         if self.tx_index == len(self.txs):
             return False
         next_txn = self.txs[self.tx_index]
-        return next_txn['type'] == 'sent'
+        return next_txn.type == 'sent'
 
     def next_tx(self):
         """Process the next transaction in this wallet.
@@ -209,45 +368,183 @@ class Wallet(object):
         txn = self.txs[self.tx_index]
 
         self.tx_index += 1
-
-        txid = txn['txid']
-        if txn['type'] == 'received':
-            amt = float_to_satoshis(txn['amount'])
-            utxos = self.get_utxos(txid, amt)
-            self.utxos.extend(utxos)
+        self.last_added_utxos = []
+        self.last_removed_utxos = []
+
+        txid = txn.txid
+        if (self.bulk_fetch and txn.block_height is not None and
+                txid not in bitcoind_rpc.DECODED_TX_CACHE):
+            num_cached = self.conn.get_decoded_txs_in_block(
+                txn.block_height,
+                tx_ids=self.txids_by_height[txn.block_height])
+            dprint("Bulk fetched %d txs from block %d" %
+                   (num_cached, txn.block_height))
+        if txn.type == 'received':
+            utxos = self.get_utxos(txid, txn.amount)
+            self.last_added_utxos = self.add_utxos(utxos)
+            self.save_checkpoint()
             return TransactionType.RECEIVE
-        elif txn['type'] == 'sent':
+        elif txn.type == 'sent':
             #remove inputs from utxos set
             inputs = self.get_inputs(txid)
             for tx_input in inputs:
                 dprint(("Attempting to delete this utxo from set due to send: "
                         "%s") % str(tx_input))
                 try:
-                    self.utxos.remove(tx_input)
+                    self.remove_utxo(tx_input)
                 except ValueError:
+                    owner = None
+                    if self.outpoint_index is not None:
+                        owner = self.outpoint_index.get_owner(tx_input[:2])
+                    if (owner is not None and
+                            not self.outpoint_index.is_owner(
+                                owner, self.wallet_label)):
+                        dprint(("Input %s of tx %s belongs to wallet %s, so "
+                                "this is a multi-party transaction.") %
+                               (str(tx_input), txid, owner))
+                        continue
                     print(("WARNING: Missing input %s from wallet %s in tx %s. "
                            "This indicates a bug in this program, incomplete "
                            "clustering analysis, or a multi-party transaction "
                            "such as a CoinJoin. This input will be ignored.") %
                           (str(tx_input), self.wallet_label, txid))
                     continue
+                self.last_removed_utxos.append(tx_input)
                 dprint("Deleted this utxo from set due to send: %s" %
                        str(tx_input))
+            if self.outpoint_index is not None:
+                self.outpoint_index.classify_inputs(
+                    txid, self.wallet_label, inputs, self.last_removed_utxos)
 
             #add change to utxo set, if any
-            spend_amts = []
-            for spend_output in txn['outputs']:
-                assert spend_output['wallet_id'] != self.wallet_label
-                spend_amt = float_to_satoshis(spend_output['amount'])
-                spend_amts.append(spend_amt)
-            change_utxos = self.get_utxos_mismatch_amt(txid, spend_amts)
+            assert self.wallet_label not in txn.output_wallet_ids
+            change_utxos = self.get_utxos_mismatch_amt(txid,
+                                                       txn.output_amounts)
             dprint("Adding these change utxos due to send: %s" %
                    str(change_utxos))
-            self.utxos.extend(change_utxos)
+            self.last_added_utxos = self.add_utxos(change_utxos)
+            if self.outpoint_index is not None:
+                self.index_sent_outputs(txid, txn)
+            self.save_checkpoint()
             return TransactionType.SEND
         else:
             raise TypeError
 
+    def get_checkpoint_path(self, tx_index):
+        """Returns the cache path of the checkpoint taken at `tx_index`."""
+        return cache.get_path('checkpoints', self.wallet_label,
+                              '%d.json' % tx_index)
+
+    def save_checkpoint(self):
+        """Save the current UTXO set to disk if a checkpoint is due."""
+        if (self.checkpoint_interval is None or self.tx_index == 0 or
+                self.tx_index % self.checkpoint_interval != 0):
+            return
+        checkpoint = {
+            'format': CHECKPOINT_FORMAT,
+            'tx_index': self.tx_index,
+            'last_txid': self.txs[self.tx_index - 1].txid,
+            'utxos': self.utxos
+        }
+        cache.save_json(self.get_checkpoint_path(self.tx_index), checkpoint)
+        dprint("Saved checkpoint at tx %d for %s" %
+               (self.tx_index, self.wallet_label))
+
+    def load_checkpoint(self, tx_index):
+        """Load the UTXO set checkpointed at `tx_index` from disk.
+
+        A checkpoint is only trusted if it was saved in the current
+        `CHECKPOINT_FORMAT`, and the transaction preceding it is the same as in
+        the currently downloaded history.
+
+        Returns:
+            List of utxos as tuples of (txid, output_index, amt_in_satoshis),
+            or None if no valid checkpoint exists at that index.
+        """
+        checkpoint = cache.load_json(self.get_checkpoint_path(tx_index))
+        if checkpoint is None:
+            return None
+        if (checkpoint.get('format') != CHECKPOINT_FORMAT or
+                checkpoint['tx_index'] != tx_index or
+                checkpoint['last_txid'] != self.txs[tx_index - 1].txid):
+            dprint("Ignoring stale checkpoint at tx %d for %s" %
+                   (tx_index, self.wallet_label))
+            return None
+        return [tuple(utxo) for utxo in checkpoint['utxos']]
+
+    def snapshot_at(self, tx_index):
+        """Get the UTXO set after the first `tx_index` transactions.
+
+        Resumes from the nearest checkpoint at or before `tx_index`, or from
+        the current position if that is closer, and replays the remaining
+        transactions. The wallet's iteration state is left at `tx_index`, so
+        callers may continue iterating from there.
+
+        Args:
+            tx_index (int): Number of transactions processed, from 0 (the empty
+                wallet) to `get_num_txs()` (the final UTXO set).
+
+        Returns:
+            List of utxos as tuples of (txid, output_index, amt_in_satoshis).
+        """
+        assert 0 <= tx_index <= len(self.txs)
+
+        start_index = 0
+        start_utxos = []
+        if self.checkpoint_interval is not None:
+            checkpoint_index = tx_index - tx_index % self.checkpoint_interval
+            while checkpoint_index > 0:
+                utxos = self.load_checkpoint(checkpoint_index)
+                if utxos is not None:
+                    start_index = checkpoint_index
+                    start_utxos = utxos
+                    break
+                checkpoint_index -= self.checkpoint_interval
+
+        if not start_index <= self.tx_index <= tx_index:
+            self.set_utxos(start_utxos)
+            self.tx_index = start_index
+            self.last_added_utxos = []
+            self.last_removed_utxos = []
+        dprint("Replaying txs %d through %d of %s" %
+               (self.tx_index, tx_index, self.wallet_label))
+        while self.tx_index < tx_index:
+            self.next_tx()
+        return list(self.utxos)
+
+    def iter_deltas(self):
+        """Iterate like `next`, but yield the changes made at each step.
+
+        Each step processes the same transactions as a call to `next`, so
+        applying the deltas in order to an empty set reproduces the UTXO sets
+        `next` would return. A UTXO added and spent within a step appears in
+        neither list. Unlike `next`, this never copies or returns the whole UTXO
+        set, so the cost of each step depends only on what changed.
+
+        Yields:
+            `UTXODelta`
+        """
+        while True:
+            added = collections.OrderedDict()
+            removed = []
+            while True:
+                if self.tx_index == len(self.txs):
+                    return
+                self.next_tx()
+                for utxo in self.last_removed_utxos:
+                    if utxo[:2] in added:
+                        del added[utxo[:2]]
+                    else:
+                        removed.append(utxo)
+                for utxo in self.last_added_utxos:
+                    added[utxo[:2]] = utxo
+                if not self.iterate_until_send or self.is_next_tx_send():
+                    break
+            desired_spend = None
+            if self.is_next_tx_send():
+                desired_spend = self.get_current_desired_spend()
+            yield UTXODelta(added.values(), removed, desired_spend)
+
     def __iter__(self):
         return self
 
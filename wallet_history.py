@@ -0,0 +1,258 @@
+"""Exports replayed wallet histories to a columnar file and reloads them.
+
+Replaying a `Wallet` costs many round trips to WalletExplorer.com and bitcoind.
+Once a wallet has been replayed, its transaction table and the log of UTXOs
+added and removed by each transaction can be written to disk with
+`export_wallet`, and any later analysis can rebuild every snapshot from that
+file with `WalletHistory` instead.
+
+File layout (all integers little-endian):
+
+    header:  magic (8 bytes), num_txs (uint32), num_events (uint32),
+             label_len (uint16), label (label_len bytes), padding to 8 bytes
+    tx table, one column after another:
+        txid (32 bytes each), block_height (int32), block_pos (int32),
+        tx_type (uint8, a `TransactionType` value), desired_spend (int64),
+        event_start (uint32, num_txs + 1 entries)
+    event log, one column after another:
+        is_add (uint8), txid (32 bytes each), output_index (uint32),
+        amt (int64)
+
+The events of transaction i are those in [event_start[i], event_start[i+1]),
+with removals listed before additions in the order `Wallet` applied them.
+Every column starts on an 8-byte boundary. The block height and position of a
+transaction that isn't in a block yet are stored as `NOT_IN_BLOCK`.
+"""
+import binascii
+import collections
+import mmap
+import struct
+import sys
+
+import cache #cache.py
+import http #http.py
+from wallet import Wallet, TransactionType #wallet.py
+
+ENABLE_DEBUG_PRINT = False
+
+MAGIC = 'WSHIST01'
+
+HEADER_FORMAT = '<8sIIH'
+
+#Stored as the block height and position of transactions not yet in a block
+NOT_IN_BLOCK = -1
+
+#(name, struct format of one element) for each column, in file order
+TX_COLUMNS = [('txid', '32s'), ('block_height', 'i'), ('block_pos', 'i'),
+              ('tx_type', 'B'), ('desired_spend', 'q'), ('event_start', 'I')]
+EVENT_COLUMNS = [('is_add', 'B'), ('ev_txid', '32s'),
+                 ('ev_output_index', 'I'), ('ev_amt', 'q')]
+
+def get_history_path(wallet_label):
+    """Returns the cache path of the exported history for a wallet."""
+    return cache.get_path('history', '%s.bin' % wallet_label)
+
+def _align(offset):
+    """Round `offset` up to the next 8-byte boundary."""
+    return (offset + 7) & ~7
+
+def _column_offsets(header_size, num_txs, num_events):
+    """Compute the file offset of every column.
+
+    Returns:
+        Dict mapping column name to (offset, element_format).
+    """
+    offsets = {}
+    offset = _align(header_size)
+    for name, fmt in TX_COLUMNS:
+        num_items = num_txs + 1 if name == 'event_start' else num_txs
+        offsets[name] = (offset, fmt)
+        offset = _align(offset + struct.calcsize('<' + fmt) * num_items)
+    for name, fmt in EVENT_COLUMNS:
+        offsets[name] = (offset, fmt)
+        offset = _align(offset + struct.calcsize('<' + fmt) * num_events)
+    return offsets
+
+def _to_column(block_value):
+    """Returns a block height or position as stored, mapping None."""
+    return NOT_IN_BLOCK if block_value is None else block_value
+
+def export_wallet(wallet, path):
+    """Replay a wallet from its first transaction and write it to `path`.
+
+    Args:
+        wallet (`Wallet`): A wallet that has not been iterated yet.
+        path (str): Destination file.
+    """
+    assert wallet.tx_index == 0
+    columns = collections.defaultdict(list)
+    num_txs = wallet.get_num_txs()
+    for i in range(0, num_txs):
+        txn = wallet.txs[i]
+        desired_spend = 0
+        if wallet.is_next_tx_send():
+            desired_spend = wallet.get_current_desired_spend()
+        columns['txid'].append(binascii.unhexlify(txn.txid))
+        columns['block_height'].append(_to_column(txn.block_height))
+        columns['block_pos'].append(_to_column(txn.block_pos))
+        columns['event_start'].append(len(columns['is_add']))
+        tx_type = wallet.next_tx()
+        columns['tx_type'].append(int(tx_type))
+        columns['desired_spend'].append(desired_spend)
+        events = ([(0, utxo) for utxo in wallet.last_removed_utxos] +
+                  [(1, utxo) for utxo in wallet.last_added_utxos])
+        for is_add, utxo in events:
+            columns['is_add'].append(is_add)
+            columns['ev_txid'].append(binascii.unhexlify(utxo[0]))
+            columns['ev_output_index'].append(utxo[1])
+            columns['ev_amt'].append(utxo[2])
+    columns['event_start'].append(len(columns['is_add']))
+    num_events = len(columns['is_add'])
+
+    label = wallet.wallet_label.encode('utf-8')
+    header = struct.pack(HEADER_FORMAT, MAGIC, num_txs, num_events,
+                         len(label)) + label
+    offsets = _column_offsets(len(header), num_txs, num_events)
+    with open(path, 'wb') as out_file:
+        out_file.write(header)
+        for name, _ in TX_COLUMNS + EVENT_COLUMNS:
+            offset, fmt = offsets[name]
+            out_file.write('\0' * (offset - out_file.tell()))
+            values = columns[name]
+            if fmt.endswith('s'):
+                out_file.write(''.join(values))
+            else:
+                out_file.write(struct.pack('<%d%s' % (len(values), fmt),
+                                           *values))
+    dprint("Exported %d txs and %d events for %s to %s" %
+           (num_txs, num_events, wallet.wallet_label, path))
+
+class WalletHistory(object):
+    """Read-only view over an exported wallet history.
+
+    The file is memory-mapped, and each value is decoded from the map only
+    when it's read, so opening a history is constant time regardless of its
+    size.
+
+    Attributes:
+        wallet_label (str): The label of the exported wallet.
+        num_txs (int): Number of transactions in the tx table.
+        num_events (int): Number of UTXO add/remove events in the log.
+
+    Args:
+        path (str): Location of a file written by `export_wallet`.
+
+    Raises:
+        ValueError: If the file is not an exported wallet history.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as history_file:
+            self._map = mmap.mmap(history_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        header_size = struct.calcsize(HEADER_FORMAT)
+        magic, num_txs, num_events, label_len = struct.unpack_from(
+            HEADER_FORMAT, self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not an exported wallet history" % path)
+        self.num_txs = num_txs
+        self.num_events = num_events
+        self.wallet_label = self._map[header_size:header_size + label_len]
+        self._columns = {}
+        for name, (offset, fmt) in _column_offsets(
+                header_size + label_len, num_txs, num_events).iteritems():
+            fmt = '<' + fmt
+            self._columns[name] = (offset, fmt, struct.calcsize(fmt))
+
+    def close(self):
+        """Release the memory map."""
+        self._map.close()
+
+    def get_num_txs(self):
+        """Returns the number of transactions for this wallet as integer."""
+        return self.num_txs
+
+    def get(self, column, index):
+        """Read one value of the named column."""
+        offset, fmt, size = self._columns[column]
+        return struct.unpack_from(fmt, self._map, offset + index * size)[0]
+
+    def get_block_height(self, index):
+        """Returns the block height of a transaction, or None if unknown."""
+        block_height = self.get('block_height', index)
+        return None if block_height == NOT_IN_BLOCK else block_height
+
+    def get_block_pos(self, index):
+        """Returns the position of a transaction in its block, or None."""
+        block_pos = self.get('block_pos', index)
+        return None if block_pos == NOT_IN_BLOCK else block_pos
+
+    def get_txid(self, index):
+        """Returns the hex txid of the transaction at `index`."""
+        return binascii.hexlify(self.get('txid', index))
+
+    def iter_events(self, tx_index):
+        """Yields the UTXO events of a transaction as (is_add, utxo)."""
+        for i in range(self.get('event_start', tx_index),
+                       self.get('event_start', tx_index + 1)):
+            utxo = (binascii.hexlify(self.get('ev_txid', i)),
+                    self.get('ev_output_index', i),
+                    self.get('ev_amt', i))
+            yield bool(self.get('is_add', i)), utxo
+
+    def iter_sends(self):
+        """Rebuild the UTXO set just before each send transaction.
+
+        Yields the same snapshots as iterating a `Wallet` created with
+        `iterate_until_send=True`.
+
+        Yields:
+            (int, List[utxo], int): The index of the send transaction about to
+                be made, the UTXO set, with each utxo as a tuple of
+                (txid, output_index, amt_satoshis), and the desired spend.
+        """
+        utxos = collections.OrderedDict()
+        num_processed_this_round = 0
+        for tx_index in range(0, self.num_txs):
+            if (self.get('tx_type', tx_index) == TransactionType.SEND and
+                    num_processed_this_round > 0):
+                yield (tx_index, utxos.values(),
+                       self.get('desired_spend', tx_index))
+                num_processed_this_round = 0
+            for is_add, utxo in self.iter_events(tx_index):
+                if is_add:
+                    utxos[utxo[:2]] = utxo
+                else:
+                    del utxos[utxo[:2]]
+            num_processed_this_round += 1
+
+    def iter_send_snapshots(self):
+        """Rebuild the UTXO set just before each send transaction.
+
+        Yields:
+            (List[utxo], int): The UTXO set and desired spend, as yielded by
+                `iter_sends`.
+        """
+        for _, utxos, desired_spend in self.iter_sends():
+            yield (utxos, desired_spend)
+
+def main():
+    """Export the history of each wallet label given on the command line."""
+    if len(sys.argv) < 2:
+        print "Usage: wallet_history.py wallet_label [wallet_label ...]"
+        sys.exit(1)
+    for wallet_label in sys.argv[1:]:
+        try:
+            export_wallet(Wallet(wallet_label=wallet_label),
+                          get_history_path(wallet_label))
+        except http.WalletNotFoundError:
+            print "Skipped %s because it's missing from API" % wallet_label
+            continue
+        print "Exported %s" % wallet_label
+
+def dprint(msg):
+    """Debug print statements."""
+    if ENABLE_DEBUG_PRINT:
+        print "DEBUG: %s" % msg
+
+if __name__ == '__main__':
+    main()